@@ -0,0 +1,210 @@
+"""
+Git by a bus as a library, for programs that want the results without
+running the driver's chain of stages and reading back their tsvs:
+
+    import api
+
+    summary = api.Summary(departed_devs=['alice'])
+    for fd in summary.tally(api.analyze(['/src/myrepo', '/src/monorepo/svc=svc'], bus_risks={'bob': 0.3})):
+        print fd.fname, fd.dev_risk
+    print summary.top('risk', 'dev')
+
+Everything is a generator of common.FileData, one file at a time:
+file_stats does what gen_file_stats.py does for git, with
+git_file_stats.gen_stats_multi, estimate_knowledge what
+estimate_unique_knowledge.py does, with the models in MODELS, and
+estimate_risks what estimate_file_risk.py does (with its
+estimate_file_risks), and analyze chains the three.  Nothing is
+written to disk (but the blame model's cache, and the knowledge memo
+with memo_dir), and nothing is read before it is asked for, so the
+first files come back while the history of the rest is still to be
+read.
+
+Reading the history chdirs into each repository, as the stage does.
+The working directory is put back whenever a file is handed over, but
+that makes analyses in more than one thread of a process step on each
+other; use processes for that.
+"""
+
+import os
+
+from optparse import Values
+
+from common import FileData, safe_author_name, safe_int, parse_path_project
+from gen_file_stats import compile_filters
+from estimate_unique_knowledge import MODELS, ESTIMATE_BATCH, BlameModel, memoized_estimate
+from estimate_file_risk import estimate_file_risks
+from knowledge_memo import KnowledgeMemo, MEMO_SIZE
+import git_file_stats
+import summarize
+
+GIT_EXE = '/usr/bin/env git'
+
+def parse_repos(repos):
+    """
+    [(root, project), ...] of repos: a path[=project] as on the
+    command line, or a list of those or of (root, project) tuples.
+    """
+    if isinstance(repos, basestring):
+        repos = [repos]
+    return [parse_path_project(repo, False) if isinstance(repo, basestring) else tuple(repo) for repo in repos]
+
+def ignore_skipped(project, skipped):
+    pass
+
+def file_stats(repos, interesting=None, not_interesting=None, case_sensitive=False, git_exe=GIT_EXE, max_size=None,
+               since=None, hunks=False, report_skipped=None):
+    """
+    Yields a FileData, with the fname, dev_experience and cnt_lines
+    filled in, for each interesting file of repos (see parse_repos).
+
+    interesting and not_interesting are lists of regular expressions as
+    for gen_file_stats.py -i and -n, and the rest are its options of
+    the same names.
+
+    Nothing is printed about the binary, generated, vendored and
+    oversized files skipped: report_skipped, if given, is called with
+    the project and {reason: count} of those of each project that has
+    any, and they are counted in metrics.counters either way.
+    """
+    interesting, not_interesting = compile_filters(interesting, not_interesting, case_sensitive)
+    options = Values({'git_exe': git_exe, 'max_size': max_size, 'since': since, 'hunks': hunks,
+                      'report_skipped': report_skipped or ignore_skipped})
+    cwd = os.getcwd()
+    try:
+        for line in git_file_stats.gen_stats_multi(parse_repos(repos), interesting, not_interesting, options):
+            here = os.getcwd()
+            os.chdir(cwd)
+            yield FileData(line)
+            os.chdir(here)
+    finally:
+        os.chdir(cwd)
+
+def estimate_knowledge(fds, model='sequential:0.1', repos=None, git_exe=GIT_EXE, cache_dir=None, jobs=4,
+                       memo_size=MEMO_SIZE, memo_dir=None):
+    """
+    Yields each of fds with its dev_uniq and tot_knowledge estimated by
+    model, given as for estimate_unique_knowledge.py --model, as
+    floats and an int, as they would be read back from the stage's
+    tsv.
+
+    The blame model needs the repos the files are from, and uses
+    git_exe, cache_dir (defaults to ~/.git_by_a_bus_cache) and jobs.
+    The estimates of files with the same history are memoized as
+    estimate_unique_knowledge.py does, see --memo-size and --memo-dir.
+    """
+    model = model.split(':')
+    if model[0] not in MODELS:
+        raise ValueError('Unknown model %s, the models are %s' % (model[0], ', '.join(sorted(MODELS.keys()))))
+    options = Values({'repos': parse_repos(repos or []), 'git_exe': git_exe, 'jobs': jobs,
+                      'cache_dir': cache_dir or os.path.join(os.path.expanduser('~'), '.git_by_a_bus_cache')})
+    spec = ':'.join(model)
+    knowledge_model = MODELS[model[0]](model[1:], options)
+    memo = None
+    if memo_size or memo_dir:
+        memo = KnowledgeMemo(max(memo_size, 2), memo_dir)
+    # only the blame model gains from batches, which it blames in
+    # parallel, the rest go a file at a time
+    batch_size = 1
+    if isinstance(knowledge_model, BlameModel):
+        batch_size = ESTIMATE_BATCH
+
+    def estimate_batch(batch):
+        for fd, (dev_uniq, tot_knowledge) in zip(batch, memoized_estimate(spec, knowledge_model, batch, memo)):
+            fd.dev_uniq = [(devs, float(uniq)) for devs, uniq in dev_uniq]
+            fd.tot_knowledge = safe_int(tot_knowledge)
+        return batch
+
+    try:
+        batch = []
+        for fd in fds:
+            batch.append(fd)
+            if len(batch) >= batch_size:
+                for estimated in estimate_batch(batch):
+                    yield estimated
+                batch = []
+        for estimated in estimate_batch(batch):
+            yield estimated
+    finally:
+        knowledge_model.close()
+        if memo:
+            memo.close()
+
+def estimate_risks(fds, bus_risks=None, def_bus_risk=0.1):
+    """
+    Yields a FileData for each of fds with its dev_risk estimated from
+    its dev_uniq, with the probability that each dev will be hit by a
+    bus from bus_risks ({dev: probability}) or else def_bus_risk.
+
+    The files go through estimate_file_risk.estimate_file_risks as
+    lines, as in the stage, so what comes back is what its tsv holds.
+    """
+    bus_risks = dict([(safe_author_name(dev), float(risk)) for dev, risk in (bus_risks or {}).items()])
+    lines = (fd.as_line() for fd in fds)
+    for line in estimate_file_risks(lines, bus_risks, float(def_bus_risk)):
+        yield FileData(line)
+
+def analyze(repos, interesting=None, not_interesting=None, model='sequential:0.1', bus_risks=None, def_bus_risk=0.1,
+            case_sensitive=False, git_exe=GIT_EXE, max_size=None, since=None, cache_dir=None, jobs=4,
+            memo_size=MEMO_SIZE, memo_dir=None, report_skipped=None):
+    """
+    Yields a FileData with everything filled in for each interesting
+    file of repos, as git_by_a_bus.py would write to
+    estimate_file_risk.tsv.  See file_stats, estimate_knowledge and
+    estimate_risks for the arguments.
+    """
+    # the positional model replays the hunks of each revision
+    hunks = model.split(':')[0] == 'positional'
+    fds = file_stats(repos, interesting, not_interesting, case_sensitive, git_exe, max_size, since, hunks,
+                     report_skipped)
+    fds = estimate_knowledge(fds, model, repos, git_exe, cache_dir, jobs, memo_size, memo_dir)
+    return estimate_risks(fds, bus_risks, def_bus_risk)
+
+# what Summary can total by
+SUMMARY_BY = {'dev': summarize.a_dev,
+              'project': summarize.a_project,
+              'file': summarize.a_fname}
+
+class Summary(object):
+    """
+    Running totals of FileData, as summarize.py makes them for its
+    pages, considering the devs in departed_devs to be hit by a bus.
+
+    The totals are by valtype ('unique knowledge', 'orphaned
+    knowledge', 'risk' and 'shared knowledge (devs still present)', by
+    pairs of devs) and by each of by, out of 'dev' (a dev or a group of
+    devs joined by ' and '), 'project' and 'file'.
+    """
+
+    def __init__(self, departed_devs=None, by=('dev', 'project')):
+        self.departed_devs = [safe_author_name(dev) for dev in departed_devs or []]
+        self.aggs = {}
+        for b in by:
+            summarize.create_agg(self.aggs, (summarize.a_valtype, SUMMARY_BY[b]))
+
+    def add(self, fd):
+        for dat in summarize.file_dats(fd, self.departed_devs):
+            summarize.agg_all(self.aggs, dat)
+
+    def tally(self, fds):
+        """
+        Yields each of fds, adding it to the totals on the way.
+        """
+        for fd in fds:
+            self.add(fd)
+            yield fd
+
+    def totals(self, valtype, by='dev'):
+        """
+        {name: total} of valtype by dev, project or file.
+        """
+        return dict(self.aggs[(summarize.a_valtype, SUMMARY_BY[by])].get(valtype, {}))
+
+    def top(self, valtype, by='dev', n=10):
+        """
+        [(name, total), ...] of the n largest totals of valtype by dev,
+        project or file, largest first.
+        """
+        totals = self.totals(valtype, by).items()
+        totals.sort(key=lambda (name, total): (-total, name))
+        return totals[:n]
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+Benchmark git by a bus on synthetic inputs.
+
+Builds a synthetic git repository (with git fast-import, so building
+it is cheap compared to analyzing it) and a file of pathological
+FileData lines (many authors taking turns churning the same lines,
+which is what makes the number of knowledge groups explode), then
+times each stage separately:
+
+* gen_file_stats.py on the synthetic repo
+
+* estimate_unique_knowledge.py, estimate_file_risk.py and summarize.py
+  on its output, and again on the pathological lines
+
+Each stage runs in its own process, like under git_by_a_bus.py, and
+we record its wall time, cpu time and peak RSS, plus the number of
+knowledge groups the estimate stage created.  Results are written as
+json, and with --compare are checked against a stored baseline, with
+any stage that got slower or bigger by more than --tolerance flagged
+as a regression.
+
+Run python benchmark.py -h for options.
+"""
+
+import sys
+import os
+import time
+import random
+import shutil
+import tempfile
+
+from optparse import OptionParser
+from subprocess import Popen, PIPE
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from common import FileData
+
+SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# timing differences smaller than this are noise, however big they
+# are relative to the baseline.
+NOISE_SECONDS = 0.05
+
+def exit_with_error(err):
+    print >> sys.stderr, "Error: " + err
+    sys.exit(1)
+
+def random_lines(rand, n):
+    return ['line %d %d\n' % (rand.randint(0, 1000000), i) for i in range(n)]
+
+def random_binary(rand, n):
+    # a NUL up front makes both git and us treat it as binary
+    return '\0' + ''.join([chr(rand.randint(0, 255)) for i in range(n)])
+
+def fast_import_file(out, path, content):
+    out.write('M 100644 inline %s\n' % path)
+    out.write('data %d\n%s\n' % (len(content), content))
+
+def gen_repo_stream(out, options):
+    """
+    Write a git fast-import stream for a synthetic repository to out.
+    """
+    rand = random.Random(options.seed)
+    authors = ['dev%d' % i for i in range(options.authors)]
+    when = 1000000000
+
+    def commit(author, msg):
+        out.write('commit refs/heads/master\n')
+        out.write('author %s <%s@example.com> %d +0000\n' % (author, author, when))
+        out.write('committer %s <%s@example.com> %d +0000\n' % (author, author, when))
+        out.write('data %d\n%s\n' % (len(msg), msg))
+
+    # path -> list of lines, or None for binary files
+    files = {}
+    commit(authors[0], 'initial')
+    for i in range(options.files):
+        d = 'dir%d/sub%d' % (i % 17, i % 5)
+        if rand.random() < options.binary_share:
+            path = '%s/blob%d.bin' % (d, i)
+            files[path] = None
+            fast_import_file(out, path, random_binary(rand, options.lines * 40))
+        else:
+            path = '%s/file%d.py' % (d, i)
+            files[path] = random_lines(rand, options.lines)
+            fast_import_file(out, path, ''.join(files[path]))
+
+    n_renames = 0
+    for c in range(options.commits):
+        when += 3600
+        commit(rand.choice(authors), 'change %d' % c)
+        paths = files.keys()
+        for path in rand.sample(paths, min(len(paths), rand.randint(1, 3))):
+            lines = files[path]
+            if lines is None:
+                fast_import_file(out, path, random_binary(rand, options.lines * 40))
+                continue
+            # delete a run of lines and add some new ones somewhere
+            start = rand.randint(0, len(lines))
+            del lines[start:start + rand.randint(0, 10)]
+            at = rand.randint(0, len(lines))
+            lines[at:at] = random_lines(rand, rand.randint(0, 12))
+            fast_import_file(out, path, ''.join(lines))
+        if rand.random() < options.rename_rate:
+            old = rand.choice(files.keys())
+            n_renames += 1
+            new = '%s/renamed%d_%s' % (os.path.dirname(old), n_renames, os.path.basename(old))
+            files[new] = files.pop(old)
+            out.write('R %s %s\n' % (old, new))
+    out.write('done\n')
+
+def gen_repo(repo, options):
+    os.mkdir(repo)
+    git = options.git_exe.split(' ')
+    Popen(git + ['init', '-q', repo]).communicate()
+    git_p = Popen(git + ['fast-import', '--quiet', '--done'], stdin=PIPE, cwd=repo)
+    gen_repo_stream(git_p.stdin, options)
+    git_p.stdin.close()
+    if git_p.wait() != 0:
+        exit_with_error("git fast-import failed")
+    # the gen stage counts lines in the working tree
+    Popen(git + ['checkout', '-q', '-f', 'master'], cwd=repo).communicate()
+
+def gen_pathological(fname, options):
+    """
+    Write FileData lines where many authors take turns churning the
+    same lines, so every revision shares knowledge into new groups.
+    """
+    rand = random.Random(options.seed)
+    authors = ['dev%d' % i for i in range(options.pathological_authors)]
+    fil = open(fname, 'w')
+    for i in range(options.pathological_files):
+        fd = FileData('pathological:file%d.py' % i)
+        exp = [(authors[0], 1000, 0)]
+        for r in range(options.pathological_revs):
+            churn = rand.randint(1, 100)
+            exp.append((authors[r % len(authors)], churn, churn + r % 2))
+        fd.dev_experience = exp
+        fd.cnt_lines = 1000
+        fil.write(fd.as_line() + '\n')
+    fil.close()
+
+def run_stage(cmd, input_fname, output_fname):
+    """
+    Run a single stage and return its timings.  os.wait4 gives us the
+    rusage of just this process, so peak RSS isn't muddled by other
+    stages.
+    """
+    input_f = None
+    if input_fname:
+        input_f = open(input_fname, 'r')
+    output_f = open(output_fname, 'w')
+    start = time.time()
+    cmd_p = Popen(cmd, stdin=input_f, stdout=output_f)
+    pid, status, rusage = os.wait4(cmd_p.pid, 0)
+    wall = time.time() - start
+    cmd_p.returncode = status
+    if input_f:
+        input_f.close()
+    output_f.close()
+    if status != 0:
+        exit_with_error("%s failed" % ' '.join(cmd))
+    # ru_maxrss is in kilobytes on linux, bytes on os x
+    peak_rss_kb = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss_kb /= 1024
+    return {'wall': wall,
+            'cpu': rusage.ru_utime + rusage.ru_stime,
+            'peak_rss_kb': peak_rss_kb}
+
+def best_of(repeat, f):
+    """
+    Run f repeat times and keep the fastest run, which is the one least
+    disturbed by whatever else the box was doing.
+    """
+    best = None
+    for i in range(repeat):
+        result = f()
+        if best is None or result['wall'] < best['wall']:
+            best = result
+    return best
+
+def count_groups(fname):
+    n_files = 0
+    n_groups = 0
+    max_groups = 0
+    fil = open(fname, 'r')
+    for line in fil:
+        fd = FileData(line)
+        n_files += 1
+        n_groups += len(fd.dev_uniq)
+        max_groups = max(max_groups, len(fd.dev_uniq))
+    fil.close()
+    return {'files': n_files, 'knowledge_groups': n_groups, 'max_groups_per_file': max_groups}
+
+def bench_chain(name, gen_fname, work_dir, options, stages, counts):
+    """
+    Time the estimate and summarize stages on the FileData lines in
+    gen_fname, adding results to stages and counts under name.
+    """
+    python = options.python_exe.split(' ')
+    uniq_fname = os.path.join(work_dir, '%s_estimate_unique_knowledge.tsv' % name)
+    risk_fname = os.path.join(work_dir, '%s_estimate_file_risk.tsv' % name)
+    summary_dir = os.path.join(work_dir, '%s_summary' % name)
+
+    stages['%s/estimate_unique_knowledge' % name] = best_of(options.repeat, lambda: \
+        run_stage(python + [os.path.join(SCRIPT_PATH, 'estimate_unique_knowledge.py'), '--model', options.model],
+                  gen_fname, uniq_fname))
+    counts[name] = count_groups(uniq_fname)
+
+    stages['%s/estimate_file_risk' % name] = best_of(options.repeat, lambda: \
+        run_stage(python + [os.path.join(SCRIPT_PATH, 'estimate_file_risk.py'), '-b', '0.1'],
+                  uniq_fname, risk_fname))
+
+    def summarize():
+        shutil.rmtree(summary_dir, True)
+        os.mkdir(summary_dir)
+        return run_stage(python + [os.path.join(SCRIPT_PATH, 'summarize.py'), summary_dir],
+                         risk_fname, os.path.join(work_dir, '%s_summarize.tsv' % name))
+    stages['%s/summarize' % name] = best_of(options.repeat, summarize)
+
+def bench(work_dir, options):
+    python = options.python_exe.split(' ')
+    stages = {}
+    counts = {}
+
+    repo = os.path.join(work_dir, 'repo')
+    start = time.time()
+    gen_repo(repo, options)
+    print >> sys.stderr, "Built synthetic repo in %.1fs" % (time.time() - start)
+
+    gen_fname = os.path.join(work_dir, 'gen_file_stats.tsv')
+    stages['synthetic/gen_file_stats'] = best_of(options.repeat, lambda: \
+        run_stage(python + [os.path.join(SCRIPT_PATH, 'gen_file_stats.py'),
+                            '--git-exe', options.git_exe, '-i', r'\.py$', '-i', r'\.bin$', '%s=synthetic' % repo],
+                  None, gen_fname))
+    bench_chain('synthetic', gen_fname, work_dir, options, stages, counts)
+
+    pathological_fname = os.path.join(work_dir, 'pathological.tsv')
+    gen_pathological(pathological_fname, options)
+    bench_chain('pathological', pathological_fname, work_dir, options, stages, counts)
+
+    params = dict([(k, getattr(options, k)) for k in ['files', 'lines', 'commits', 'authors', 'rename_rate',
+                                                      'binary_share', 'pathological_files', 'pathological_authors',
+                                                      'pathological_revs', 'model', 'seed', 'repeat']])
+    return {'params': params, 'stages': stages, 'counts': counts}
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of messages about stages that got slower or bigger
+    than baseline by more than tolerance (a fraction).
+    """
+    regressions = []
+    if results['params'] != baseline.get('params'):
+        print >> sys.stderr, "Warning: baseline was run with different parameters"
+    for stage, new in sorted(results['stages'].items()):
+        old = baseline.get('stages', {}).get(stage)
+        if not old:
+            continue
+        for measure in ['wall', 'cpu', 'peak_rss_kb']:
+            if measure != 'peak_rss_kb' and new[measure] - old[measure] < NOISE_SECONDS:
+                continue
+            if old[measure] and new[measure] > old[measure] * (1 + tolerance):
+                regressions.append("%s %s: %.2f -> %.2f (+%d%%)" % \
+                                   (stage, measure, old[measure], new[measure],
+                                    round(100 * (new[measure] / float(old[measure]) - 1))))
+    for name, new in sorted(results['counts'].items()):
+        old = baseline.get('counts', {}).get(name)
+        if old and old != new:
+            regressions.append("%s counts changed: %s -> %s" % (name, old, new))
+    return regressions
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('-o', '--output', dest='output', metavar='FILE',
+                      help='Write the results as json to FILE (defaults to stdout)')
+    parser.add_option('--compare', dest='compare', metavar='FILE',
+                      help='Compare against results stored in FILE, exit with an error if any stage regressed')
+    parser.add_option('--tolerance', dest='tolerance', metavar='FLOAT', type='float', default=0.2,
+                      help='Fraction a measure may grow over the baseline before it counts as a regression (defaults to 0.2)')
+    parser.add_option('--repeat', dest='repeat', metavar='N', type='int', default=1,
+                      help='Run each stage N times and keep the fastest (defaults to 1)')
+    parser.add_option('--files', dest='files', metavar='N', type='int', default=200,
+                      help='Number of files in the synthetic repo (defaults to 200)')
+    parser.add_option('--lines', dest='lines', metavar='N', type='int', default=100,
+                      help='Initial number of lines per file (defaults to 100)')
+    parser.add_option('--commits', dest='commits', metavar='N', type='int', default=500,
+                      help='History depth, the number of commits after the initial one (defaults to 500)')
+    parser.add_option('--authors', dest='authors', metavar='N', type='int', default=10,
+                      help='Number of authors in the synthetic repo (defaults to 10)')
+    parser.add_option('--rename-rate', dest='rename_rate', metavar='FLOAT', type='float', default=0.05,
+                      help='Probability that a commit renames a file (defaults to 0.05)')
+    parser.add_option('--binary-share', dest='binary_share', metavar='FLOAT', type='float', default=0.1,
+                      help='Fraction of files that are binary (defaults to 0.1)')
+    parser.add_option('--pathological-files', dest='pathological_files', metavar='N', type='int', default=20,
+                      help='Number of pathological FileData lines (defaults to 20)')
+    parser.add_option('--pathological-authors', dest='pathological_authors', metavar='N', type='int', default=10,
+                      help='Number of authors taking turns in each pathological line (defaults to 10)')
+    parser.add_option('--pathological-revs', dest='pathological_revs', metavar='N', type='int', default=200,
+                      help='Number of revisions in each pathological line (defaults to 200)')
+    parser.add_option('--model', dest='model', metavar='MODEL[:MARG1[:MARG2]...]', default='sequential:0.1',
+                      help='Knowledge model to benchmark (defaults to sequential:0.1)')
+    parser.add_option('--seed', dest='seed', type='int', default=42,
+                      help='Random seed for the synthetic inputs (defaults to 42)')
+    parser.add_option('--work-dir', dest='work_dir', metavar='DIRNAME',
+                      help='Keep the synthetic inputs and outputs in DIRNAME (must not exist) rather than a temp dir')
+    parser.add_option('--python-exe', dest='python_exe', default=sys.executable,
+                      help='Path to the python interpreter to run the stages with (defaults to this one)')
+    parser.add_option('--git-exe', dest='git_exe', default='/usr/bin/env git',
+                      help='Path to the git exe (defaults to "/usr/bin/env git")')
+
+    options, args = parser.parse_args()
+
+    work_dir = options.work_dir
+    if work_dir:
+        work_dir = os.path.abspath(work_dir)
+        os.mkdir(work_dir)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='gbab_bench')
+
+    try:
+        results = bench(work_dir, options)
+    finally:
+        if not options.work_dir:
+            shutil.rmtree(work_dir, True)
+
+    results_json = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        fil = open(options.output, 'w')
+        fil.write(results_json + '\n')
+        fil.close()
+    else:
+        print results_json
+
+    for stage, result in sorted(results['stages'].items()):
+        print >> sys.stderr, "%-45s %8.2fs wall %8.2fs cpu %8d KB peak RSS" % \
+              (stage, result['wall'], result['cpu'], result['peak_rss_kb'])
+
+    if options.compare:
+        fil = open(options.compare, 'r')
+        baseline = json.load(fil)
+        fil.close()
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            print >> sys.stderr, "Regressions against %s:" % options.compare
+            for r in regressions:
+                print >> sys.stderr, "  " + r
+            sys.exit(1)
+        print >> sys.stderr, "No regressions against %s" % options.compare
@@ -0,0 +1,92 @@
+"""
+On-disk cache of blame results for the blame knowledge model, so files
+that haven't changed since the last run cost nothing to estimate.
+
+Entries are keyed by the blob sha of the file at HEAD, its path and
+the last commit that touched it (see git_file_stats.git_blame_keys),
+and kept in cache_dir/blame_cache.tsv as lines of
+
+key<TAB>dev1:lines1,dev2:lines2,...
+
+New entries are appended as they are found, so an interrupted run
+keeps what it has done, and several runs can share a cache dir.
+
+The keys themselves take a walk back through the history to find, so
+the keys of every file of a repository (or a subdirectory of one) are
+kept too, in cache_dir/blame_keys.HASH.tsv, with the commit they were
+found at: a run at the same commit reads them back, and a run at a
+later one only walks the commits since (see
+git_file_stats.git_blame_keys).
+"""
+
+import os
+import hashlib
+
+from common import parse_dev_shared, dev_shared_to_str
+
+class BlameCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.fname = os.path.join(cache_dir, 'blame_cache.tsv')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.entries = {}
+        if os.path.isfile(self.fname):
+            fil = open(self.fname, 'r')
+            for line in fil:
+                fields = line.rstrip('\n').split('\t')
+                # a run that died mid-write can leave a broken last line
+                if len(fields) != 2:
+                    continue
+                self.entries[fields[0]] = fields[1]
+            fil.close()
+        self.fil = open(self.fname, 'a')
+
+    def key(self, path, blob_sha, last_commit):
+        return hashlib.sha1('\0'.join([blob_sha, path, last_commit or ''])).hexdigest()
+
+    def get(self, key):
+        """
+        Returns [(dev, lines), ...] for key, or None if not cached.
+        """
+        if key not in self.entries:
+            return None
+        return [(devs[0], int(lines)) for devs, lines in parse_dev_shared(self.entries[key], int)]
+
+    def put(self, key, dev_lines):
+        s = dev_shared_to_str([([dev], lines) for dev, lines in dev_lines])
+        self.entries[key] = s
+        self.fil.write('%s\t%s\n' % (key, s))
+
+    def keys_fname(self, top, subdir):
+        return os.path.join(self.cache_dir, 'blame_keys.%s.tsv' % hashlib.sha1('\0'.join([top, subdir])).hexdigest())
+
+    def get_keys(self, top, subdir):
+        """
+        (commit, {path: (blob sha, last commit)}) as saved by put_keys
+        for subdir of the git repository at top, or None.
+        """
+        fname = self.keys_fname(top, subdir)
+        if not os.path.isfile(fname):
+            return None
+        fil = open(fname, 'r')
+        commit = fil.readline().rstrip('\n')
+        path_keys = {}
+        for line in fil:
+            path, blob_sha, last_commit = line.rstrip('\n').split('\t')
+            path_keys[path] = (blob_sha, last_commit or None)
+        fil.close()
+        return commit, path_keys
+
+    def put_keys(self, top, subdir, commit, path_keys):
+        fname = self.keys_fname(top, subdir)
+        fil = open(fname + '.partial', 'w')
+        fil.write(commit + '\n')
+        for path, (blob_sha, last_commit) in path_keys.items():
+            fil.write('%s\t%s\t%s\n' % (path, blob_sha, last_commit or ''))
+        fil.close()
+        os.rename(fname + '.partial', fname)
+
+    def close(self):
+        self.fil.close()
@@ -2,6 +2,8 @@
 Common and other crappy code used throughout git by a bus.
 """
 
+import os
+
 def safe_author_name(author):
     if author:
         return author.replace(',', '_').replace(':', '_')
@@ -40,7 +42,47 @@ def parse_dev_exp_str(s, num_func):
         return []
     return [(dd[0], num_func(dd[1]), num_func(dd[2])) for dd in  [d.split(':') for d  in s.split(',')]]
 
-def dev_exp_to_str(devs):
+def parse_dev_exp_times(s):
+    """
+    Parse the commit times out of a dev experience string, if it has
+    them (dev:added:removed:time), else return [].
+    """
+    if not s:
+        return []
+    dds = [d.split(':') for d in s.split(',')]
+    if len(dds[0]) < 4:
+        return []
+    return [int(dd[3]) for dd in dds]
+
+def parse_hunks(s):
+    """
+    Parse the hunks of a revision, written by hunks_to_str as
+    start-removed+added, separated by /.
+    """
+    hunks = []
+    for h in s.split('/'):
+        start, rest = h.split('-', 1)
+        removed, added = rest.split('+', 1)
+        hunks.append((int(start), int(removed), int(added)))
+    return hunks
+
+def hunks_to_str(hunks):
+    return '/'.join(['%d-%d+%d' % h for h in hunks])
+
+def parse_dev_exp_hunks(s):
+    """
+    Parse the hunks of each revision out of a dev experience string,
+    if it has them (dev:added:removed:time:hunks), else return [].
+    """
+    if not s or s.split(',', 1)[0].count(':') < 4:
+        return []
+    return [parse_hunks(d.split(':')[4]) for d in s.split(',')]
+
+def dev_exp_to_str(devs, times=None, hunks=None):
+    if hunks:
+        return ','.join([':'.join([str(x) for x in d] + [str(t), hunks_to_str(h)]) for d, t, h in zip(devs, times, hunks)])
+    if times:
+        return ','.join([':'.join([str(x) for x in d] + [str(t)]) for d, t in zip(devs, times)])
     return ','.join([':'.join([str(x) for x in d]) for d in devs])
 
 def project_name(fname):
@@ -61,6 +103,14 @@ class FileData(object):
 
     dev_experience: [(dev, lines_added, lines_removed), ...]
 
+    exp_times: [commit_time, ...], the unix time of each revision in
+    dev_experience, or [] if unknown.
+
+    exp_hunks: [[(start, lines_removed, lines_added), ...], ...], the
+    hunks of each revision in dev_experience, or [] if they weren't
+    recorded (see gen_file_stats.py --hunks).  Only recorded along
+    with exp_times.
+
     dev_uniq: [([dev1], uniq_knowledge), ([dev1, dev2], uniq_knowledge), ...]
 
     dev_risk: [([dev1], risk), ([dev1, dev2], risk), ...]
@@ -84,6 +134,8 @@ class FileData(object):
         self.tot_knowledge = safe_int(tot_knowledge)
         
         self.dev_experience = parse_dev_exp_str(dev_experience, int)
+        self.exp_times = parse_dev_exp_times(dev_experience)
+        self.exp_hunks = parse_dev_exp_hunks(dev_experience)
         self.dev_uniq = parse_dev_shared(dev_uniq, float)
         self.dev_risk = parse_dev_shared(dev_risk, float)
 
@@ -92,7 +144,7 @@ class FileData(object):
     def as_line(self):
         return '\t'.join(map(safe_str, [self.fname,
                                         self.cnt_lines,
-                                        dev_exp_to_str(self.dev_experience),
+                                        dev_exp_to_str(self.dev_experience, self.exp_times, self.exp_hunks),
                                         self.tot_knowledge,
                                         dev_shared_to_str(self.dev_uniq),
                                         dev_shared_to_str(self.dev_risk)]))
@@ -125,3 +177,24 @@ def parse_departed_devs(dd_file, departed_devs):
         departed_devs.append(line)
     fil.close()
 
+def parse_path_project(path_project, use_svn):
+    """
+    Parse a path[=project] argument into a (root, project) tuple.
+    """
+    path_project = path_project.split('=')
+
+    # handle symlinked directories, which git doesn't like.
+    # but don't use them for svn.
+    if not use_svn:
+        root = os.path.realpath(path_project[0])
+    else:
+        root = path_project[0]
+
+    if len(path_project) > 1:
+        project = path_project[1]
+    else:
+        # if they don't specify a project name, use the last piece of
+        # the root.
+        project = os.path.split(root)[1]
+
+    return root, project
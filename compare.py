@@ -0,0 +1,206 @@
+"""
+Compare the results of two runs, e.g. last week's and this week's
+estimate_file_risk.tsv, to see what got riskier:
+
+python compare.py --html changes.html last_week/estimate_file_risk.tsv output/estimate_file_risk.tsv > changes.tsv
+
+Prints kind<TAB>name<TAB>valtype<TAB>old<TAB>new<TAB>change for every
+file, dev (or group of devs) and project whose unique knowledge,
+orphaned knowledge or risk changed by more than --threshold, the files
+as they come and then the devs and projects.  With --html, also writes
+a page of the largest changes of each.
+
+Neither run is loaded whole: both are sorted by fname with bounded
+memory (see external_sort.py) and walked side by side, keeping only
+the totals per dev and project and the largest changes per file.
+
+Run python compare.py -h for options.
+"""
+
+import sys
+import heapq
+
+from optparse import OptionParser
+
+from common import parse_departed_devs
+from external_sort import sort_lines, BUFFER_SIZE
+from tsv_index import line_fname
+import summarize
+import stage_io
+
+# the values compared, as summarize.py names them
+VALTYPES = summarize.DIR_VALTYPES
+
+def merge_join(old_lines, new_lines):
+    """
+    Given the lines of two runs sorted by fname, yields (old_line,
+    new_line) for each fname in either, with None for the run it isn't
+    in.
+    """
+    old_lines = iter(old_lines)
+    new_lines = iter(new_lines)
+    old_line = next(old_lines, None)
+    new_line = next(new_lines, None)
+    while old_line is not None or new_line is not None:
+        if new_line is None or (old_line is not None and line_fname(old_line) < line_fname(new_line)):
+            yield old_line, None
+            old_line = next(old_lines, None)
+        elif old_line is None or line_fname(new_line) < line_fname(old_line):
+            yield None, new_line
+            new_line = next(new_lines, None)
+        else:
+            yield old_line, new_line
+            old_line = next(old_lines, None)
+            new_line = next(new_lines, None)
+
+def file_vals(line, departed_devs):
+    """
+    {valtype: {dev: val}} of the FileData line, totalled the way
+    summarize.py does, or {} for no line.
+    """
+    if line is None:
+        return {}
+    path = (summarize.a_valtype, summarize.a_dev)
+    return summarize.summarize([line], departed_devs, [path])[path]
+
+def add_vals(totals, name, vals, i):
+    """
+    Add vals ({valtype: val}) to the old (i = 0) or new (i = 1) totals
+    of name in totals ({valtype: {name: [old, new]}}).
+    """
+    for valtype, val in vals.items():
+        old_new = totals.setdefault(valtype, {}).setdefault(name, [0, 0])
+        old_new[i] += val
+
+def changed(old, new, threshold):
+    return abs(round(new - old)) > threshold
+
+class Movers(object):
+    """
+    The top files by how much each valtype changed, either way.
+    """
+
+    def __init__(self, top):
+        self.top = top
+        # valtype -> heap of (abs(change), fname, old, new)
+        self.heaps = dict([(valtype, []) for valtype in VALTYPES])
+
+    def add(self, valtype, fname, old, new):
+        heap = self.heaps[valtype]
+        item = (abs(new - old), fname, old, new)
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def largest(self, valtype):
+        """
+        [(fname, old, new), ...], largest change first.
+        """
+        return [(fname, old, new) for change, fname, old, new in sorted(self.heaps[valtype], reverse=True)]
+
+def compare(old_lines, new_lines, departed_devs, threshold, top, out):
+    """
+    Compare the FileData lines of two runs, sorted by fname, writing
+    the changes of each file to out as they come.
+
+    Returns (movers, devs, projects): the Movers of the files, and the
+    totals by valtype of each dev and project, as {valtype: {name:
+    [old, new]}}.
+    """
+    movers = Movers(top)
+    devs = {}
+    projects = {}
+    for old_line, new_line in merge_join(old_lines, new_lines):
+        old_vals = file_vals(old_line, departed_devs)
+        if new_line == old_line:
+            new_vals = old_vals
+        else:
+            new_vals = file_vals(new_line, departed_devs)
+        fname = line_fname(old_line or new_line)
+        project = fname.split(':', 1)[0]
+        for i, vals in [(0, old_vals), (1, new_vals)]:
+            for valtype in VALTYPES:
+                dev_vals = vals.get(valtype, {})
+                for dev, val in dev_vals.items():
+                    add_vals(devs, dev, {valtype: val}, i)
+                add_vals(projects, project, {valtype: sum(dev_vals.values())}, i)
+        if new_line == old_line:
+            continue
+        for valtype in VALTYPES:
+            old = sum(old_vals.get(valtype, {}).values())
+            new = sum(new_vals.get(valtype, {}).values())
+            movers.add(valtype, fname, old, new)
+            if changed(old, new, threshold):
+                print >> out, "file\t%s\t%s\t%.1f\t%.1f\t%+.1f" % (fname, valtype, old, new, new - old)
+    return movers, devs, projects
+
+def print_totals(kind, totals, threshold, out):
+    for valtype in VALTYPES:
+        for name, (old, new) in sorted(totals.get(valtype, {}).items()):
+            if changed(old, new, threshold):
+                print >> out, "%s\t%s\t%s\t%.1f\t%.1f\t%+.1f" % (kind, name, valtype, old, new, new - old)
+
+def largest_totals(totals, valtype, top):
+    changes = [(abs(new - old), name, old, new) for name, (old, new) in totals.get(valtype, {}).items()]
+    changes.sort(reverse=True)
+    return [(name, old, new) for change, name, old, new in changes[:top]]
+
+def changes_html(valtype, noun, changes, threshold):
+    html = []
+    html.append("<h3>%s with the largest change in estimated %s</h3>" % (noun, valtype))
+    html.append("<table>")
+    html.append("<tr><th>%s</th><th>Before</th><th>After</th><th>Change</th></tr>" % noun)
+    for name, old, new in changes:
+        if changed(old, new, threshold):
+            html.append("<tr><td>%s</td><td>%d</td><td>%d</td><td>%+d</td></tr>" % \
+                        (name, int(round(old)), int(round(new)), int(round(new)) - int(round(old))))
+    html.append("</table>")
+    return html
+
+def compare_html(old_name, new_name, movers, devs, projects, threshold, top):
+    html = []
+    html.append("<html>\n<head><title>Git By a Bus Changes</title></head>\n<body>")
+    html.append("<h1>Git by a Bus Changes</h1>")
+    html.append("<p>From %s to %s.</p>" % (old_name, new_name))
+    html.append('<p>Note: changes of %d or less have been left out as noise.</p>' % threshold)
+    for valtype in VALTYPES:
+        html.extend(changes_html(valtype, 'Projects', largest_totals(projects, valtype, top), threshold))
+        html.extend(changes_html(valtype, 'Devs', largest_totals(devs, valtype, top), threshold))
+        html.extend(changes_html(valtype, 'Files', movers.largest(valtype), threshold))
+    html.append("</body>\n</html>")
+    return html
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] OLD_TSV NEW_TSV")
+    parser.add_option('-d', '--departed-dev-file', dest='departed_dev_file', metavar='FILE',
+                      help='File listing departed devs, one per line')
+    parser.add_option('--threshold', dest='threshold', metavar='N', type='int', default=summarize.GLOBAL_CUTOFF,
+                      help='Leave out changes of N or less (defaults to %d, as in the summary)' % summarize.GLOBAL_CUTOFF)
+    parser.add_option('--html', dest='html', metavar='FILE',
+                      help='Also write a page of the largest changes to FILE')
+    parser.add_option('--top', dest='top', metavar='N', type='int', default=100,
+                      help='Number of files, devs and projects to list for each value on the --html page (defaults to 100)')
+    parser.add_option('--buffer-size', dest='buffer_size', metavar='MB', type='int', default=BUFFER_SIZE >> 20,
+                      help='Sort at most about MB megabytes of each run in memory, spilling the rest to temporary files ' + \
+                      '(defaults to %d)' % (BUFFER_SIZE >> 20))
+    parser.add_option('--tmp-dir', dest='tmp_dir', metavar='DIRNAME',
+                      help='Where to spill the sorted runs (defaults to the system\'s temporary directory)')
+    options, args = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error('You must pass the tsvs of the old and the new run.')
+
+    departed_devs = []
+    if options.departed_dev_file:
+        parse_departed_devs(options.departed_dev_file, departed_devs)
+
+    old_lines, new_lines = [sort_lines((line for line in stage_io.file_lines(fname) if line.strip()),
+                                       options.buffer_size << 20, options.tmp_dir)
+                            for fname in args]
+    movers, devs, projects = compare(old_lines, new_lines, departed_devs, options.threshold, options.top, sys.stdout)
+    print_totals('dev', devs, options.threshold, sys.stdout)
+    print_totals('project', projects, options.threshold, sys.stdout)
+    if options.html:
+        summarize.write_page(options.html, compare_html(args[0], args[1], movers, devs, projects,
+                                                        options.threshold, options.top))
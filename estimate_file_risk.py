@@ -7,12 +7,21 @@ Note that for joint probabilities we assume that probs are independent
 that any pair or more of devs will all be hit by a bus, so these
 calculations are extra iffy for friends, lovers, conjoined twins, or
 carpoolers.
+
+With --snapshot-dir, also estimates the risk for each knowledge
+snapshot estimate_unique_knowledge.py wrote there, writing
+DATE.risk.tsv next to each DATE.tsv.
 """
 
 import sys
+import os
+import re
 import optparse
 
 from common import FileData, safe_author_name
+import metrics
+import profiling
+import stage_io
 
 def get_bus_risk(dev, bus_risks, def_risk):
     if dev not in bus_risks:
@@ -20,7 +29,7 @@ def get_bus_risk(dev, bus_risks, def_risk):
     else:
         return bus_risks[dev]
 
-def estimate_file_risks(lines, bus_risks, def_bus_risk):
+def file_dev_risk(fd, bus_risks, def_bus_risk):
     """
     Estimate the risk in the file as:
 
@@ -29,18 +38,44 @@ def estimate_file_risks(lines, bus_risks, def_bus_risk):
 
     We use a simple joint probability and assume that all bus killings
     are independently likely.
+
+    Returns the dev_risk of fd, the risk of each group in fd.dev_uniq.
+    """
+    dev_risk = []
+    for devs, shared in fd.dev_uniq:
+        risk = shared
+        for dev in devs:
+            risk = float(risk) * get_bus_risk(dev, bus_risks, def_bus_risk)
+        dev_risk.append((devs, risk))
+    return dev_risk
+
+def estimate_file_risks(lines, bus_risks, def_bus_risk):
+    """
+    Fill in the risk of each FileData line, see file_dev_risk.
     """
     for line in lines:
         fd = FileData(line)
-        dev_risk = []
-        for devs, shared in fd.dev_uniq:
-            risk = shared
-            for dev in devs:
-                risk = float(risk) * get_bus_risk(dev, bus_risks, def_bus_risk)
-            dev_risk.append((devs, risk))
-        fd.dev_risk = dev_risk
+        fd.dev_risk = file_dev_risk(fd, bus_risks, def_bus_risk)
+        metrics.incr('files_risk_estimated')
         yield fd.as_line()
 
+# knowledge snapshots written by estimate_unique_knowledge.py
+SNAPSHOT_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})\.tsv$')
+
+def estimate_snapshot_risks(snapshot_dir, bus_risks, def_bus_risk):
+    for snapshot in sorted(os.listdir(snapshot_dir)):
+        m = SNAPSHOT_RE.match(snapshot)
+        if not m:
+            continue
+        risk_fname = os.path.join(snapshot_dir, m.group(1) + '.risk.tsv')
+        in_f = open(os.path.join(snapshot_dir, snapshot), 'r')
+        out_f = open(risk_fname + '.partial', 'w')
+        for line in estimate_file_risks(in_f, bus_risks, def_bus_risk):
+            out_f.write(line + '\n')
+        in_f.close()
+        out_f.close()
+        os.rename(risk_fname + '.partial', risk_fname)
+
 def parse_risk_file(risk_file, bus_risks):
     risk_f = open(risk_file, 'r')
     for line in risk_f:
@@ -58,11 +93,28 @@ if __name__ == '__main__':
                       help='The estimated probability that a dev will be hit by a bus in your analysis timeframe')
     parser.add_option('-r', '--risk-file', dest='risk_file', metavar='FILE',
                       help='File of dev=float lines (e.g. ejorgensen=0.4) with dev bus likelihoods')
+    parser.add_option('--snapshot-dir', dest='snapshot_dir', metavar='DIRNAME',
+                      help='Also estimate the risk for the knowledge snapshots in DIRNAME (see estimate_unique_knowledge.py --snapshots)')
+    parser.add_option('--metrics', dest='metrics', metavar='FILE',
+                      help='Write counters about the run as json to FILE')
+    parser.add_option('--profile', dest='profile', metavar='DIRNAME',
+                      help='Profile this stage, writing estimate_file_risk.pstats, estimate_file_risk.collapsed.txt and estimate_file_risk.profile.txt into DIRNAME')
     options, args = parser.parse_args()
 
+    if options.profile:
+        profiling.start('estimate_file_risk', options.profile)
+
     bus_risks = {}
     if options.risk_file:
         parse_risk_file(options.risk_file, bus_risks)
     
-    for line in estimate_file_risks(sys.stdin, bus_risks, float(options.bus_risk)):
+    for line in estimate_file_risks(stage_io.input_lines(sys.stdin), bus_risks, float(options.bus_risk)):
         print line
+
+    if options.snapshot_dir:
+        estimate_snapshot_risks(options.snapshot_dir, bus_risks, float(options.bus_risk))
+
+    profiling.stop()
+
+    if options.metrics:
+        metrics.write(options.metrics)
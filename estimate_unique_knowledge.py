@@ -21,15 +21,60 @@ for each revision in the log:
   authored the revision.  Take (churn - new_knowledge) lines of
   knowledge proportionally from all knowledge that dev doesn't share
   and move it to a shared account.
+
+With --snapshots, the same replay also records the knowledge as it
+stood at each snapshot date, writing a FileData tsv per date into the
+snapshot dir (snapshot_dir/YYYY-MM-DD.tsv), for estimate_file_risk.py
+and summarize.py to turn into trends.  This needs the commit times
+that gen_file_stats.py records for git.  Only the files that exist
+now have a history to replay, so the snapshots leave out files
+deleted since, and the totals of past dates come out low.
+
+The blame model (--model blame) instead measures who owns the lines
+that exist today: a dev's unique knowledge of a file is the number of
+its lines at HEAD that git blame says they last changed.  It needs
+the path[=project] arguments gen_file_stats.py was run with, runs at
+most --jobs blames at once and caches them in --cache-dir, keyed by
+blob sha, path and the last commit to touch the path, so unchanged
+files cost nothing on later runs.
+
+The sequential model spreads the lines a revision removes over
+everyone who knows the file.  The positional model (--model
+positional[:knowledge_churn_constant]) instead keeps track of which
+lines each group of devs knows, by replaying the hunks of each revision
+onto the file, so removing lines only takes knowledge from those who
+knew them, and churned lines are shared with whoever knew them before.
+It needs the hunks gen_file_stats.py records with --hunks.
+
+Models are looked up by name in MODELS.  --model can be repeated to
+calibrate several models, or churn constants, against a single read of
+the input: each FileData is parsed once and estimated by every model,
+and each model's output goes to its own tsv in --model-dir.
+
+Files with the same dev experience get the same estimate, so the
+sequential model's estimates are memoized (see knowledge_memo.py),
+also across runs with --memo-dir.
 """
 
 import sys
+import os
 import math
 import copy
+import time
+import calendar
+import bisect
 
 from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
 
-from common import FileData
+from common import FileData, parse_path_project
+from blame_cache import BlameCache
+from knowledge_memo import KnowledgeMemo, MEMO_SIZE
+from line_intervals import LineIntervals
+import git_file_stats
+import metrics
+import profiling
+import stage_io
 
 def sequential_create_knowledge(dev_uniq, dev, adjustment):
     """
@@ -88,7 +133,10 @@ def sequential_distribute_shared_knowledge(dev, shared_knowledge, tot_knowledge,
         if dev not in shared_key_exploded:
             sequential_share_knowledge_group(dev, shared_key_exploded, pct_to_share, dev_uniq)
 
-def sequential_estimate_uniq(fd, knowledge_churn_constant):
+def sequential_snapshot(dev_uniq, tot_knowledge):
+    return [(shared_key.split('\0'), shared) for shared_key, shared in dev_uniq.items()], int(tot_knowledge)
+
+def sequential_estimate_uniq(fd, knowledge_churn_constant, cut_times=None, snapshots=None):
     """
     Estimate the amounts of unique knowledge for each developer who
     has made changes to the path represented by this FileData, using a
@@ -98,11 +146,30 @@ def sequential_estimate_uniq(fd, knowledge_churn_constant):
     Returns a list of [([dev1, dev2...], knowledge), ...], indicating
     the knowledge shared uniquely by the group of devs in the first
     field (there may be only dev in the list or many)
+
+    If cut_times (sorted unix times) are given, also appends
+    (cut_time, dev_uniq, tot_knowledge, cnt_lines) to snapshots for
+    each cut time the file existed at, with the knowledge and number
+    of lines as of that time.  The lines are fd.cnt_lines less those
+    the revisions after the cut added.
     """
     tot_knowledge = 0
     dev_uniq = {}
+    cut_times = cut_times or []
+    next_cut = 0
+    # lines added less lines removed, so far
+    net_lines = 0
+    # [(cut_time, dev_uniq, tot_knowledge, net_lines), ...]
+    cuts = []
 
-    for dev, added, deleted in fd.dev_experience:
+    for i, (dev, added, deleted) in enumerate(fd.dev_experience):
+        if cut_times:
+            while next_cut < len(cut_times) and cut_times[next_cut] < fd.exp_times[i]:
+                # before the first revision the file didn't exist yet
+                if i:
+                    cuts.append((cut_times[next_cut],) + sequential_snapshot(dev_uniq, tot_knowledge) +
+                                (net_lines,))
+                next_cut += 1
         adjustment = added - deleted
         if adjustment > 0:
             sequential_create_knowledge(dev_uniq, dev, adjustment)
@@ -115,37 +182,470 @@ def sequential_estimate_uniq(fd, knowledge_churn_constant):
             sequential_distribute_shared_knowledge(dev, shared_knowledge, tot_knowledge, dev_uniq)
             sequential_create_knowledge(dev_uniq, dev, new_knowledge)            
         tot_knowledge += adjustment + (churn * knowledge_churn_constant)
+        net_lines += adjustment
+
+    if fd.dev_experience:
+        for cut_time in cut_times[next_cut:]:
+            cuts.append((cut_time,) + sequential_snapshot(dev_uniq, tot_knowledge) + (net_lines,))
+    for cut_time, snap_uniq, snap_knowledge, cut_net_lines in cuts:
+        cnt_lines = fd.cnt_lines
+        if cnt_lines is not None:
+            cnt_lines = max(0, cnt_lines - (net_lines - cut_net_lines))
+        snapshots.append((cut_time, snap_uniq, snap_knowledge, cnt_lines))
 
-    dev_uniq = [(shared_key.split('\0'), shared) for shared_key, shared in dev_uniq.items()]
-    
-    return dev_uniq, int(tot_knowledge)
+    return sequential_snapshot(dev_uniq, tot_knowledge)
  
-def sequential(lines, model_args):
+class SequentialModel(object):
+    """
+    The sequential model, see the description in the file docs.  Its
+    one argument is the knowledge_churn_constant.
+
+    If options.snapshot_writer is set, also writes the FileData as of
+    each of its snapshot dates to it.
+    """
+
+    def __init__(self, model_args, options):
+        self.knowledge_churn_constant = float(model_args[0])
+        self.snapshot_writer = getattr(options, 'snapshot_writer', None)
+        # the estimate only depends on the dev experience, unless
+        # there are snapshots to write along the way
+        self.memoizable = self.snapshot_writer is None
+
+    def estimate(self, fds):
+        """
+        Returns [(dev_uniq, tot_knowledge), ...] for each of fds.
+        """
+        results = []
+        for fd in fds:
+            cut_times = None
+            snapshots = []
+            if self.snapshot_writer:
+                cut_times = self.snapshot_writer.cut_times_for(fd)
+            dev_uniq, tot_knowledge = sequential_estimate_uniq(fd, self.knowledge_churn_constant, cut_times, snapshots)
+            for cut_time, snap_uniq, snap_knowledge, snap_lines in snapshots:
+                self.snapshot_writer.write(cut_time, fd, snap_uniq, snap_knowledge, snap_lines)
+            results.append((dev_uniq, tot_knowledge))
+        return results
+
+    def close(self):
+        pass
+
+def positional_churn(mix, dev, knowledge_churn_constant):
+    """
+    Who knows a line that was known as mix, ((shared_key, share), ...),
+    once dev has changed it: knowledge_churn_constant of it is new
+    knowledge of dev's, and the rest is shared by dev with whoever
+    knew the line before.
+    """
+    churned = {dev: knowledge_churn_constant}
+    for shared_key, share in mix:
+        shared_key_exploded = shared_key.split('\0')
+        if dev not in shared_key_exploded:
+            shared_key_exploded.append(dev)
+            shared_key_exploded.sort()
+        new_shared_key = '\0'.join(shared_key_exploded)
+        churned[new_shared_key] = churned.get(new_shared_key, 0) + share * (1 - knowledge_churn_constant)
+    return tuple(sorted([(shared_key, share) for shared_key, share in churned.items() if share]))
+
+def positional_estimate_uniq(fd, knowledge_churn_constant):
     """
-    Entry point for the sequential algorithm.
+    Estimate the unique knowledge of each group of devs by replaying
+    the hunks of each revision onto the lines of the file: added lines
+    are known only by the dev who added them, removed lines take what
+    was known about them away with them, and lines replaced by a hunk
+    (the first min(added, removed) of them) are churned, see
+    positional_churn.
 
-    See the description in the file docs.
+    Each line is worth one line of knowledge, split between the groups
+    that know it, so tot_knowledge is the number of lines the hunks
+    leave.  Returns the same as sequential_estimate_uniq.
+    """
+    if fd.dev_experience and not fd.exp_hunks:
+        print >> sys.stderr, "Error: no hunks for %s, the positional model needs a gen_file_stats.tsv from --hunks" % fd.fname
+        sys.exit(1)
+    lines = LineIntervals()
+    # (mix, dev) -> churned mix, most lines are churned the same way as
+    # their neighbours
+    churned = {}
+    for (dev, added, deleted), hunks in zip(fd.dev_experience, fd.exp_hunks):
+        own = ((dev, 1),)
+        # lines added less lines removed by the hunks so far, since
+        # git gives the line numbers from before the revision
+        shift = 0
+        for start, n_removed, n_added in hunks:
+            # git counts from 1, and gives the line before the
+            # insertion when a hunk removes nothing
+            pos = start + shift
+            if n_removed:
+                pos -= 1
+            def churn_segments(removed):
+                new_segments = []
+                churn = n_added
+                for length, mix in removed:
+                    length = min(length, churn)
+                    if not length:
+                        break
+                    if (mix, dev) not in churned:
+                        churned[(mix, dev)] = positional_churn(mix, dev, knowledge_churn_constant)
+                    new_segments.append((length, churned[(mix, dev)]))
+                    churn -= length
+                new_segments.append((churn, own))
+                return new_segments
+            shift += n_added - lines.replace(pos, n_removed, churn_segments)
+
+    dev_uniq = {}
+    for length, mix in lines.segments():
+        for shared_key, share in mix:
+            dev_uniq[shared_key] = dev_uniq.get(shared_key, 0) + length * share
+    return [(shared_key.split('\0'), uniq) for shared_key, uniq in sorted(dev_uniq.items())], len(lines)
+
+class PositionalModel(object):
+    """
+    The positional model, see the description in the file docs.  Its
+    one argument is the knowledge_churn_constant, 0.1 if not given.
+    """
+
+    # the hunks are part of the memo key
+    memoizable = True
+
+    def __init__(self, model_args, options):
+        self.knowledge_churn_constant = float((model_args or ['0.1'])[0])
+
+    def estimate(self, fds):
+        """
+        Returns [(dev_uniq, tot_knowledge), ...] for each of fds.
+        """
+        return [positional_estimate_uniq(fd, self.knowledge_churn_constant) for fd in fds]
+
+    def close(self):
+        pass
 
-    Yields FileData objects as tsv lines, with dev_uniq and
-    tot_knowledge fields filled in.
+class BlameModel(object):
     """
-    knowledge_churn_constant = float(model_args[0])
+    The blame model, see the description in the file docs.  Uses
+    options.repos ([(root, project), ...]), options.cache_dir,
+    options.jobs and options.git_exe.
+    """
+
+    # blames have their own cache, keyed by the file rather than its
+    # history
+    memoizable = False
+
+    def __init__(self, model_args, options):
+        self.options = options
+        self.roots = dict([(project, root) for root, project in options.repos])
+        self.cache = BlameCache(options.cache_dir)
+        self.pool = ThreadPool(options.jobs)
+        # project -> (git root, {path: (blob sha, last commit)})
+        self.project_keys = {}
+
+    def blame_file(self, job):
+        path, top = job
+        return git_file_stats.git_blame_owners(path, self.options.git_exe, top)
+
+    def estimate(self, fds):
+        """
+        Returns [(dev_uniq, tot_knowledge), ...] for each of fds.
+        """
+        jobs = []
+        keys = []
+        # index into jobs of the blame for each of fds, None if cached
+        job_indexes = []
+        # key -> index into jobs, so files shared by several projects
+        # are blamed once
+        pending = {}
+        for fd in fds:
+            path = fd.fname.split(':', 1)[1]
+            if fd.project not in self.project_keys:
+                if fd.project not in self.roots:
+                    print >> sys.stderr, "Error: no path given for project %s, the blame model needs one" % fd.project
+                    sys.exit(1)
+                self.project_keys[fd.project] = blame_keys(self.roots[fd.project], self.options.git_exe, self.cache)
+            top, path_keys = self.project_keys[fd.project]
+            key = None
+            if path in path_keys:
+                key = self.cache.key(path, *path_keys[path])
+            keys.append(key)
+            job_index = None
+            if self.cache.get(key) is None:
+                job_index = pending.get(key)
+                if job_index is None:
+                    job_index = len(jobs)
+                    jobs.append((path, top))
+                    if key:
+                        pending[key] = job_index
+            job_indexes.append(job_index)
+
+        # blame whatever isn't cached, at most options.jobs at a time
+        blamed = self.pool.map(self.blame_file, jobs)
+        metrics.incr('files_blamed', len(jobs))
+        results = []
+        for fd, key, job_index in zip(fds, keys, job_indexes):
+            if job_index is None:
+                dev_lines = self.cache.get(key)
+                metrics.incr('blame_cache_hits')
+            else:
+                dev_lines = blamed[job_index]
+                if key and self.cache.get(key) is None:
+                    self.cache.put(key, dev_lines)
+            results.append(([([dev], lines) for dev, lines in dev_lines], sum([lines for dev, lines in dev_lines])))
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.cache.close()
+
+# model name -> class, each taking (model_args, options) and
+# estimating a list of FileData at a time.  Models whose estimates only
+# depend on the dev experience say so with memoizable.
+MODELS = {'sequential': SequentialModel,
+          'positional': PositionalModel,
+          'blame': BlameModel}
+
+# number of files to read before handing them to the models, which
+# lets the blame model run its blames in parallel
+ESTIMATE_BATCH = 1000
+
+def model_fname(model_dir, spec):
+    return os.path.join(model_dir, 'estimate_unique_knowledge.%s.tsv' % spec.replace(':', '_'))
+
+def memoized_estimate(spec, model, fds, memo):
+    """
+    model.estimate(fds), only running the model for the files memo
+    doesn't already have an estimate for.
+    """
+    if memo is None or not model.memoizable:
+        return model.estimate(fds)
+    results = []
+    for fd in fds:
+        key = memo.key(spec, fd)
+        result = memo.get(key)
+        if result is None:
+            result = model.estimate([fd])[0]
+            memo.put(key, result)
+        results.append(result)
+    return results
+
+def estimate(lines, specs, models, outs, memo=None):
+    """
+    Parse each FileData in lines once, estimate it with every one of
+    models (run as specs) and write it, with dev_uniq and
+    tot_knowledge filled in, as a tsv line to each of the files in the
+    matching outs.
+    """
+    def estimate_batch(fds):
+        for spec, model, model_outs in zip(specs, models, outs):
+            for fd, (dev_uniq, tot_knowledge) in zip(fds, memoized_estimate(spec, model, fds, memo)):
+                fd.dev_uniq = dev_uniq
+                fd.tot_knowledge = tot_knowledge
+                line = fd.as_line() + '\n'
+                for out in model_outs:
+                    out.write(line)
+                metrics.incr('knowledge_groups', len(dev_uniq))
+                metrics.high('max_knowledge_groups_per_file', len(dev_uniq))
+        metrics.incr('files_estimated', len(fds))
+
+    batch = []
     for line in lines:
-        fd = FileData(line)
-        dev_uniq, tot_knowledge = sequential_estimate_uniq(fd, knowledge_churn_constant)
-        fd.dev_uniq = dev_uniq
-        fd.tot_knowledge = tot_knowledge
-        yield fd.as_line()
+        batch.append(FileData(line))
+        if len(batch) >= ESTIMATE_BATCH:
+            estimate_batch(batch)
+            batch = []
+    if batch:
+        estimate_batch(batch)
+
+def blame_keys(root, git_exe, cache):
+    """
+    Returns (git root, {path: (blob sha, last commit)}) for the files
+    under root, with paths relative to the git root like
+    gen_file_stats.py writes them.
+
+    The keys are kept in cache (a BlameCache) along with HEAD, so they
+    are only looked for again in the commits since the last run.
+    """
+    git_cmd = [x for x in git_exe.split(' ') if x]
+    top = git_file_stats.git_output(git_cmd + ['rev-parse', '--show-toplevel'], cwd=root).strip()
+    head = git_file_stats.git_output(git_cmd + ['rev-parse', 'HEAD'], cwd=top).strip()
+    subdir = os.path.relpath(root, top)
+    if subdir == os.curdir:
+        subdir = ''
+    saved = cache.get_keys(top, subdir)
+    if saved and saved[0] == head:
+        metrics.incr('blame_keys_cached')
+        return top, saved[1]
+    if saved and not git_file_stats.git_is_ancestor(saved[0], head, git_exe, top):
+        saved = None
+    path_keys = git_file_stats.git_blame_keys(git_exe, top, subdir, saved)
+    cache.put_keys(top, subdir, head, path_keys)
+    return top, path_keys
+
+def parse_date(s):
+    """
+    The unix time of the start (UTC) of a YYYY-MM-DD date.
+    """
+    return calendar.timegm(time.strptime(s, '%Y-%m-%d'))
+
+def monthly_cut_times(until):
+    """
+    The start of every month from 1970 up to until.
+    """
+    cut_times = []
+    year, month = 1970, 2
+    while True:
+        cut_time = calendar.timegm((year, month, 1, 0, 0, 0))
+        if cut_time > until:
+            return cut_times
+        cut_times.append(cut_time)
+        year, month = year + month / 12, month % 12 + 1
+
+class SnapshotWriter(object):
+    """
+    Writes the knowledge as of each snapshot date, one
+    snapshot_dir/YYYY-MM-DD.tsv of FileData lines per date.
+
+    spec is either 'monthly', for the start of every month up to now,
+    or a comma separated list of YYYY-MM-DD dates.  A snapshot at a
+    date holds the knowledge from the revisions committed before it.
+
+    Only the files that exist now are in the snapshots, so files
+    deleted since a date are missing from it.
+    """
+
+    def __init__(self, snapshot_dir, spec):
+        self.snapshot_dir = snapshot_dir
+        self.monthly = spec == 'monthly'
+        if self.monthly:
+            self.cut_times = monthly_cut_times(time.time())
+        else:
+            self.cut_times = sorted([parse_date(d.strip()) for d in spec.split(',') if d.strip()])
+        # cut time -> open .partial file
+        self.fils = {}
+        if not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir)
+
+    def cut_times_for(self, fd):
+        if fd.dev_experience and not fd.exp_times:
+            print >> sys.stderr, "Error: no commit times for %s, snapshots need a gen_file_stats.tsv from git" % fd.fname
+            sys.exit(1)
+        if not fd.exp_times:
+            return []
+        # skip the months before the file existed, explicit dates are
+        # few enough to just pass them all
+        if self.monthly:
+            return self.cut_times[bisect.bisect_left(self.cut_times, fd.exp_times[0]):]
+        return self.cut_times
+
+    def fname_for(self, cut_time):
+        return os.path.join(self.snapshot_dir, time.strftime('%Y-%m-%d', time.gmtime(cut_time)) + '.tsv')
+
+    def write(self, cut_time, fd, dev_uniq, tot_knowledge, cnt_lines):
+        if cut_time not in self.fils:
+            self.fils[cut_time] = open(self.fname_for(cut_time) + '.partial', 'w')
+        snap_fd = FileData(fd.fname)
+        snap_fd.cnt_lines = cnt_lines
+        snap_fd.dev_uniq = dev_uniq
+        snap_fd.tot_knowledge = tot_knowledge
+        self.fils[cut_time].write(snap_fd.as_line() + '\n')
+        metrics.incr('snapshot_lines')
+
+    def close(self):
+        for cut_time, fil in self.fils.items():
+            fil.close()
+            os.rename(self.fname_for(cut_time) + '.partial', self.fname_for(cut_time))
+        metrics.incr('snapshots_written', len(self.fils))
 
 if __name__ == '__main__':
     parser = OptionParser()
-    parser.add_option('--model', dest='model', metavar='MODEL[:MARG1[:MARG2]...]', default="sequential:0.1",
-                      help='Knowledge model to use, with arguments.')
+    parser.add_option('--model', dest='models', metavar='MODEL[:MARG1[:MARG2]...]', action='append',
+                      help='Knowledge model to use, with arguments (defaults to sequential:0.1).  Repeat to run several ' + \
+                      'models over a single read of the input, see --model-dir')
+    parser.add_option('--model-dir', dest='model_dir', metavar='DIRNAME',
+                      help='Write the output of each model to DIRNAME/estimate_unique_knowledge.MODEL_MARG1....tsv; ' + \
+                      'the first model also goes to stdout')
+    parser.add_option('--memo-size', dest='memo_size', metavar='N', type='int', default=MEMO_SIZE,
+                      help='Number of estimates to keep in memory for files with the same history (defaults to %d, 0 to not memoize)' % MEMO_SIZE)
+    parser.add_option('--memo-dir', dest='memo_dir', metavar='DIRNAME',
+                      help='Also keep the estimates in DIRNAME/knowledge_memo.db for later runs')
+    parser.add_option('--metrics', dest='metrics', metavar='FILE',
+                      help='Write counters about the run as json to FILE')
+    parser.add_option('--profile', dest='profile', metavar='DIRNAME',
+                      help='Profile this stage, writing estimate_unique_knowledge.pstats, estimate_unique_knowledge.collapsed.txt and estimate_unique_knowledge.profile.txt into DIRNAME')
+    parser.add_option('--snapshots', dest='snapshots', metavar='monthly|DATE[,DATE...]',
+                      help='Also write the knowledge as of the start of every month, or of each YYYY-MM-DD date, into --snapshot-dir')
+    parser.add_option('--snapshot-dir', dest='snapshot_dir', metavar='DIRNAME',
+                      help='Directory for the --snapshots tsvs, one DATE.tsv per snapshot')
+    parser.add_option('--cache-dir', dest='cache_dir', metavar='DIRNAME',
+                      default=os.path.join(os.path.expanduser('~'), '.git_by_a_bus_cache'),
+                      help='Where the blame model caches blames (defaults to ~/.git_by_a_bus_cache)')
+    parser.add_option('--jobs', dest='jobs', metavar='N', type='int', default=4,
+                      help='Number of blames the blame model runs at once (defaults to 4)')
+    parser.add_option('--git-exe', dest='git_exe', default='/usr/bin/env git',
+                      help='Path to the git exe (defaults to "/usr/bin/env git")')
+    parser.set_usage("usage: %prog [options] [git_controlled_path1[=project_name1] ...]\n\n" + \
+                     "Reads FileData lines on stdin.  The paths are only needed for the blame model.")
     options, args = parser.parse_args()
 
-    model = options.model.split(':')
-    model_func = locals()[model[0]]
-    model_args = model[1:]
-    
-    for line in model_func(sys.stdin, model_args):
-        print line
+    if options.snapshots and not options.snapshot_dir:
+        parser.error('--snapshots needs --snapshot-dir')
+
+    options.repos = [parse_path_project(arg, False) for arg in args]
+
+    if options.profile:
+        profiling.start('estimate_unique_knowledge', options.profile)
+
+    specs = options.models or ['sequential:0.1']
+    if len(specs) > 1 and not options.model_dir:
+        parser.error('Running several models needs --model-dir')
+    for spec in specs:
+        if spec.split(':')[0] not in MODELS:
+            parser.error('Unknown model %s, the models are %s' % (spec, ', '.join(sorted(MODELS.keys()))))
+
+    if options.snapshots and specs[0].split(':')[0] != 'sequential':
+        parser.error('--snapshots is only supported by the sequential model')
+
+    options.snapshot_writer = None
+    if options.snapshots:
+        options.snapshot_writer = SnapshotWriter(options.snapshot_dir, options.snapshots)
+
+    models = []
+    outs = []
+    for i, spec in enumerate(specs):
+        model_options = options
+        if i:
+            # the snapshots are of the first model only
+            model_options = copy.copy(options)
+            model_options.snapshot_writer = None
+        model = spec.split(':')
+        models.append(MODELS[model[0]](model[1:], model_options))
+        model_outs = []
+        if not i:
+            model_outs.append(sys.stdout)
+        if options.model_dir:
+            if not os.path.isdir(options.model_dir):
+                os.makedirs(options.model_dir)
+            model_outs.append(open(model_fname(options.model_dir, spec) + '.partial', 'w'))
+        outs.append(model_outs)
+
+    memo = None
+    if options.memo_size or options.memo_dir:
+        memo = KnowledgeMemo(max(options.memo_size, 2), options.memo_dir)
+
+    estimate(stage_io.input_lines(sys.stdin), specs, models, outs, memo)
+
+    for model in models:
+        model.close()
+    if memo:
+        memo.close()
+        print >> sys.stderr, "Knowledge memo: %d hits (%d from disk), %d misses" % (memo.hits, memo.disk_hits, memo.misses)
+    if options.model_dir:
+        for spec, model_outs in zip(specs, outs):
+            model_outs[-1].close()
+            os.rename(model_fname(options.model_dir, spec) + '.partial', model_fname(options.model_dir, spec))
+
+    if options.snapshot_writer:
+        options.snapshot_writer.close()
+
+    profiling.stop()
+
+    if options.metrics:
+        metrics.write(options.metrics)
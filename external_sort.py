@@ -0,0 +1,147 @@
+"""
+Sorting and summing more than fits in memory, for compare.py and
+summarize.py --memory-budget.
+
+sort_lines reads its lines into a buffer of about buffer_size bytes,
+sorts each buffer full and spills it to a temporary file (a run), then
+merges the runs with heapq.merge, so only a line of each run is held
+at once.  Lines that fit in a single buffer are sorted without
+touching the disk.
+
+The lines are sorted as they are, which for FileData lines is by fname,
+since the tab after it sorts before anything in a file name.
+
+ExternalSums does the same for sums by key: values are added up in a
+dict until it holds about budget bytes, which is then spilled as a run
+of key<TAB>sum lines sorted by key, and the runs are merged, adding up
+the sums of the same key as they come out together.
+"""
+
+import heapq
+import tempfile
+
+import metrics
+
+# bytes of lines to sort in memory at a time
+BUFFER_SIZE = 64 << 20
+
+# what python spends on a str besides its characters, roughly
+STR_OVERHEAD = 40
+
+def write_run(lines, tmp_dir):
+    """
+    Write the sorted lines to a temporary file, which goes away when
+    closed, and return it ready to read back.
+    """
+    fil = tempfile.TemporaryFile(prefix='gbab_sort', dir=tmp_dir)
+    fil.writelines(lines)
+    fil.seek(0)
+    metrics.incr('sort_runs_spilled')
+    return fil
+
+def sort_lines(lines, buffer_size=BUFFER_SIZE, tmp_dir=None):
+    """
+    Yields lines sorted, spilling runs into tmp_dir (the system's
+    temporary directory by default) when there are more than
+    buffer_size bytes of them.  Every line yielded ends with a
+    newline.
+    """
+    runs = []
+    buf = []
+    size = 0
+    try:
+        for line in lines:
+            if not line.endswith('\n'):
+                line += '\n'
+            buf.append(line)
+            size += len(line) + STR_OVERHEAD
+            if size >= buffer_size:
+                buf.sort()
+                runs.append(write_run(buf, tmp_dir))
+                buf = []
+                size = 0
+        buf.sort()
+        if not runs:
+            for line in buf:
+                yield line
+            return
+        if buf:
+            runs.append(write_run(buf, tmp_dir))
+            buf = []
+        for line in heapq.merge(*runs):
+            yield line
+    finally:
+        for run in runs:
+            run.close()
+
+# what a dict entry and its key and value cost besides the characters
+# of the key, roughly
+ENTRY_OVERHEAD = 120
+
+def parse_sum(s):
+    """
+    A sum back as an int if it was written as one, else a float.
+    """
+    if s.lstrip('-').isdigit():
+        return int(s)
+    return float(s)
+
+class ExternalSums(object):
+    """
+    Sums of values by key, a tuple of strs without tabs or newlines in
+    them, kept in at most about budget bytes of memory.
+    """
+
+    def __init__(self, budget, tmp_dir=None):
+        self.budget = budget
+        self.tmp_dir = tmp_dir
+        self.sums = {}
+        self.size = 0
+        self.runs = []
+
+    def add(self, key, val):
+        key = '\0'.join(key)
+        if key in self.sums:
+            self.sums[key] += val
+            return
+        self.sums[key] = val
+        self.size += len(key) + ENTRY_OVERHEAD
+        if self.size >= self.budget:
+            self.spill()
+
+    def sorted_lines(self):
+        keys = self.sums.keys()
+        keys.sort()
+        for key in keys:
+            yield '%s\t%r\n' % (key, self.sums[key])
+
+    def spill(self):
+        self.runs.append(write_run(self.sorted_lines(), self.tmp_dir))
+        self.sums = {}
+        self.size = 0
+
+    def items(self):
+        """
+        Yields (key, sum) for every key, in order of key, then closes
+        the runs, so it can only be done once.
+        """
+        # keys are joined by NULs, which sort before anything in them,
+        # so all the lines of a key come out of the merge together
+        last_key = None
+        total = 0
+        try:
+            for line in heapq.merge(self.sorted_lines(), *self.runs):
+                key, val = line.rstrip('\n').rsplit('\t', 1)
+                if key != last_key:
+                    if last_key is not None:
+                        yield tuple(last_key.split('\0')), total
+                    last_key = key
+                    total = 0
+                total += parse_sum(val)
+            if last_key is not None:
+                yield tuple(last_key.split('\0')), total
+        finally:
+            self.sums = {}
+            for run in self.runs:
+                run.close()
+            self.runs = []
@@ -0,0 +1,197 @@
+"""
+Filter engine for deciding which paths are interesting, shared by the
+git and svn gen_stats backends.
+
+The interesting and not_interesting regular expressions are combined
+into single alternation regexes, so each path costs at most two
+searches no matter how many patterns were passed.
+
+Where the patterns allow it, some of the work is pushed further up:
+
+* interesting patterns that are all anchored literal directories
+  (e.g. ^svc-a/ ^lib/) are turned into pathspecs for git ls-tree, so
+  git never lists the rest of the tree.  This only happens for
+  case-sensitive matching since pathspecs are case-sensitive, and
+  ls-tree does not support glob or :(exclude) magic, so nothing else
+  can be pushed down.
+
+* not_interesting patterns that are literal directories
+  (e.g. /vendor/ ^third_party/) prune the whole directory as soon as
+  the first path under it is seen, so the rest of the paths in it are
+  dropped with a single startswith.
+"""
+
+import re
+
+# regexp metacharacters, if none of these appear (unescaped) the
+# pattern matches literally.
+META_CHARS = '.^$*+?{}[]()|\\'
+
+# escapes that still match a single literal character.
+LITERAL_ESCAPES = '.-/_ ^$*+?{}[]()|\\'
+
+def literal_pattern(pattern):
+    """
+    If pattern matches only a literal string, return a tuple of
+    (anchored, literal), where anchored is True if the pattern has to
+    match at the start of the path.  Otherwise returns None.
+    """
+    anchored = False
+    if pattern.startswith('^'):
+        anchored = True
+        pattern = pattern[1:]
+    literal = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1] not in LITERAL_ESCAPES:
+                return None
+            literal.append(pattern[i + 1])
+            i += 2
+            continue
+        if c in META_CHARS:
+            return None
+        literal.append(c)
+        i += 1
+    if not literal:
+        return None
+    return anchored, ''.join(literal)
+
+def can_combine(regexes):
+    """
+    Patterns with backreferences, named groups (which can't be defined
+    twice in one regex) or inline global flags change meaning or don't
+    compile when wrapped into a bigger alternation, so those are
+    matched one by one.
+    """
+    for r in regexes:
+        if re.search(r'\\[1-9]|\(\?P[=<]|\(\?[iLmsux]+\)', r.pattern):
+            return False
+    return len(set([r.flags for r in regexes])) <= 1
+
+def combine(regexes):
+    """
+    Compile a list of compiled regexes into a single alternation
+    regex, or return None if there are no regexes.
+    """
+    if not regexes:
+        return None
+    return re.compile('|'.join(['(?:%s)' % r.pattern for r in regexes]), regexes[0].flags)
+
+class AnyOf(object):
+    """
+    Fallback for patterns that can't be combined, with the same search
+    interface as a compiled regex.
+    """
+
+    def __init__(self, regexes):
+        self.regexes = regexes
+
+    def search(self, s):
+        for r in self.regexes:
+            m = r.search(s)
+            if m:
+                return m
+        return None
+
+def matcher(regexes):
+    if not regexes:
+        return None
+    if can_combine(regexes):
+        return combine(regexes)
+    return AnyOf(regexes)
+
+class FileFilter(object):
+    """
+    Decides which paths are interesting.
+
+    interesting: compiled regexes, any match indicates interest
+
+    not_interesting: compiled regexes, any match trumps interesting
+    """
+
+    def __init__(self, interesting, not_interesting):
+        interesting = list(interesting or [])
+        not_interesting = list(not_interesting or [])
+
+        self.interesting = matcher(interesting)
+        self.not_interesting = matcher(not_interesting)
+
+        # literal not_interesting patterns ending in a directory
+        # separator exclude everything under the directory they match.
+        prune_dirs = []
+        for n in not_interesting:
+            lit = literal_pattern(n.pattern)
+            if lit and lit[1].endswith('/'):
+                prune_dirs.append(n)
+        self.prune_dirs = matcher(prune_dirs)
+
+        # directory prefixes we can hand to git as pathspecs, or None
+        # if any interesting pattern can't be expressed that way.
+        self.include_dirs = None
+        if interesting and not [i for i in interesting if i.flags & re.IGNORECASE]:
+            include_dirs = []
+            for i in interesting:
+                lit = literal_pattern(i.pattern)
+                if not lit or not lit[0] or not lit[1].endswith('/'):
+                    include_dirs = None
+                    break
+                include_dirs.append(lit[1])
+            self.include_dirs = include_dirs
+
+    def is_interesting(self, f):
+        if f.strip() == '':
+            return False
+        if not self.interesting or not self.interesting.search(f):
+            return False
+        return not (self.not_interesting and self.not_interesting.search(f))
+
+    def pathspecs(self, root):
+        """
+        root: the path of the project relative to the repository root,
+        '' for the repository root itself.
+
+        Returns the list of pathspecs that cover every path under root
+        that could possibly be interesting (an empty list if none
+        can), or None if the patterns can't be pushed down and the
+        whole of root has to be listed.
+        """
+        if self.include_dirs is None:
+            return None
+        root = root.strip('/')
+        if root:
+            root += '/'
+        pathspecs = []
+        for d in self.include_dirs:
+            if d.startswith(root):
+                pathspecs.append(d)
+            elif root.startswith(d):
+                # the whole project is under an interesting directory
+                return None
+        return pathspecs
+
+    def filter(self, paths, key=None):
+        """
+        Yields the interesting paths from the iterable paths.  If key
+        is given, paths may be any items and key(item) gives the path
+        to filter on.
+
+        Paths under a pruned directory are skipped without running any
+        regexes, which is most effective when paths are sorted (as
+        git ls-tree lists them) but is correct in any order.
+        """
+        pruned = None
+        for item in paths:
+            f = item
+            if key:
+                f = key(item)
+            if pruned and f.startswith(pruned):
+                continue
+            if self.prune_dirs:
+                m = self.prune_dirs.search(f)
+                if m:
+                    pruned = f[:m.end()]
+                    continue
+            if self.is_interesting(f):
+                yield item
@@ -0,0 +1,231 @@
+"""
+Who knows a file, and what would be lost if a dev left, without a
+full run:
+
+python git_by_a_bus.py query src/server/handler.py --leaving alice
+
+Prints, for each file, a line with its project:path, its number of
+lines and where its history came from, then a line per group of devs
+that knows some of it:
+
+group<TAB>devs<TAB>unique knowledge<TAB>risk
+
+largest first, orphaned<TAB>devs<TAB>knowledge for what only departed
+devs knew, and with --leaving, lost<TAB>devs<TAB>knowledge for what
+would be orphaned if the devs leaving left too.
+
+Only the file's history is needed, which is looked up in the
+gen_file_stats.tsv of the last run in --output through its index (see
+tsv_index.py), or in the journal of a run still going, and only read
+from git if it isn't there (or with --live or --since).  The model and
+the risk are always run again, in process, with the options given, so
+they needn't be those of the run.
+
+Run python git_by_a_bus.py query -h for options.
+"""
+
+import sys
+import os
+import time
+
+from optparse import OptionParser
+
+from common import FileData, parse_departed_devs
+from estimate_unique_knowledge import MODELS
+from estimate_file_risk import parse_risk_file, file_dev_risk
+from summarize import split_out_dev_vals
+import git_file_stats
+import tsv_index
+
+def resolve(arg, git_exe):
+    """
+    Returns (project, path, top) for a PATH argument: a file in a git
+    checkout, which gives path relative to the git root top, or
+    project:path or path (relative to the git root) for a file that
+    isn't checked out here, which gives top None and project None if
+    not given.
+    """
+    if not os.path.exists(arg):
+        if ':' in arg:
+            project, path = arg.split(':', 1)
+            return project, path, None
+        return None, arg, None
+    f = os.path.realpath(arg)
+    git_cmd = ('%s rev-parse --show-toplevel' % git_exe).split(' ')
+    top = git_file_stats.git_output(git_cmd, cwd=os.path.dirname(f)).strip()
+    if not top:
+        return None, None, None
+    return None, os.path.relpath(f, top).replace(os.path.sep, '/'), top
+
+def journal_lines(journal, path, project=None):
+    """
+    The lines for path in the journal of an unfinished gen run, as
+    [(fname, line), ...], see tsv_index.lookup.
+    """
+    if project is None:
+        needle = ':%s\t' % path
+    else:
+        needle = '%s:%s\t' % (project, path)
+    found = {}
+    fil = open(journal, 'r')
+    for line in fil:
+        if line.startswith('#') or needle not in line:
+            continue
+        fname = tsv_index.line_fname(line)
+        if fname == needle[:-1] or (project is None and fname.endswith(needle[:-1])):
+            found[fname] = line
+    fil.close()
+    return sorted(found.items())
+
+def cached_history(output_dir, path, project):
+    """
+    (source, [(fname, line), ...]) of the history of path recorded in
+    output_dir, or (None, []) if there isn't one.
+    """
+    tsv = os.path.join(output_dir, 'gen_file_stats.tsv')
+    if os.path.isfile(tsv):
+        lines = tsv_index.lookup(tsv, path, project)
+        if lines:
+            return tsv, lines
+    journal = os.path.join(output_dir, 'gen_file_stats.journal')
+    if os.path.isfile(journal):
+        lines = journal_lines(journal, path, project)
+        if lines:
+            return journal, lines
+    return None, []
+
+def live_history(path, project, top, options):
+    """
+    FileData of path, read from git in top, None if it has no history.
+    """
+    os.chdir(top)
+    cutoff = None
+    if options.since:
+        cutoff = git_file_stats.git_cutoff(options.since, options.git_exe)
+    dev_experience, exp_times, exp_hunks = git_file_stats.parse_dev_experience(path, options.git_exe, cutoff,
+                                                                               options.hunks)
+    if not dev_experience:
+        return None
+    fd = FileData(':'.join([project, path]))
+    fd.dev_experience = dev_experience
+    fd.exp_times = exp_times
+    fd.exp_hunks = exp_hunks
+    fd.cnt_lines = git_file_stats.count_lines(path)
+    return fd
+
+def file_histories(arg, options):
+    """
+    (source, [FileData, ...]) of the file named by arg, one per
+    project it is in.  Exits with an error if it can't be found.
+    """
+    project, path, top = resolve(arg, options.git_exe)
+    if path is None:
+        print >> sys.stderr, "Error: %s is not in a git checkout" % arg
+        sys.exit(1)
+    project = options.project or project
+
+    if not (options.live or options.since):
+        source, lines = cached_history(options.output, path, project)
+        fds = [FileData(line) for fname, line in lines]
+        # histories from runs without --hunks are no use to the
+        # positional model
+        if fds and not (options.hunks and [fd for fd in fds if fd.dev_experience and not fd.exp_hunks]):
+            return source, fds
+
+    if top is None:
+        print >> sys.stderr, "Error: no history of %s in %s, and it isn't checked out here to read it from git" % \
+              (arg, options.output)
+        sys.exit(1)
+    project = project or os.path.basename(top)
+    fd = live_history(path, project, top, options)
+    if fd is None:
+        print >> sys.stderr, "Error: %s has no history in git" % arg
+        sys.exit(1)
+    return 'git', [fd]
+
+def print_breakdown(fd, source, departed_devs, leaving, out):
+    print >> out, "%s\t%s lines\tfrom %s" % (fd.fname, fd.cnt_lines, source)
+    dev_uniq, dev_orphaned = split_out_dev_vals(fd.dev_uniq, departed_devs)
+    dev_risk = dict([('\0'.join(devs), risk) for devs, risk in split_out_dev_vals(fd.dev_risk, departed_devs)[0]])
+    for devs, uniq in sorted(dev_uniq, key=lambda (devs, uniq): (-uniq, devs)):
+        print >> out, "group\t%s\t%.1f\t%.2f" % (' and '.join(devs), uniq, dev_risk.get('\0'.join(devs), 0))
+    for devs, orphaned in sorted(dev_orphaned, key=lambda (devs, orphaned): (-orphaned, devs)):
+        print >> out, "orphaned\t%s\t%.1f" % (' and '.join(devs), orphaned)
+    if leaving:
+        lost = split_out_dev_vals(fd.dev_uniq, departed_devs + leaving)[1]
+        lost = [(devs, val) for devs, val in lost if set(devs) & set(leaving)]
+        for devs, val in sorted(lost, key=lambda (devs, val): (-val, devs)):
+            print >> out, "lost\t%s\t%.1f" % (' and '.join(devs), val)
+
+def main(args):
+    usage = """usage: %prog query [options] PATH ...
+
+               Print who knows each file PATH, a file in a git checkout, or project:path or a path
+               relative to the top of the repository for a file of the last run in the output dir."""
+    usage = '\n'.join([line.strip() for line in usage.split('\n')])
+    parser = OptionParser(usage=usage)
+    parser.add_option('-o', '--output', dest='output', metavar='DIRNAME', default='output',
+                      help='Output directory of the run to look the history up in (defaults to "output")')
+    parser.add_option('--project', dest='project', metavar='PROJECT',
+                      help='Project the files are in (defaults to any project of the run they are in, ' + \
+                      'or the name of the git root when read from git)')
+    parser.add_option('--model', dest='model', metavar='MODEL[:MARG1[:MARG2]...]', default='sequential:0.1',
+                      help='Knowledge model to use, with arguments (defaults to sequential:0.1)')
+    parser.add_option('-b', '--bus-risk', dest='bus_risk', metavar='FLOAT', default=0.1,
+                      help='The default estimated probability that a dev will be hit by a bus (defaults to 0.1)')
+    parser.add_option('-r', '--risk-file', dest='risk_file', metavar='FILE',
+                      help='File of dev=float lines (e.g. ejorgensen=0.4) with custom bus risks for devs')
+    parser.add_option('-d', '--departed-dev-file', dest='departed_dev_file', metavar='FILE',
+                      help='File listing departed devs, one per line')
+    parser.add_option('--leaving', dest='leaving', metavar='DEV', action='append', default=[],
+                      help='Also print the knowledge that would be orphaned if DEV left (may be repeated)')
+    parser.add_option('--live', dest='live', default=False, action='store_true',
+                      help='Read the history from git even if the run has it')
+    parser.add_option('--since', dest='since', metavar='DATE|COMMIT',
+                      help='Read the history from git, only after this commit or YYYY-MM-DD date')
+    parser.add_option('--git-exe', dest='git_exe', default='/usr/bin/env git',
+                      help='Path to the git exe (defaults to "/usr/bin/env git")')
+    parser.add_option('--cache-dir', dest='cache_dir', metavar='DIRNAME',
+                      default=os.path.join(os.path.expanduser('~'), '.git_by_a_bus_cache'),
+                      help='Where the blame model caches blames (defaults to ~/.git_by_a_bus_cache)')
+    parser.add_option('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                      help='Print how long each file took to stderr')
+    options, args = parser.parse_args(args)
+
+    if not args:
+        parser.error('You must pass the files to query.')
+
+    model = options.model.split(':')
+    if model[0] not in MODELS:
+        parser.error('Unknown model %s, the models are %s' % (options.model, ', '.join(sorted(MODELS.keys()))))
+    options.hunks = model[0] == 'positional'
+
+    bus_risks = {}
+    if options.risk_file:
+        parse_risk_file(options.risk_file, bus_risks)
+    departed_devs = []
+    if options.departed_dev_file:
+        parse_departed_devs(options.departed_dev_file, departed_devs)
+
+    options.output = os.path.abspath(options.output)
+    paths = [os.path.abspath(arg) if os.path.exists(arg) else arg for arg in args]
+    for arg, path in zip(args, paths):
+        start = time.time()
+        source, fds = file_histories(path, options)
+        if model[0] == 'blame':
+            # the blame model blames the file in its checkout
+            top = resolve(path, options.git_exe)[2]
+            if top is None:
+                print >> sys.stderr, "Error: the blame model needs %s checked out" % arg
+                sys.exit(1)
+            options.repos = [(top, fd.project) for fd in fds]
+            options.jobs = 1
+        knowledge_model = MODELS[model[0]](model[1:], options)
+        for fd, (dev_uniq, tot_knowledge) in zip(fds, knowledge_model.estimate(fds)):
+            fd.dev_uniq = dev_uniq
+            fd.tot_knowledge = tot_knowledge
+            fd.dev_risk = file_dev_risk(fd, bus_risks, float(options.bus_risk))
+            print_breakdown(fd, source, departed_devs, options.leaving, sys.stdout)
+        knowledge_model.close()
+        if options.verbose:
+            print >> sys.stderr, "%s took %.1fms" % (arg, 1000 * (time.time() - start))
@@ -1,22 +1,283 @@
 """
-Generate file stats for all interesting files in a project using git (default) or svn.
+Generate file stats for all interesting files in one or more projects using git (default) or svn.
 
 Run python gen_file_stats.py -h for options.
 
 Prints FileData objects encoded as tsv lines to stdout.  Only the
 fname, dev_experience and cnt_lines fields are filled in.
+
+Large runs can be spread across machines with --shard I/N, and the
+shards put back together with python gen_file_stats.py merge.
 """
 
+import sys
 import os
 import re
 
 from optparse import OptionParser
+from itertools import chain
+import heapq
 
+from common import parse_path_project
 import git_file_stats
+import metrics
+import profiling
+import sampling
+import stage_io
+import tsv_index
 
-if __name__ == '__main__':
-    usage = "usage: %prog [options] git_controlled_path[=project_name]"
-    parser = OptionParser()
+# files worth analyzing unless -i says otherwise
+DEFAULT_INTERESTING = r'\.java$ \.cs$ \.py$ \.c$ \.cpp$ \.h$ \.hpp$ \.pl$ \.rb$ \.sh$'.split(' ')
+
+def compile_filters(interesting, not_interesting, case_sensitive):
+    """
+    Compile the -i and -n regular expressions, returning
+    (interesting, not_interesting).
+    """
+    flags = 0
+    if not case_sensitive:
+        flags = re.IGNORECASE
+    return [re.compile(i, flags) for i in interesting or DEFAULT_INTERESTING], \
+           [re.compile(n, flags) for n in not_interesting or []]
+
+class Journal(object):
+    """
+    Crash-safe record of the progress of a gen run, so a run that dies
+    partway can be resumed without redoing finished files.
+
+    The journal holds the tsv lines generated so far, a
+    '#done\tordinal\tfname' record for every finished file (right after
+    its line, if it produced one) and a '#batch' record after every
+    batch, written only once the batch has been flushed and fsync'd.
+    Anything after the last '#batch' is from a batch that didn't make
+    it and is discarded on resume.
+    """
+
+    def __init__(self, fname, header, batch_size):
+        """
+        fname: path of the journal file
+
+        header: string identifying the arguments of the run, a journal
+        from a run with different arguments can't be resumed
+
+        batch_size: number of files to finish between checkpoints
+        """
+        self.fname = fname
+        self.header = header
+        self.batch_size = batch_size
+        self.done = set()
+        self.pending = []
+        self.n_pending = 0
+        self.fil = None
+
+    def open(self, resume):
+        """
+        Start a new journal, or if resume and one exists, pick up where
+        it left off.  Returns False if the existing journal is from a
+        run with different arguments.
+        """
+        if resume and os.path.isfile(self.fname):
+            fil = open(self.fname, 'r+')
+            if fil.readline().rstrip('\n') != '#gen\t' + self.header:
+                fil.close()
+                return False
+            done = []
+            end = fil.tell()
+            for line in iter(fil.readline, ''):
+                if not line.endswith('\n'):
+                    break
+                if line == '#batch\n':
+                    self.done.update(done)
+                    done = []
+                    end = fil.tell()
+                elif line.startswith('#done\t'):
+                    done.append(line[:-1].split('\t', 2)[2])
+            # drop the remains of a batch that was never completed
+            fil.seek(end)
+            fil.truncate()
+            self.fil = fil
+        else:
+            self.fil = open(self.fname, 'w+')
+            self.fil.write('#gen\t%s\n' % self.header)
+            self.sync()
+        return True
+
+    def record(self, ordinal, fname, line):
+        if line:
+            self.pending.append(line + '\n')
+        self.pending.append('#done\t%d\t%s\n' % (ordinal, fname))
+        self.n_pending += 1
+        if self.n_pending >= self.batch_size:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.pending.append('#batch\n')
+        self.fil.write(''.join(self.pending))
+        self.sync()
+        self.pending = []
+        self.n_pending = 0
+
+    def sync(self):
+        self.fil.flush()
+        os.fsync(self.fil.fileno())
+
+    def lines(self):
+        """
+        Yields (ordinal, line) for all the tsv lines in the journal, in
+        the order they were generated.
+        """
+        self.fil.seek(0)
+        last_line = None
+        for line in self.fil:
+            if line.startswith('#done\t'):
+                if last_line is not None:
+                    yield int(line.split('\t', 2)[1]), last_line
+                last_line = None
+            elif not line.startswith('#'):
+                last_line = line.rstrip('\n')
+
+    def finish(self):
+        """
+        Checkpoint whatever is pending, yield (ordinal, line) for all
+        the tsv lines and remove the journal.
+        """
+        self.checkpoint()
+        for ordinal_line in self.lines():
+            yield ordinal_line
+        self.fil.close()
+        os.remove(self.fname)
+
+def parse_shard(shard):
+    """
+    Parse an i/N shard argument into an (i, N) tuple, None if it's
+    malformed.
+    """
+    try:
+        i, n = [int(x) for x in shard.split('/')]
+    except ValueError:
+        return None
+    if n < 1 or i < 0 or i >= n:
+        return None
+    return i, n
+
+def write_manifest(fname, shard, signature, heads, ordinals):
+    """
+    Write the manifest of a shard, which records what the shard is
+    part of and the ordinal of each of its lines, so merge_shards can
+    check the shards belong together and restore the order a single
+    run would have produced.
+
+    The manifest goes to a partial file first and is renamed into
+    place only once it is complete.
+    """
+    partial_fname = fname + '.partial'
+    fil = open(partial_fname, 'w')
+    fil.write('#shard\t%d/%d\n' % shard)
+    fil.write('#gen\t%s\n' % signature)
+    for project, head in heads:
+        fil.write('#head\t%s\t%s\n' % (project, head))
+    for ordinal in ordinals:
+        fil.write('%d\n' % ordinal)
+    fil.close()
+    os.rename(partial_fname, fname)
+
+def read_manifest(fname):
+    """
+    Returns (shard, header, ordinals), where header is the lines
+    identifying the run the shard is part of.
+    """
+    shard = None
+    header = []
+    ordinals = []
+    fil = open(fname, 'r')
+    for line in fil:
+        line = line.rstrip('\n')
+        if line.startswith('#shard\t'):
+            shard = parse_shard(line.split('\t', 1)[1])
+        elif line.startswith('#'):
+            header.append(line)
+        elif line:
+            ordinals.append(int(line))
+    fil.close()
+    return shard, header, ordinals
+
+def merge_shards(tsvs_manifests):
+    """
+    tsvs_manifests: list of (shard tsv, shard manifest) file names.
+
+    The tsvs can be the output of gen_file_stats.py --shard, or of any
+    later stage run on it, since each stage writes one line per input
+    line.
+
+    Returns (error, lines), where error is a message if the shards
+    don't make up a complete run, else None and lines yields the
+    lines of all shards in the order a single run would produce.
+    """
+    shards = {}
+    header = None
+    n_shards = None
+    for tsv, manifest in tsvs_manifests:
+        if not os.path.isfile(manifest):
+            return "no manifest %s for shard %s" % (manifest, tsv), None
+        shard, shard_header, ordinals = read_manifest(manifest)
+        if shard is None:
+            return "manifest %s has no shard" % manifest, None
+        if header is None:
+            header, n_shards = shard_header, shard[1]
+        elif shard_header != header or shard[1] != n_shards:
+            return "shard %s is from a different run or HEAD than %s" % (tsv, tsvs_manifests[0][0]), None
+        if shard[0] in shards:
+            return "shard %d/%d passed twice" % shard, None
+        n_lines = len([line for line in stage_io.file_lines(tsv) if line.strip()])
+        if n_lines != len(ordinals):
+            return "shard %s has %d lines, its manifest %d" % (tsv, n_lines, len(ordinals)), None
+        shards[shard[0]] = (tsv, ordinals)
+
+    missing = [str(i) for i in range(n_shards or 0) if i not in shards]
+    if missing:
+        return "missing shards %s of %d" % (', '.join(missing), n_shards), None
+
+    def shard_lines(tsv, ordinals):
+        lines = (line.rstrip('\n') for line in stage_io.file_lines(tsv) if line.strip())
+        for ordinal, line in zip(ordinals, lines):
+            yield ordinal, line
+
+    merged = heapq.merge(*[shard_lines(tsv, ordinals) for tsv, ordinals in shards.values()])
+    return None, (line for ordinal, line in merged)
+
+def merge_main(args):
+    usage = """usage: %prog merge [options] shard_tsv1[=manifest1] shard_tsv2[=manifest2] ...
+
+               Merge the output of gen_file_stats.py --shard runs (or of later stages run on
+               them) into the output a single run would have produced.
+
+               Manifests default to shard_tsv.manifest."""
+    usage = '\n'.join([line.strip() for line in usage.split('\n')])
+    parser = OptionParser(usage=usage)
+    options, args = parser.parse_args(args)
+
+    if not args:
+        parser.error("You must pass the shard tsvs to merge.")
+
+    tsvs_manifests = []
+    for arg in args:
+        tsv_manifest = arg.split('=')
+        if len(tsv_manifest) > 1:
+            tsvs_manifests.append((tsv_manifest[0], tsv_manifest[1]))
+        else:
+            tsvs_manifests.append((tsv_manifest[0], tsv_manifest[0] + '.manifest'))
+
+    error, lines = merge_shards(tsvs_manifests)
+    if error:
+        print >> sys.stderr, "Error: " + error
+        sys.exit(1)
+
+    for line in lines:
+        print line
+
+def main(args):
+    usage = "usage: %prog [options] git_controlled_path1[=project_name1] [git_controlled_path2[=project_name2] ...]"
+    parser = OptionParser(usage=usage)
     parser.add_option('-i', '--interesting', metavar="REGEXP", dest='interesting', action='append',
                       help='Regular expression to determine which files should be included in calculations.  ' + \
                       'May be repeated, any match is sufficient to indicate interest. ' + \
@@ -30,48 +291,183 @@ if __name__ == '__main__':
                       help='Path to the git exe (defaults to "/usr/bin/env git")')
     parser.add_option('--svn', dest='use_svn', default=False, action='store_true',
                       help='Use svn intead of git to generate file statistics.  This requires you to install pysvn.')
+    parser.add_option('--max-size', dest='max_size', metavar='BYTES', type='int', default=None,
+                      help='Skip files bigger than this many bytes in HEAD (git only, defaults to no limit)')
+    parser.add_option('--since', dest='since', metavar='DATE|COMMIT',
+                      help='Only read the history after this commit, or the last commit before this YYYY-MM-DD date, ' + \
+                      'crediting the lines that survive from before it to their authors with a blame (git only)')
+    parser.add_option('--hunks', dest='hunks', default=False, action='store_true',
+                      help='Also record the hunks of each revision, which the positional knowledge model needs (git only)')
+    parser.add_option('--only', dest='only', metavar='REGEXP', action='append',
+                      help='Only do the files whose project:path matches REGEXP (git only, may be repeated)')
+    parser.add_option('--files', dest='files', metavar='FILE',
+                      help='Only do the files listed as project:path in FILE, one per line (git only)')
+    parser.add_option('--journal', dest='journal', metavar='FILE',
+                      help='Record progress in FILE, so an interrupted run can be continued with --resume (git only).  ' + \
+                      'Lines are only printed once all files are done.')
+    parser.add_option('--resume', dest='resume', default=False, action='store_true',
+                      help='Continue the run recorded in the --journal file, skipping files it has already finished')
+    parser.add_option('--checkpoint-every', dest='checkpoint_every', metavar='N', type='int', default=100,
+                      help='Number of files to finish between fsyncs of the --journal file (defaults to 100)')
+    parser.add_option('--shard', dest='shard', metavar='I/N',
+                      help='Only do shard I (counting from 0) of N, for spreading a run across machines (git only).  ' + \
+                      'Requires --manifest, combine the shards with "%prog merge".')
+    parser.add_option('--manifest', dest='manifest', metavar='FILE',
+                      help='Where to write the manifest of a --shard run, "%prog merge" looks for it in shard_tsv.manifest ' + \
+                      'by default')
+    parser.add_option('--sample-fraction', dest='sample_fraction', metavar='FLOAT', type='float',
+                      help='Only analyze this fraction of the files, chosen at random from each directory of each project ' + \
+                      '(git only).  Requires --sample-manifest, which summarize.py needs to scale the results up.')
+    parser.add_option('--sample-size', dest='sample_size', metavar='N', type='int',
+                      help='Like --sample-fraction, but analyze about N files in all')
+    parser.add_option('--sample-seed', dest='sample_seed', metavar='SEED', default='0',
+                      help='Seed for choosing the --sample-fraction / --sample-size files (defaults to 0)')
+    parser.add_option('--sample-manifest', dest='sample_manifest', metavar='FILE',
+                      help='Where to write the sizes of the strata a sample was drawn from')
+    parser.add_option('--metrics', dest='metrics', metavar='FILE',
+                      help='Write counters about the run as json to FILE')
+    parser.add_option('--profile', dest='profile', metavar='DIRNAME',
+                      help='Profile this stage with a sampling profiler, writing gen_file_stats.collapsed.txt and gen_file_stats.profile.txt ' + \
+                      'into DIRNAME')
 
-    options, args = parser.parse_args()
+    options, args = parser.parse_args(args)
 
-    if len(args) != 1:
-        parser.error("You must pass a single git controlled path as the argument.")
-        
-    path_project = args[0].split('=')
+    if not args:
+        parser.error("You must pass at least one git controlled path as an argument.")
 
-    project = None
+    roots_projects = [parse_path_project(arg, options.use_svn) for arg in args]
 
-    # handle symlinked directories, which git doesn't like.
-    # but don't use them for svn.
-    if not options.use_svn:
-        root = os.path.realpath(path_project[0])
-    else:
-        root = path_project[0]
+    interesting, not_interesting = compile_filters(options.interesting, options.not_interesting, options.case_sensitive)
 
-    if len(path_project) > 1:
-        project = path_project[1]
-    else:
-        # if they don't specify a project name, use the last piece of
-        # the root.
-        project = os.path.split(root)[1]
+    if options.resume and not options.journal:
+        parser.error("--resume requires --journal")
 
-    interesting = options.interesting or r'\.java$ \.cs$ \.py$ \.c$ \.cpp$ \.h$ \.hpp$ \.pl$ \.rb$ \.sh$'.split(' ')
-    not_interesting = options.not_interesting or []
+    if options.journal and options.use_svn:
+        parser.error("--journal is not supported with --svn")
 
-    if options.case_sensitive:
-        interesting = [re.compile(i) for i in interesting]
-        not_interesting = [re.compile(n) for n in not_interesting]
-    else:
-        interesting = [re.compile(i, re.IGNORECASE) for i in interesting]
-        not_interesting = [re.compile(n, re.IGNORECASE) for n in not_interesting]
+    if options.hunks and options.use_svn:
+        parser.error("--hunks is not supported with --svn")
+
+    only = None
+    if options.only or options.files:
+        if options.use_svn:
+            parser.error("--only and --files are not supported with --svn")
+        if options.journal or options.shard:
+            parser.error("--only and --files don't go with --journal or --shard")
+        only = tsv_index.Selection(options.only, options.files)
+
+    shard = None
+    if options.shard:
+        shard = parse_shard(options.shard)
+        if not shard:
+            parser.error("--shard must be I/N with 0 <= I < N")
+        if options.use_svn:
+            parser.error("--shard is not supported with --svn")
+        if not options.manifest:
+            parser.error("--shard requires --manifest")
+        manifest = os.path.abspath(options.manifest)
+
+    sample = None
+    if options.sample_fraction is not None or options.sample_size is not None:
+        if options.sample_fraction is not None and options.sample_size is not None:
+            parser.error("--sample-fraction and --sample-size don't go together")
+        if options.sample_fraction is not None and not 0 < options.sample_fraction <= 1:
+            parser.error("--sample-fraction must be more than 0 and at most 1")
+        if options.use_svn:
+            parser.error("sampling is not supported with --svn")
+        if shard:
+            parser.error("sampling is not supported with --shard")
+        if only:
+            parser.error("sampling is not supported with --only or --files")
+        if not options.sample_manifest:
+            parser.error("sampling requires --sample-manifest")
+        sample = sampling.Sample(options.sample_fraction, options.sample_size, options.sample_seed)
+        sample_manifest = os.path.abspath(options.sample_manifest)
+
+    # we chdir around, so hold on to absolute paths
+    if options.journal:
+        options.journal = os.path.abspath(options.journal)
+    if options.metrics:
+        options.metrics = os.path.abspath(options.metrics)
 
-    gen_stats = git_file_stats.gen_stats
+    if options.profile:
+        # the gen stage is long, keep the overhead down by only
+        # sampling.
+        profiling.start('gen_file_stats', options.profile, sample_only=True)
 
     if options.use_svn:
         # only run the import if they actually try to use svn, since
         # we don't want to import pysvn and fail if we don't have to.
         import svn_file_stats
-        gen_stats = svn_file_stats.gen_stats
-    
-    for line in gen_stats(root, project, interesting, not_interesting, options):
+        lines = chain(*[svn_file_stats.gen_stats(root, project, interesting, not_interesting, options) \
+                        for root, project in roots_projects])
+        for line in lines:
+            if line.strip():
+                print line
+        finish(options)
+        return
+
+    # identifies the run, regardless of where the repositories are
+    # checked out.
+    signature = repr(([project for root, project in roots_projects],
+                      [i.pattern for i in interesting],
+                      [n.pattern for n in not_interesting],
+                      options.case_sensitive,
+                      options.max_size,
+                      options.since,
+                      options.sample_fraction,
+                      options.sample_size,
+                      options.sample_seed))
+    if options.hunks:
+        signature += ' --hunks'
+
+    if shard:
+        # shards can only be merged if they were all built from the
+        # same commits.
+        heads = []
+        for root, project in roots_projects:
+            git_file_stats.prepare(root, options.git_exe)
+            heads.append((project, git_file_stats.git_head(options.git_exe)))
+
+    if options.journal:
+        journal = Journal(options.journal, repr((roots_projects, signature, shard)), options.checkpoint_every)
+        if not journal.open(options.resume):
+            print >> sys.stderr, "Error: journal %s is from a run with different arguments" % options.journal
+            sys.exit(1)
+        if journal.done:
+            print >> sys.stderr, "Resuming, %d files already done" % len(journal.done)
+        for ordinal, fname, line in git_file_stats.gen_stats_progress(roots_projects, interesting, not_interesting,
+                                                                      options, journal.done, shard, sample):
+            journal.record(ordinal, fname, line)
+        lines = journal.finish()
+    else:
+        # projects in the same git repository share one git log.
+        lines = ((ordinal, line) for ordinal, fname, line in \
+                 git_file_stats.gen_stats_progress(roots_projects, interesting, not_interesting,
+                                                   options, shard=shard, sample=sample, only=only) if line)
+
+    ordinals = []
+    for ordinal, line in lines:
         if line.strip():
             print line
+            if shard:
+                ordinals.append(ordinal)
+
+    if shard:
+        write_manifest(manifest, shard, signature, heads, ordinals)
+
+    if sample:
+        sample.write_manifest(sample_manifest)
+
+    finish(options)
+
+def finish(options):
+    profiling.stop()
+    if options.metrics:
+        metrics.write(options.metrics)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['merge']:
+        merge_main(sys.argv[2:])
+    else:
+        main(sys.argv[1:])
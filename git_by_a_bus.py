@@ -4,7 +4,8 @@ Driver for git by a bus.
 
 Calls gen_file_stats.py, estimate_unique_knowledge.py,
 estimate_file_risk.py, summarize.py in a chain, storing output from
-each in output_dir/(basename).tsv.
+each in output_dir/(basename).tsv, or compressed in
+output_dir/(basename).tsv.gz and so on with --compress.
 
 To re-run only a portion of the calculations, you can remove all tsv
 downstream and run again with the -c option (this is useful if you
@@ -12,21 +13,48 @@ want to manually remove some files from gen_file_stats.tsv, for
 instance, rather than run the gen_file_stats.py step, which is slowest
 by orders of magnitude).
 
-Writes a summary found at output_dir/index.html.
+Outputs are only moved into place once their stage has finished, and
+an interrupted gen_file_stats.py run is resumed from its journal by
+running again with -c.
+
+With --only REGEXP or --files FILE, only the files picked are run
+again, and their lines spliced into the tsvs of the last run in
+output_dir, with the summary updated for just the files that changed
+(see run_selected).
+
+python git_by_a_bus.py query PATH prints who knows the file PATH, from
+the history of the last run or git (see file_query.py).
+
+With --serve PORT, only output_dir/index.html is written, and once the
+chain is done the rest of the summary is served on localhost:PORT,
+rendered as pages are asked for.
+
+Writes a summary found at output_dir/index.html, and timings and
+counters for each stage to output_dir/metrics.json.  With --snapshots,
+knowledge and risk snapshots go in output_dir/snapshots and are
+charted in output_dir/trends.html.
 
 Run as python git_by_a_bus.py -h for options.
 """
 
 import sys
 import os
+import time
+import shutil
 
 from optparse import OptionParser
-from subprocess import Popen
+from subprocess import Popen, PIPE
 from string import Template
 
 SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
 sys.path.append(SCRIPT_PATH)
 
+from common import parse_departed_devs
+import metrics
+import stage_io
+import summarize
+import tsv_index
+
 def exit_with_error(err):
     print >> sys.stderr, "Error: " + err
     exit(1)
@@ -45,7 +73,54 @@ def output_fname_for(pyfile, output_dir):
         return None
     return os.path.join(output_dir, os.path.splitext(os.path.basename(pyfile))[0] + '.tsv')
 
-def run_chained(cmd_ts, python_cmd, output_dir, verbose):
+def run_stage_cmd(cmd, input_f, output_f, metrics_fname, stage_metrics):
+    """
+    Run a single stage command, adding its timings and the counters it
+    wrote to metrics_fname into stage_metrics.  Returns False if the
+    command failed.
+
+    output_f can also be a stage_io.CompressedWriter, which the output
+    is pumped into by a thread while the command runs.
+    """
+    start = time.time()
+    if isinstance(output_f, stage_io.CompressedWriter):
+        cmd_p = Popen(cmd + ['--metrics', metrics_fname], stdin=input_f, stdout=PIPE)
+        pump = stage_io.pump(cmd_p.stdout, output_f)
+    else:
+        cmd_p = Popen(cmd + ['--metrics', metrics_fname], stdin=input_f, stdout=output_f)
+        pump = None
+    # unlike communicate, wait4 gives us the resource usage of just
+    # this command
+    pid, status, rusage = os.wait4(cmd_p.pid, 0)
+    cmd_p.returncode = status
+    if pump:
+        pump.join()
+
+    stage_metrics['wall'] = stage_metrics.get('wall', 0) + time.time() - start
+    stage_metrics['cpu'] = stage_metrics.get('cpu', 0) + rusage.ru_utime + rusage.ru_stime
+    # ru_maxrss is in kilobytes on linux, bytes on os x
+    peak_rss_kb = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss_kb /= 1024
+    stage_metrics['peak_rss_kb'] = max(stage_metrics.get('peak_rss_kb', 0), peak_rss_kb)
+    if os.path.isfile(metrics_fname):
+        metrics.combine(stage_metrics.setdefault('counters', {}), metrics.read(metrics_fname))
+        os.remove(metrics_fname)
+    return status == 0
+
+def run_chained(cmd_ts, python_cmd, output_dir, verbose, run_metrics, profile=False, compress=None):
+    """
+    Run the stages in cmd_ts, recording timings and counters for each
+    stage that runs in the dictionary run_metrics, keyed by stage.
+
+    If profile, each stage is profiled into output_dir (see
+    profiling.py).
+
+    If compress is one of stage_io.compressions(), the outputs are
+    compressed into output_dir/(basename).tsv.COMPRESS.  The stages
+    read their input compressed or not, so earlier outputs -c finds
+    can be either.
+    """
     for cmd_t in cmd_ts:
         input_pyfile = cmd_t[0]
         output_pyfile = cmd_t[1]
@@ -57,38 +132,175 @@ def run_chained(cmd_ts, python_cmd, output_dir, verbose):
         input_fname = output_fname_for(input_pyfile, output_dir)
         output_fname = output_fname_for(output_pyfile, output_dir)
 
+        stage = os.path.splitext(os.path.basename(output_pyfile))[0]
+
         # don't re-run if the results exist
-        if os.path.isfile(output_fname):
+        if stage_io.existing(output_fname):
             if verbose:
-                print >> sys.stderr, "%s EXISTS, SKIPPING" % output_fname
+                print >> sys.stderr, "%s EXISTS, SKIPPING" % stage_io.existing(output_fname)
             continue
+        if input_fname:
+            input_fname = stage_io.existing(input_fname) or input_fname
+        output_fname = stage_io.compressed_fname(output_fname, compress)
+
+        # write to a partial file and only move it into place once
+        # the stage is done, so a crashed run never leaves an output
+        # that -c would take for complete.
+        partial_fname = output_fname + '.partial'
 
         input_f = None
         if input_fname:
-            input_f = open(input_fname, 'r')
-        output_f = open(output_fname, 'w')
+            input_f = open(input_fname, 'rb')
+        output_f = open(partial_fname, 'wb')
+        writer = output_f
+        if compress:
+            writer = stage_io.CompressedWriter(output_f, compress)
+
+        stage_metrics = {}
+        run_metrics[stage] = stage_metrics
 
         for opt_args in opts_args:
             cmd = [x for x in ' '.join([python_cmd, output_pyfile, opt_args]).split(' ') if x]
+            if profile:
+                cmd.extend(['--profile', output_dir])
             if verbose:
                 print >> sys.stderr, "Input file is: %s" % input_fname
                 print >> sys.stderr, "Output file is: %s" % output_fname
                 print >> sys.stderr, cmd
-            cmd_p = Popen(cmd, stdin=input_f, stdout=output_f)
-            cmd_p.communicate()
+            if not run_stage_cmd(cmd, input_f, writer, output_fname + '.metrics', stage_metrics):
+                write_metrics(output_dir, run_metrics)
+                exit_with_error("%s failed, partial output left in %s" % (output_pyfile, partial_fname))
             
         if input_f:
             input_f.close()
         if output_f:
+            if compress:
+                writer.close()
+            output_f.flush()
+            os.fsync(output_f.fileno())
             output_f.close()
+        os.rename(partial_fname, output_fname)
+
+def write_lines(fname, lines):
+    fil = open(fname, 'wb')
+    fil.writelines(lines)
+    fil.close()
+
+def run_selected(cmd_ts, python_cmd, output_dir, selection, departed_devs, verbose, run_metrics, profile=False):
+    """
+    Run the stages in cmd_ts again for just the files selection (a
+    tsv_index.Selection) picks, splicing their lines into the tsvs of
+    the last run in output_dir, which must all be there and plain.
+
+    The first stage only does the selected files, into
+    output_dir/(basename).tsv.delta.  The rest only get the lines that
+    changed, or are new, and the summary is updated from the lines
+    that changed or are gone as they were and as they are now (see
+    summarize.py --update), as long as the last run saved its
+    aggregates with the same departed_devs.  Otherwise it is written
+    anew.
+    """
+    # fnames whose lines have changed, are new or are gone
+    changed = None
+    delta_fnames = []
+    for cmd_t in cmd_ts:
+        input_pyfile = cmd_t[0]
+        output_pyfile = cmd_t[1]
+        opts_args = cmd_t[2]
+
+        input_fname = output_fname_for(input_pyfile, output_dir)
+        output_fname = output_fname_for(output_pyfile, output_dir)
+        stage = os.path.splitext(os.path.basename(output_pyfile))[0]
+        stage_metrics = {}
+        run_metrics[stage] = stage_metrics
+
+        input_f = None
+        if input_fname:
+            input_f = open(input_fname + '.delta', 'rb')
+        extra_args = []
+        if stage == 'summarize':
+            aggs_fname = os.path.join(output_dir, 'summarize.aggs')
+            if os.path.isfile(aggs_fname) and summarize.saved_departed_devs(aggs_fname) == sorted(departed_devs):
+                extra_args = ['--update', input_fname + '.old']
+            else:
+                # summarize everything, clearing out the pages of the
+                # last run first so none of them are left over
+                input_f.close()
+                input_f = open(input_fname, 'rb')
+                for subdir in ['projects', 'devs', 'dirs', 'files']:
+                    shutil.rmtree(os.path.join(output_dir, subdir), True)
+        delta_fname = output_fname + '.delta'
+        delta_fnames.append(delta_fname)
+        output_f = open(delta_fname, 'wb')
+
+        for opt_args in opts_args:
+            cmd = [x for x in ' '.join([python_cmd, output_pyfile, opt_args]).split(' ') if x] + extra_args
+            if profile:
+                cmd.extend(['--profile', output_dir])
+            if verbose:
+                print >> sys.stderr, cmd
+            if not run_stage_cmd(cmd, input_f, output_f, output_fname + '.metrics', stage_metrics):
+                write_metrics(output_dir, run_metrics)
+                exit_with_error("%s failed" % output_pyfile)
+        if input_f:
+            input_f.close()
+        output_f.close()
+
+        if stage == 'summarize':
+            break
+        new_lines = stage_io.file_lines(delta_fname)
+        if changed is None:
+            # the files the first stage was asked for, whether it still
+            # has lines for them or not
+            old_sha1s = dict([(fname, sha1) for fname, offset, length, sha1 in tsv_index.read_index(output_fname)])
+            new_sha1s = dict([(tsv_index.line_fname(line), tsv_index.line_sha1(line)) for line in new_lines])
+            selected = set([fname for fname in old_sha1s if selection(fname)]) | set(new_sha1s)
+            changed = set([fname for fname in selected if old_sha1s.get(fname) != new_sha1s.get(fname)])
+            if verbose:
+                print >> sys.stderr, "%d files selected, %d changed" % (len(selected), len(changed))
+            tsv_index.splice(output_fname, stage_io.file_lines(delta_fname), selected)
+            # only the lines that changed go on down the chain
+            write_lines(delta_fname, tsv_index.records(output_fname, changed))
+            if not changed:
+                break
+        else:
+            taken_out = tsv_index.splice(output_fname, new_lines, changed)
+            # the lines the summary has to take out again
+            write_lines(output_fname + '.old', taken_out)
+            delta_fnames.append(output_fname + '.old')
+
+    for delta_fname in delta_fnames:
+        if os.path.isfile(delta_fname):
+            os.remove(delta_fname)
+
+def read_metrics(output_dir):
+    """
+    The metrics of the last run in output_dir, so stages -c doesn't
+    re-run keep theirs.
+    """
+    metrics_fname = os.path.join(output_dir, 'metrics.json')
+    if os.path.isfile(metrics_fname):
+        return metrics.read(metrics_fname)
+    return {}
+
+def write_metrics(output_dir, run_metrics):
+    metrics.counters = run_metrics
+    metrics.write(os.path.join(output_dir, 'metrics.json'))
 
 def main(python_cmd, paths_projects, options):
     output_dir = os.path.abspath(options.output or 'output')
-    try:
-        os.mkdir(output_dir)
-    except:
-        if not options.continue_last:
-            exit_with_error("Output directory exists and you have not specified -c")
+    selected = options.only or options.files
+    if selected:
+        # splices into the tsvs of the last run
+        for pyfile in ['gen_file_stats.py', 'estimate_unique_knowledge.py', 'estimate_file_risk.py']:
+            if not os.path.isfile(output_fname_for(pyfile, output_dir)):
+                exit_with_error("--only and --files need the uncompressed tsvs of a complete run in %s" % output_dir)
+    else:
+        try:
+            os.mkdir(output_dir)
+        except:
+            if not options.continue_last:
+                exit_with_error("Output directory exists and you have not specified -c")
 
     risk_file_option = ''
     if options.risk_file:
@@ -112,21 +324,113 @@ def main(python_cmd, paths_projects, options):
     if options.git_exe:
         git_exe_option = "--git-exe %s" % options.git_exe
 
-    model_option = "--model %s" % options.model
+    # the gen stage keeps a journal so a crashed run can be resumed
+    # with -c rather than started over.
+    journal_option = ''
+    if not options.use_svn and not selected:
+        journal_option = "--journal %s" % os.path.join(output_dir, 'gen_file_stats.journal')
+        if options.continue_last:
+            journal_option += ' --resume'
+
+    only_option = ' '.join(["--only %s" % o for o in options.only])
+    if options.files:
+        only_option += " --files %s" % os.path.abspath(options.files)
+
+    max_size_option = ''
+    if options.max_size is not None:
+        max_size_option = "--max-size %d" % options.max_size
+
+    since_option = ''
+    if options.since:
+        since_option = "--since %s" % options.since
+
+    db_fname = os.path.join(output_dir, 'results.db')
+    db_option = ''
+    if options.db:
+        db_option = "--db %s" % db_fname
+
+    # with --serve, summarize.py only writes the index and the rest is
+    # rendered on demand afterwards.
+    index_only_option = ''
+    if options.serve:
+        index_only_option = '--index-only'
+    bundle_option = ''
+    if options.bundle:
+        bundle_option = '--bundle'
+
+    # a sampled run describes its strata in a manifest, which
+    # summarize.py scales the results up with.
+    sample_option = ''
+    sample_manifest_option = ''
+    if options.sample_fraction is not None or options.sample_size is not None:
+        sample_manifest_option = "--sample-manifest %s" % os.path.join(output_dir, 'gen_file_stats.sample')
+        sample_option = "%s --sample-seed %s" % (sample_manifest_option, options.sample_seed)
+        if options.sample_fraction is not None:
+            sample_option += " --sample-fraction %s" % options.sample_fraction
+        if options.sample_size is not None:
+            sample_option += " --sample-size %d" % options.sample_size
+
+    # with --keep-aggs, and on --only and --files runs, a summary
+    # written page by page saves its aggregates, which later --only and
+    # --files runs update rather than summarizing everything again.
+    aggs_option = ''
+    if (options.keep_aggs or selected) and \
+       not (options.serve or options.bundle or sample_option or options.memory_budget):
+        aggs_option = "--aggs %s" % os.path.join(output_dir, 'summarize.aggs')
+
+    memory_budget_option = ''
+    if options.memory_budget:
+        memory_budget_option = "--memory-budget %d" % options.memory_budget
+
+    # the first model's estimates go on down the chain, and with more
+    # than one every model's also end up in output_dir/models
+    models = options.models or ['sequential:0.1']
+    model_option = ' '.join(["--model %s" % model for model in models])
+    if len(models) > 1:
+        model_option += " --model-dir %s" % os.path.join(output_dir, 'models')
+    if options.memo_dir:
+        model_option += " --memo-dir %s" % options.memo_dir
+    if 'blame' in [model.split(':')[0] for model in models]:
+        # the blame model goes back to the repositories
+        model_option += " --jobs %d %s %s" % (options.jobs, git_exe_option, ' '.join(paths_projects))
+        if options.cache_dir:
+            model_option += " --cache-dir %s" % options.cache_dir
+
+    # the positional model replays the hunks of each revision, which
+    # gen_file_stats.py only reads when asked to.
+    hunks_option = ''
+    if 'positional' in [model.split(':')[0] for model in models]:
+        hunks_option = '--hunks'
+
+    # the snapshots come out of the same knowledge replay, and ride
+    # along with the risk and summarize stages.
+    snapshot_dir_option = ''
+    snapshots_option = ''
+    if options.snapshots:
+        snapshot_dir_option = "--snapshot-dir %s" % os.path.join(output_dir, 'snapshots')
+        snapshots_option = "--snapshots %s %s" % (options.snapshots, snapshot_dir_option)
 
     # commands to chain together--the stdout of the first becomes the
     # stdin of the next.  You can find the output of gen_file_stats.py
     # in output_dir/gen_file_stats.tsv, and so on.
     cmd_ts = []
+    #
+    # all the projects go to a single gen_file_stats.py, so projects in
+    # the same git repository share one git log.
     cmd_ts.append([None, os.path.join(SCRIPT_PATH,'gen_file_stats.py'),
-                   ['${interesting_file_option} ${not_interesting_file_option} ${case_sensitive_option} ${git_exe_option} ${svn_option} %s' % path_project \
-                    for path_project in paths_projects]])
+                   ['${interesting_file_option} ${not_interesting_file_option} ${case_sensitive_option} ${git_exe_option} ${max_size_option} ${since_option} ${hunks_option} ${only_option} ${sample_option} ${journal_option} ${svn_option} %s' % \
+                    ' '.join(paths_projects)]])
     cmd_ts.append([os.path.join(SCRIPT_PATH,'gen_file_stats.py'),
-        os.path.join(SCRIPT_PATH,'estimate_unique_knowledge.py'), '${model_option}'])
+        os.path.join(SCRIPT_PATH,'estimate_unique_knowledge.py'), '${model_option} ${snapshots_option}'])
     cmd_ts.append([os.path.join(SCRIPT_PATH,'estimate_unique_knowledge.py'),
-        os.path.join(SCRIPT_PATH,'estimate_file_risk.py'), '-b ${bus_risk} ${risk_file_option}'])
+        os.path.join(SCRIPT_PATH,'estimate_file_risk.py'), '-b ${bus_risk} ${risk_file_option} ${snapshot_dir_option}'])
+    if options.db:
+        # load the results into output_dir/results.db, and render the
+        # summary from there.
+        cmd_ts.append([os.path.join(SCRIPT_PATH,'estimate_file_risk.py'),
+            os.path.join(SCRIPT_PATH,'results_db.py'), '${db_fname}'])
     cmd_ts.append([os.path.join(SCRIPT_PATH,'estimate_file_risk.py'),
-        os.path.join(SCRIPT_PATH,'summarize.py'), '${departed_dev_option} ${output_dir}'])
+        os.path.join(SCRIPT_PATH,'summarize.py'), '${departed_dev_option} ${snapshot_dir_option} ${sample_manifest_option} ${db_option} ${index_only_option} ${bundle_option} ${aggs_option} ${memory_budget_option} ${output_dir}'])
                   
     for cmd_t in cmd_ts:
         if len(cmd_t) > 2:
@@ -141,15 +445,58 @@ def main(python_cmd, paths_projects, options):
                                                 not_interesting_file_option=not_interesting_file_option,
                                                 case_sensitive_option=case_sensitive_option,
                                                 git_exe_option=git_exe_option,
+                                                max_size_option=max_size_option,
+                                                since_option=since_option,
+                                                hunks_option=hunks_option,
+                                                only_option=only_option,
+                                                sample_option=sample_option,
+                                                sample_manifest_option=sample_manifest_option,
+                                                journal_option=journal_option,
                                                 svn_option=svn_option,
                                                 model_option=model_option,
+                                                snapshots_option=snapshots_option,
+                                                snapshot_dir_option=snapshot_dir_option,
+                                                db_fname=db_fname,
+                                                db_option=db_option,
+                                                index_only_option=index_only_option,
+                                                bundle_option=bundle_option,
+                                                aggs_option=aggs_option,
+                                                memory_budget_option=memory_budget_option,
                                                 output_dir=output_dir) \
                          for s in opts_args]
             cmd_t[2] = opts_args
 
-    run_chained(cmd_ts, python_cmd, output_dir, options.verbose)
+    run_metrics = read_metrics(output_dir)
+    if selected:
+        departed_devs = []
+        if options.departed_dev_file:
+            parse_departed_devs(options.departed_dev_file, departed_devs)
+        run_selected(cmd_ts, python_cmd, output_dir, tsv_index.Selection(options.only, options.files), departed_devs,
+                     options.verbose, run_metrics, options.profile)
+    else:
+        run_chained(cmd_ts, python_cmd, output_dir, options.verbose, run_metrics, options.profile, options.compress)
+    write_metrics(output_dir, run_metrics)
+
+    if options.serve:
+        serve_f = None
+        if not options.db:
+            serve_f = open(stage_io.existing(output_fname_for('estimate_file_risk.py', output_dir)), 'rb')
+        cmd = [x for x in ' '.join([python_cmd, os.path.join(SCRIPT_PATH, 'summarize.py'), '--serve %d' % options.serve,
+                                    departed_dev_option, snapshot_dir_option, db_option]).split(' ') if x]
+        if options.verbose:
+            print >> sys.stderr, cmd
+        # runs until interrupted
+        try:
+            Popen(cmd, stdin=serve_f).wait()
+        except KeyboardInterrupt:
+            pass
     
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['query']:
+        import file_query
+        file_query.main(sys.argv[2:])
+        sys.exit(0)
+
     usage = """usage: %prog [options] [git_controlled_path1[=project_name1], git_controlled_path2[=project_name2],...]
 
                Analyze each git controlled path and create an html summary of orphaned / at-risk code knowledge.
@@ -188,14 +535,66 @@ if __name__ == '__main__':
     parser.add_option('-c', '--continue-last', dest='continue_last', default=False, action="store_true",
                       help="Continue last run, using existing output files and recreating missing.  You can remove tsv files " + \
                       "in the output dir and modify others to clean up bad runs.")
+    parser.add_option('--compress', dest='compress', metavar='gz|bz2|xz',
+                      help='Compress the tsv of each stage as it is written, into output_dir/STAGE.tsv.gz and so on ' + \
+                      '(xz needs the lzma module).  Every stage reads compressed input as well')
+    parser.add_option('--only', dest='only', metavar='REGEXP', action='append', default=[],
+                      help='Only run the files whose project:path matches REGEXP again, updating the results of the ' + \
+                      'last run in the output dir for them (git only, may be repeated)')
+    parser.add_option('--files', dest='files', metavar='FILE',
+                      help='Like --only, for the files listed as project:path in FILE, one per line')
+    parser.add_option('--keep-aggs', dest='keep_aggs', default=False, action='store_true',
+                      help='Save the aggregates of the summary to output_dir/summarize.aggs, so later --only and ' + \
+                      '--files runs update them rather than summarizing everything again (those runs always save them)')
+    parser.add_option('--profile', dest='profile', default=False, action='store_true',
+                      help='Profile each stage, writing stage.pstats, stage.collapsed.txt and stage.profile.txt into the ' + \
+                      'output dir.  The gen_file_stats.py stage is only sampled, so has no .pstats.')
     parser.add_option('-v', '--verbose', dest='verbose', default=False, action="store_true", help="Print debugging info")
     parser.add_option('--python-exe', dest='python_exe', default='/usr/bin/env python',
                       help='Path to the python interpreter (defaults to "/usr/bin/env python")')
     parser.add_option('--git-exe', dest='git_exe', help='Path to the git exe (defaults to "/usr/bin/env git")')
     parser.add_option('--svn', dest='use_svn', default=False, action='store_true',
                       help='Use svn intead of git to generate file statistics.  This requires you to install pysvn in your PYTHONPATH.')
-    parser.add_option('--model', dest='model', metavar='MODEL[:MARG1[:MARG2]...]', default='sequential:0.1',
-                      help='Knowledge model to use, with arguments.  Right now only sequential is supported.')
+    parser.add_option('--max-size', dest='max_size', metavar='BYTES', type='int', default=None,
+                      help='Skip files bigger than BYTES in HEAD (git only, defaults to no size limit).  Binary, ' + \
+                      'linguist-generated and linguist-vendored files are always skipped')
+    parser.add_option('--since', dest='since', metavar='DATE|COMMIT',
+                      help='Only read the history after this commit or YYYY-MM-DD date, crediting the lines that survive ' + \
+                      'from before it to their authors with git blame.  Much faster on long histories (git only)')
+    parser.add_option('--sample-fraction', dest='sample_fraction', metavar='FLOAT', type='float',
+                      help='Only analyze this fraction of the files, chosen at random from each directory of each project, ' + \
+                      'and estimate the totals per project and dev with confidence intervals, without per-file pages (git only)')
+    parser.add_option('--sample-size', dest='sample_size', metavar='N', type='int',
+                      help='Like --sample-fraction, but analyze about N files in all')
+    parser.add_option('--sample-seed', dest='sample_seed', metavar='SEED', default='0',
+                      help='Seed for choosing the sampled files (defaults to 0)')
+    parser.add_option('--db', dest='db', default=False, action='store_true',
+                      help='Also load the results into a SQLite database, output_dir/results.db, for query.py, ' + \
+                      'and render the summary from it')
+    parser.add_option('--serve', dest='serve', metavar='PORT', type='int',
+                      help='Only write index.html, then serve the project, dev and file pages on localhost:PORT, ' + \
+                      'rendering them on request')
+    parser.add_option('--bundle', dest='bundle', default=False, action='store_true',
+                      help='Write the summary as a few hundred JSON shards and a single page to view them, ' + \
+                      'instead of a page per project, dev and file')
+    parser.add_option('--memory-budget', dest='memory_budget', metavar='MB', type='int',
+                      help='Keep the summary\'s aggregates in about MB megabytes of memory, spilling the rest to sorted ' + \
+                      'runs on disk, for runs too big to summarize in memory')
+    parser.add_option('--model', dest='models', metavar='MODEL[:MARG1[:MARG2]...]', action='append',
+                      help='Knowledge model to use, with arguments: sequential:CHURN_CONSTANT (the default, sequential:0.1) ' + \
+                      'replays the history, positional:CHURN_CONSTANT replays the hunks of each revision onto the lines ' + \
+                      'they change (git only), blame credits the lines in HEAD to whoever last changed them (git only).  ' + \
+                      'Repeat to also estimate with other models in the same pass, into output_dir/models; ' + \
+                      'the summary is of the first')
+    parser.add_option('--jobs', dest='jobs', metavar='N', type='int', default=4,
+                      help='Number of git blames the blame model runs at once (defaults to 4)')
+    parser.add_option('--cache-dir', dest='cache_dir', metavar='DIRNAME',
+                      help='Where the blame model caches blames between runs (defaults to ~/.git_by_a_bus_cache)')
+    parser.add_option('--memo-dir', dest='memo_dir', metavar='DIRNAME',
+                      help='Keep the knowledge estimates of each file history in DIRNAME, so later runs needn\'t redo them')
+    parser.add_option('--snapshots', dest='snapshots', metavar='monthly|DATE[,DATE...]',
+                      help='Also estimate the knowledge and risk as of the start of every month, or of each YYYY-MM-DD date, ' + \
+                      'and chart the trends in trends.html (git only)')
 
     options, paths_projects = parser.parse_args()
 
@@ -203,6 +602,25 @@ if __name__ == '__main__':
         if not read_projects_file(options.projects_file, paths_projects):
             exit_with_error("Could not read projects file %s" % options.projects_file)
 
+    if options.serve and (options.sample_fraction is not None or options.sample_size is not None):
+        parser.error('--serve is not supported for sampled runs')
+
+    if options.compress and options.compress not in stage_io.compressions():
+        parser.error('--compress must be one of %s' % ', '.join(stage_io.compressions()))
+
+    if options.bundle and (options.serve or options.sample_fraction is not None or options.sample_size is not None):
+        parser.error('--bundle does not go with --serve or sampled runs')
+
+    if options.memory_budget and (options.serve or options.bundle or options.sample_fraction is not None or \
+                                  options.sample_size is not None):
+        parser.error('--memory-budget does not go with --serve, --bundle or sampled runs')
+
+    if options.only or options.files:
+        if options.use_svn or options.snapshots or options.db or options.serve or options.bundle or options.compress or \
+           options.sample_fraction is not None or options.sample_size is not None or len(options.models or []) > 1:
+            parser.error('--only and --files do not go with --svn, --snapshots, --db, --serve, --bundle, --compress, ' + \
+                         'sampled runs or more than one --model')
+
     if not paths_projects:
         parser.error('No paths/projects!  You must either specify paths/projects on the command line and/or in a file with the -p option.')
     
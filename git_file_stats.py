@@ -1,7 +1,9 @@
 """
 Module to generate file stats using git.
 
-The only function here intended for external consumption is gen_stats.
+The only functions here intended for external consumption are
+gen_stats, gen_stats_multi and gen_stats_progress, and the git_blame_*
+helpers used by the blame knowledge model.
 
 Output of gen_stats should be exactly the same as the output of
 git_file_stats.gen_stats, but in practice they may differ by a line or
@@ -11,10 +13,13 @@ two (appears to be whitespace handling, perhaps line endings?)
 import sys
 import os
 import re
+import hashlib
 
 from subprocess import Popen, PIPE
 
-from common import is_interesting, FileData, safe_author_name
+from common import FileData, safe_author_name
+from file_filter import FileFilter
+import metrics
     
 def gen_stats(root, project, interesting, not_interesting, options):
     """
@@ -30,29 +35,272 @@ def gen_stats(root, project, interesting, not_interesting, options):
     indicate a path is not interesting.
 
     options: from gen_file_stats.py's main, currently only uses
-    git_exe.
+    git_exe, max_size, since and hunks, and report_skipped if it has
+    one (see print_skipped).
 
     Yields FileData objects encoded as tsv lines.  Only the fname,
     dev_experience and cnt_lines fields are filled in.
     """
+    return gen_stats_multi([(root, project)], interesting, not_interesting, options)
+
+def gen_stats_multi(roots_projects, interesting, not_interesting, options):
+    """
+    Same as gen_stats, for a list of (root, project) tuples.  Yields
+    the lines for each project in turn, exactly as separate gen_stats
+    calls would.
+
+    Projects that live in the same git repository (e.g. several
+    subdirectories of one monorepo) share the history: it is read from
+    a single git log of the repository (see walk_history) rather than
+    one per file, except with hunks.  The history of a file is read
+    once no matter how many projects include it.
+    """
+    for ordinal, fname, fd_line in gen_stats_progress(roots_projects, interesting, not_interesting, options):
+        if fd_line:
+            yield fd_line
+
+def gen_stats_progress(roots_projects, interesting, not_interesting, options, done=None, shard=None, sample=None,
+                       only=None):
+    """
+    Does the work for gen_stats_multi, but yields (ordinal, fname,
+    line) for every file it has finished with, where fname is
+    project:path and line is None if the file had no history worth a
+    line.  This lets callers keep track of which files are complete.
+
+    ordinal is the position of the file in the full listing of all
+    projects, so output from different runs (e.g. shards) can be put
+    back in the order a single run would produce.
+
+    done: optional set of fnames finished by an earlier run, which are
+    skipped.
+
+    shard: optional (shard_index, n_shards) tuple, only files whose
+    path falls in that shard (see shard_of) are done.
+
+    sample: optional sampling.Sample, only the files it chooses from
+    each project are done.
+
+    only: optional function of fname, only the files it is true for
+    are done (see tsv_index.Selection).
+    """
     git_exe = options.git_exe
+    file_filter = FileFilter(interesting, not_interesting)
 
-    # since git only works once you're in a git controlled path, we
-    # need to get into one of those...
-    prepare(root, git_exe)
+    # list all the projects first, so we know how many projects will
+    # need the history of each file.
+    listings = []
+    n_needed = {}
+    # git root -> (sha, commit time) of the --since cutoff commit, or
+    # None for the whole history
+    cutoffs = {}
+    # git root -> the roots of its projects, relative to it
+    roots_at = {}
+    ordinal = 0
+    for root, project in roots_projects:
+        # since git only works once you're in a git controlled path, we
+        # need to get into one of those...
+        prepare(root, git_exe)
+        top = os.getcwd()
+        if top not in cutoffs:
+            cutoffs[top] = None
+            if getattr(options, 'since', None):
+                cutoffs[top] = git_cutoff(options.since, git_exe)
+        roots_at.setdefault(top, []).append(repo_relative(root))
+        files = []
+        for f in list_files(root, project, file_filter, git_exe, options, only):
+            if shard is None or shard_of(f, shard[1]) == shard[0]:
+                files.append((ordinal, f))
+            ordinal += 1
+        listings.append((top, project, files))
 
-    files = git_ls(root, git_exe)
+    if sample:
+        sample.set_population(sum([len(files) for top, project, files in listings]))
+        listings = [(top, project, sample.choose(project, files, key=lambda ordinal_f: ordinal_f[1]))
+                    for top, project, files in listings]
 
-    for f in files:
-        if is_interesting(f, interesting, not_interesting):
-            dev_experience = parse_dev_experience(f, git_exe)
+    for top, project, files in listings:
+        for o, f in files:
+            n_needed[(top, f)] = n_needed.get((top, f), 0) + 1
+
+    # (dev_experience, exp_times, exp_hunks, cnt_lines) of files that projects still to
+    # come will need again, dropped once the last one has them.
+    shared = {}
+    # git roots whose history has been walked
+    walked = set()
+
+    for top, project, files in listings:
+        os.chdir(top)
+        if top not in walked and len(roots_at[top]) > 1 and not getattr(options, 'hunks', False):
+            # one git log for all the projects in the repository,
+            # rather than one per file
+            walked.add(top)
+            needed = sorted(set([f for t, p, fs in listings if t == top
+                                 for o, f in fs if not (done and ':'.join([p, f]) in done)]))
+            histories, left_out = walk_history(roots_at[top], needed, git_exe, cutoffs[top])
+            for f, (dev_experience, exp_times) in histories.items():
+                cnt_lines = None
+                if dev_experience:
+                    cnt_lines = count_lines(f)
+                shared[(top, f)] = (dev_experience, exp_times, [], cnt_lines)
+        for ordinal, f in files:
+            key = (top, f)
+            fname = ':'.join([project, f])
+            n_needed[key] -= 1
+            if done and fname in done:
+                if not n_needed[key]:
+                    del n_needed[key]
+                    shared.pop(key, None)
+                continue
+            if key in shared:
+                dev_experience, exp_times, exp_hunks, cnt_lines = shared[key]
+            else:
+                dev_experience, exp_times, exp_hunks = parse_dev_experience(f, git_exe, cutoffs[top],
+                                                                            getattr(options, 'hunks', False))
+                cnt_lines = None
+                if dev_experience:
+                    cnt_lines = count_lines(f)
+                shared[key] = (dev_experience, exp_times, exp_hunks, cnt_lines)
+            if not n_needed[key]:
+                del n_needed[key]
+                del shared[key]
+
+            fd_line = None
             if dev_experience:
-                fd = FileData(':'.join([project, f]))
+                fd = FileData(fname)
                 fd.dev_experience = dev_experience
-                fd.cnt_lines = count_lines(f)
+                fd.exp_times = exp_times
+                fd.exp_hunks = exp_hunks
+                fd.cnt_lines = cnt_lines
                 fd_line = fd.as_line()
-                if fd_line.strip():
-                    yield fd_line
+                if not fd_line.strip():
+                    fd_line = None
+            yield ordinal, fname, fd_line
+
+def shard_of(f, n_shards):
+    """
+    The shard a path belongs to.  Uses a hash of the path within the
+    repository rather than the project, so a file shared by several
+    projects is only scanned by one shard, and assignments are the
+    same across machines and runs.
+    """
+    return int(hashlib.md5(f).hexdigest()[:8], 16) % n_shards
+
+def list_files(root, project, file_filter, git_exe, options, only=None):
+    """
+    Given that prepare has chdir'd us to the git root, list the
+    interesting files under root worth running the history for, of
+    those only is true for if given.
+    """
+    pathspecs = file_filter.pathspecs(repo_relative(root))
+
+    files = git_ls(root, git_exe, pathspecs, long_format=True)
+    files = file_filter.filter(files, key=lambda f_size: f_size[0])
+    if only:
+        files = [(f, size) for f, size in files if only(':'.join([project, f]))]
+
+    # drop binary, generated and oversized files before we pay for
+    # their logs.
+    skipped = {}
+    files = list(skip_files(files, git_exe, getattr(options, 'max_size', None), skipped))
+
+    metrics.incr('files_interesting', len(files) + sum(skipped.values()))
+    for reason, cnt in skipped.items():
+        metrics.incr('files_skipped', cnt)
+        metrics.incr('files_skipped_%s' % reason.replace(' ', '_').replace('-', '_'), cnt)
+
+    if skipped:
+        getattr(options, 'report_skipped', print_skipped)(project, skipped)
+    return files
+
+def print_skipped(project, skipped):
+    """
+    The default options.report_skipped: tells the user on stderr how
+    many files of project were skipped, given {reason: count}.
+    """
+    print >> sys.stderr, "Skipped %d files in %s: %s" % \
+          (sum(skipped.values()), project,
+           ', '.join(['%s %d' % (reason, cnt) for reason, cnt in sorted(skipped.items())]))
+
+# attributes that mark a file as not worth running the history for,
+# see gitattributes(5) and github linguist.
+SKIP_ATTRS = ['binary', 'linguist-generated', 'linguist-vendored']
+
+# git considers a file binary if there is a NUL in the first this many
+# bytes.
+BINARY_SNIFF_BYTES = 8000
+
+# number of paths to check attributes for in a single git check-attr.
+CHECK_ATTR_BATCH = 1000
+
+def skip_files(files, git_exe, max_size, skipped):
+    """
+    files: iterable of (path, size) as yielded by git_ls with
+    long_format.
+
+    max_size: skip files bigger than this many bytes, None for no
+    limit.
+
+    skipped: dictionary of reason -> count of files skipped for that
+    reason, updated as we go.
+
+    Yields the paths of files that are worth running the history for.
+    """
+    batch = []
+    for f, size in files:
+        if max_size is not None and size is not None and size > max_size:
+            skipped['too large'] = skipped.get('too large', 0) + 1
+            continue
+        batch.append(f)
+        if len(batch) >= CHECK_ATTR_BATCH:
+            for f in skip_by_content(batch, git_exe, skipped):
+                yield f
+            batch = []
+    for f in skip_by_content(batch, git_exe, skipped):
+        yield f
+
+def skip_by_content(batch, git_exe, skipped):
+    attrs = git_check_attr(batch, git_exe)
+    for f in batch:
+        reason = attrs.get(f)
+        if not reason and is_binary(f):
+            reason = 'binary'
+        if reason:
+            skipped[reason] = skipped.get(reason, 0) + 1
+        else:
+            yield f
+
+def git_check_attr(files, git_exe):
+    """
+    Returns a dictionary of path -> the first of SKIP_ATTRS set for
+    that path, for those of files with any set.
+    """
+    if not files:
+        return {}
+    # -z = null byte separate input and output
+    # --stdin = read the paths from stdin rather than the command line
+    git_cmd = ('%s check-attr -z --stdin' % git_exe).split(' ')
+    git_cmd.extend(SKIP_ATTRS)
+    out = git_output(git_cmd, '\0'.join(files) + '\0')
+    # output is path, attribute, value triples
+    fields = out.split('\0')
+    attrs = {}
+    for i in range(0, len(fields) - 2, 3):
+        f, attr, value = fields[i:i + 3]
+        if value in ('set', 'true') and f not in attrs:
+            attrs[f] = attr
+    return attrs
+
+def is_binary(f):
+    """
+    Use the same check git does: a NUL byte near the start of the file.
+    """
+    try:
+        fil = open(f, 'rb')
+    except IOError:
+        return False
+    head = fil.read(BINARY_SNIFF_BYTES)
+    fil.close()
+    return '\0' in head
 
 
 def count_lines(f):
@@ -63,81 +311,553 @@ def count_lines(f):
     fil.close()
     return count
 
-def parse_experience(log):
+# starts each commit of the logs parse_history parses (see
+# NUMSTAT_FORMAT), a byte that doesn't turn up in author names
+COMMIT_MARK = '\x01'
+
+# --format of the git log --numstat runs parse_history parses: the mark,
+# then the author name and commit time on separate lines
+NUMSTAT_FORMAT = '--format=format:%x01%an%n%ct'
+
+def parse_count(s):
     """
-    Parse the dev experience from the git log.
+    A line count of git log --numstat, None for the - of a binary file.
     """
-    # list of tuple of shape [(dev, lines_add, lines_removed), ...]
-    exp = []
+    if s == '-':
+        return None
+    return int(s)
 
-    # entry lines were zero separated with -z
-    entry_lines = log.split('\0')
+def parse_history(fields):
+    """
+    Parse the NUL separated fields of a git log -z --numstat run with
+    NUMSTAT_FORMAT, of a single file or of a whole repository.
 
-    current_entry = []
-    
-    for entry_line in entry_lines:
-        if not entry_line.strip():
-            # blank entry line marks the end of an entry, we're ready to process
-            local_entry = current_entry
-            current_entry = []
-            if len(local_entry) < 2:
-                print >> sys.stderr, "Weird entry, cannot parse: %s\n-----" % '\n'.join(local_entry)
-                continue
-            author, changes = local_entry[:2]
-            author = safe_author_name(author)
+    Yields (author, commit time, [(lines added, lines removed, path
+    before, path after), ...]) for each commit, newest first.  The line
+    counts are None for binary files, and the paths are the same unless
+    the file was renamed or copied.  Commits without any changes shown
+    (merges, or only whitespace changed with -w) have none.
+    """
+    fields = iter(fields)
+    commit = None
+    for field in fields:
+        if field.startswith(COMMIT_MARK):
+            if commit:
+                yield commit
+            commit = None
+            # the first change of the commit follows the commit time
+            header = field[len(COMMIT_MARK):].split('\n', 2)
             try:
-                changes_split = re.split(r'\s+', changes)
-                # this can be two fields if there were file renames
-                # detected, in which case the file names are on the
-                # following entry lines, or three fields (third being
-                # the filename) if there were no file renames
-                lines_added, lines_removed = changes_split[:2]
-                lines_added = int(lines_added)
-                lines_removed = int(lines_removed)
-
-                # don't record revisions that don't have any removed or
-                # added lines...they mean nothing to our algorithm
-                if lines_added or lines_removed:
-                    exp.append((author, lines_added, lines_removed))
-            except ValueError:
-                print >> sys.stderr, "Weird entry, cannot parse: %s\n-----" % '\n'.join(local_entry)                    
+                commit = (safe_author_name(header[0].strip()), int(header[1].strip()), [])
+            except (IndexError, ValueError):
+                metrics.incr('weird_entries')
+                print >> sys.stderr, "Weird entry, cannot parse: %s\n-----" % field[len(COMMIT_MARK):]
                 continue
-        else:
-            # continue to aggregate the entry
-            lines = entry_line.split('\n')
-            current_entry.extend([line.strip() for line in lines])
+            if len(header) < 3:
+                continue
+            field = header[2]
+        if not field.strip() or commit is None:
+            continue
+        # added<TAB>removed<TAB>path, or with an empty path if the file
+        # was renamed or copied, in which case the paths before and
+        # after are the next two fields
+        changes = field.split('\t', 2)
+        try:
+            if len(changes) < 3:
+                raise ValueError(field)
+            added, removed, path = changes
+            old = new = path
+            if not path:
+                old = fields.next()
+                new = fields.next()
+            commit[2].append((parse_count(added.strip()), parse_count(removed.strip()), old, new))
+        except (ValueError, StopIteration):
+            metrics.incr('weird_entries')
+            print >> sys.stderr, "Weird entry, cannot parse: %s\n-----" % field
+    if commit:
+        yield commit
+
+def parse_experience(log, paths=None):
+    """
+    Parse the dev experience from the git log --follow of a file, see
+    parse_history.
+
+    Returns ([(dev, lines_added, lines_removed), ...], [commit_time,
+    ...]), oldest revision first.
+
+    If paths is given, appends the path the file had before each
+    revision to it, newest revision first.
+    """
+    # list of tuple of shape [(dev, lines_add, lines_removed), ...]
+    exp = []
+    # commit time of each revision in exp
+    times = []
+
+    for author, commit_time, changes in parse_history(log.split('\0')):
+        # the log of a single file only shows the changes to it
+        for lines_added, lines_removed, old, new in changes[:1]:
+            if paths is not None:
+                paths.append(old)
+            # don't record revisions that don't have any removed or
+            # added lines, or of binary files...they mean nothing to
+            # our algorithm
+            if lines_added or lines_removed:
+                exp.append((author, lines_added, lines_removed))
+                times.append(commit_time)
+
+    metrics.incr('revisions_parsed', len(exp))
 
     # we need the oldest log entries first.
     exp.reverse()
-    return exp
+    times.reverse()
+    return exp, times
             
-def parse_dev_experience(f, git_exe):
+# matches a hunk header of git log -p -U0, '@@ -start[,removed] +start[,added] @@'
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@')
+
+def parse_hunk_experience(log, paths=None):
+    """
+    Parse the dev experience from a git log -p -U0 with each entry
+    starting with a NUL, as run by parse_dev_experience with hunks.
+
+    Returns the same as parse_experience, along with [[(start,
+    lines_removed, lines_added), ...], ...], the hunks of each
+    revision as git gives them: start is the line in the file before
+    the revision the hunk removes from, or inserts after if it removes
+    nothing.  The lines added and removed are the totals of the hunks.
+    """
+    exp = []
+    times = []
+    hunks = []
+
+    if not log:
+        return exp, times, hunks
+
+    # the first entry starts with the first NUL
+    for entry in log.split('\0')[1:]:
+        entry_lines = entry.split('\n')
+        try:
+            author = safe_author_name(entry_lines[0].strip())
+            commit_time = int(entry_lines[1])
+        except (IndexError, ValueError):
+            metrics.incr('weird_entries')
+            print >> sys.stderr, "Weird entry, cannot parse: %s\n-----" % entry
+            continue
+
+        rev_hunks = []
+        path = None
+        # the diff headers, up to the first hunk of each diff, are the
+        # only place the file names are
+        in_header = False
+        for line in entry_lines[2:]:
+            if line.startswith('diff --git '):
+                in_header = True
+            elif line.startswith('@@ '):
+                in_header = False
+                m = HUNK_RE.match(line)
+                if not m:
+                    metrics.incr('weird_hunks')
+                    continue
+                start, removed, added = m.groups()
+                rev_hunks.append((int(start), int(removed or 1), int(added or 1)))
+            elif in_header and path is None:
+                # --no-prefix, so these are the bare paths
+                if line.startswith('rename from '):
+                    path = line[len('rename from '):]
+                elif line.startswith('--- ') and line != '--- /dev/null':
+                    path = line[len('--- '):]
+                elif line.startswith('+++ ') and line != '+++ /dev/null':
+                    path = line[len('+++ '):]
+        if paths is not None and path is not None:
+            paths.append(path)
+
+        lines_removed = sum([removed for start, removed, added in rev_hunks])
+        lines_added = sum([added for start, removed, added in rev_hunks])
+        if lines_added or lines_removed:
+            exp.append((author, lines_added, lines_removed))
+            times.append(commit_time)
+            hunks.append(rev_hunks)
+
+    metrics.incr('revisions_parsed', len(exp))
+    metrics.incr('hunks_parsed', sum([len(rev_hunks) for rev_hunks in hunks]))
+
+    exp.reverse()
+    times.reverse()
+    hunks.reverse()
+    return exp, times, hunks
+
+def parse_dev_experience(f, git_exe, cutoff=None, hunks=False):
     """
     Run git log and parse the dev experience out of it.
+
+    Returns (dev_experience, exp_times, exp_hunks), where exp_hunks is
+    [] unless hunks is set, in which case the patch of each revision is
+    read as well (see parse_hunk_experience).
+
+    cutoff: optional (sha, commit time) of the commit to start the
+    history at.  The lines of the file that survive at the cutoff are
+    credited to their authors by a blame at the cutoff (see
+    blame_baseline), and only the revisions after it are read from the
+    log.  With hunks, each author's surviving lines are taken to be
+    one block, one after the other.
     """
+    if hunks:
+        # -p -U0 = the patch of each revision, with no context lines,
+        #   so each hunk header gives exactly the lines changed
+        # --no-prefix = no a/ and b/ on the paths in the diff headers
+        # --no-ext-diff --no-textconv = line numbers of the file itself
+        # --format=format:%x00%an%n%ct = a NUL to start each entry,
+        #   then the author name and commit time on separate lines
+        git_cmd = ("%s log -w --follow -p -U0 --no-prefix --no-ext-diff --no-textconv --format=format:%%x00%%an%%n%%ct" %
+                   git_exe).split(' ')
+        if not cutoff:
+            git_cmd.append(f)
+            return parse_hunk_experience(git_output(git_cmd))
+        git_cmd.extend(['%s..HEAD' % cutoff[0], '--', f])
+        paths = []
+        exp, times, exp_hunks = parse_hunk_experience(git_output(git_cmd), paths)
+        path = f
+        if paths:
+            path = paths[-1]
+        baseline = blame_baseline(path, cutoff[0], git_exe)
+        baseline_hunks = []
+        n_lines = 0
+        for dev, lines, removed in baseline:
+            baseline_hunks.append([(n_lines, 0, lines)])
+            n_lines += lines
+        return baseline + exp, [cutoff[1]] * len(baseline) + times, baseline_hunks + exp_hunks
+
     # -z = null byte separate logs
     # -w = ignore all whitespace when calculating changed lines
     # --follow = follow file history through renames
     # --numstat = print a final ws separated line of the form 'num_added_lines num_deleted_lines file_name'
-    # --format=format:%an = use only the author name for the log msg format
-    git_cmd = ("%s log -z -w --follow --numstat --format=format:%%an" % git_exe).split(' ')
-    git_cmd.append(f)
+    # NUMSTAT_FORMAT = use only the author name and commit time for the
+    #   log msg format, see parse_history
+    git_cmd = ("%s log -z -w --follow --numstat" % git_exe).split(' ')
+    git_cmd.append(NUMSTAT_FORMAT)
+    if not cutoff:
+        git_cmd.append(f)
+        return parse_experience(git_output(git_cmd)) + ([],)
+
+    git_cmd.extend(['%s..HEAD' % cutoff[0], '--', f])
+    paths = []
+    exp, times = parse_experience(git_output(git_cmd), paths)
+    # the oldest revision since the cutoff tells us what the file was
+    # called at the cutoff
+    path = f
+    if paths:
+        path = paths[-1]
+    baseline = blame_baseline(path, cutoff[0], git_exe)
+    return baseline + exp, [cutoff[1]] * len(baseline) + times, []
+
+def read_fields(fil, chunk_size=1 << 16):
+    """
+    Yields the NUL separated fields of fil as they are read, rather
+    than reading all of it into memory first.
+    """
+    rest = ''
+    while True:
+        chunk = fil.read(chunk_size)
+        if not chunk:
+            break
+        metrics.incr('git_bytes_read', len(chunk))
+        fields = (rest + chunk).split('\0')
+        rest = fields.pop()
+        for field in fields:
+            yield field
+    yield rest
+
+def is_under(path, roots):
+    for root in roots:
+        if not root or path == root or path.startswith(root + '/'):
+            return True
+    return False
+
+def walk_history(roots, files, git_exe, cutoff=None):
+    """
+    Given that prepare has chdir'd us to the git root, read the
+    history of files (paths relative to it) from a single git log of
+    the commits that touch roots (paths relative to it, '' for all of
+    it), rather than a git log --follow per file.
+
+    Each file's history is followed back through renames and copies as
+    --follow does: git detects them in the whole diff of each commit,
+    copies from unchanged files included, and the file is taken to
+    have been at the path it was renamed or copied from before that.
+    The history of a file that came from outside roots goes further
+    back than the log does, so it is left to parse_dev_experience.
+
+    cutoff: as for parse_dev_experience.
+
+    Returns ({path: (dev_experience, exp_times)}, [path, ...] of the
+    files left out).
+    """
+    # -C --find-copies-harder = detect renames and copies, from
+    #   unchanged files too, as --follow does
+    # -l0 = however many files a commit adds
+    # --full-diff = the changes to every file of the commits that
+    #   touch roots, so renames from outside them are seen
+    git_cmd = ('%s log -z -w -C --find-copies-harder -l0 --full-diff --numstat' % git_exe).split(' ')
+    git_cmd.append(NUMSTAT_FORMAT)
+    if cutoff:
+        git_cmd.append('%s..HEAD' % cutoff[0])
+    if '' not in roots:
+        git_cmd.append('--')
+        git_cmd.extend(roots)
+
+    # path -> the files whose history is at that path, as of the
+    # commit the log is at
+    followed = {}
+    # file -> the path its history is at
+    at = {}
+    exp = {}
+    times = {}
+    for f in files:
+        followed.setdefault(f, []).append(f)
+        at[f] = f
+        exp[f] = []
+        times[f] = []
+    left_out = []
+
+    metrics.incr('git_processes')
+    metrics.incr('history_walks')
     git_p = Popen(git_cmd, stdout=PIPE)
-    (out, err) = git_p.communicate()
-    return parse_experience(out)
+    for author, commit_time, changes in parse_history(read_fields(git_p.stdout)):
+        moves = []
+        for lines_added, lines_removed, old, new in changes:
+            if new not in followed:
+                continue
+            # don't record revisions that don't have any removed or
+            # added lines, or of binary files
+            if lines_added or lines_removed:
+                for f in followed[new]:
+                    exp[f].append((author, lines_added, lines_removed))
+                    times[f].append(commit_time)
+            if old != new:
+                moves.append((old, followed[new]))
+        # the paths before the commit, once all its changes are seen,
+        # since a file may have been renamed to where another one was
+        for old, fs in moves:
+            del followed[at[fs[0]]]
+        for old, fs in moves:
+            if not is_under(old, roots):
+                left_out.extend(fs)
+                continue
+            followed.setdefault(old, []).extend(fs)
+            for f in fs:
+                at[f] = old
+    git_p.wait()
+
+    histories = {}
+    for f in files:
+        if f in left_out:
+            continue
+        exp[f].reverse()
+        times[f].reverse()
+        metrics.incr('revisions_parsed', len(exp[f]))
+        if cutoff:
+            baseline = blame_baseline(at[f], cutoff[0], git_exe)
+            exp[f] = baseline + exp[f]
+            times[f] = [cutoff[1]] * len(baseline) + times[f]
+        histories[f] = (exp[f], times[f])
+    return histories, left_out
 
-def git_ls(root, git_exe):
+def git_cutoff(since, git_exe):
     """
-    List the entire tree that git is aware of in this directory.
+    Resolve since, a commit or a date, to (sha, commit time) of the
+    commit to start the history at, or None if the history starts
+    after it.
     """
+    git_cmd = ('%s rev-parse --verify -q' % git_exe).split(' ')
+    git_cmd.append('%s^{commit}' % since)
+    sha = git_output(git_cmd).strip()
+    if not sha:
+        # not a commit, so the last commit before the date
+        git_cmd = ('%s rev-list -1 HEAD' % git_exe).split(' ')
+        git_cmd.append('--before=%s' % since)
+        sha = git_output(git_cmd).strip()
+    if not sha:
+        return None
+    git_cmd = ('%s log -1 --format=format:%%ct' % git_exe).split(' ')
+    git_cmd.append(sha)
+    return sha, int(git_output(git_cmd).strip())
+
+def blame_baseline(f, cutoff_sha, git_exe):
+    """
+    Blame f at cutoff_sha, and return [(dev, lines, 0), ...] for the
+    lines each dev wrote that were still there, as the experience to
+    start the history after the cutoff from.  Returns [] if f didn't
+    exist at the cutoff.
+    """
+    # -w = ignore whitespace, like the log
+    # --incremental = a '<sha> <orig line> <final line> <num lines>'
+    #   line per block of lines, followed by the commit headers the
+    #   first time each commit is seen
+    git_cmd = ('%s blame -w --incremental' % git_exe).split(' ')
+    git_cmd.extend([cutoff_sha, '--', f])
+    out = git_output(git_cmd, stderr=PIPE)
+
+    sha_lines = {}
+    sha_author = {}
+    sha = None
+    for line in out.split('\n'):
+        fields = line.split(' ')
+        if len(fields) == 4 and len(fields[0]) in (40, 64) and fields[3].isdigit():
+            sha = fields[0]
+            sha_lines[sha] = sha_lines.get(sha, 0) + int(fields[3])
+        elif line.startswith('author ') and sha:
+            sha_author[sha] = safe_author_name(line[len('author '):])
+
+    dev_lines = {}
+    for sha, lines in sha_lines.items():
+        dev = sha_author.get(sha)
+        if dev:
+            dev_lines[dev] = dev_lines.get(dev, 0) + lines
+    if dev_lines:
+        metrics.incr('blame_baselines')
+    return [(dev, lines, 0) for dev, lines in sorted(dev_lines.items())]
+
+def git_ls(root, git_exe, pathspecs=None, long_format=False):
+    """
+    List the entire tree that git is aware of in this directory, or
+    only the parts of it under pathspecs if given (see
+    FileFilter.pathspecs).
+
+    Yields the paths as git lists them, rather than reading the whole
+    listing into memory first.  With long_format, yields (path, size)
+    instead, where size is None for things that aren't blobs
+    (e.g. submodules).
+    """
+    if pathspecs is not None and not pathspecs:
+        return
     # --full-tree = allow absolute path for final argument (pathname)
     # --name-only = don't show the git id for the object, just the file name
+    # -l = show the object size as well
     # -r = recurse
-    git_cmd = ('%s ls-tree --full-tree --name-only -r HEAD' % git_exe).split(' ')
-    git_cmd.append(root)
+    if long_format:
+        git_cmd = ('%s ls-tree --full-tree -l -r HEAD' % git_exe).split(' ')
+    else:
+        git_cmd = ('%s ls-tree --full-tree --name-only -r HEAD' % git_exe).split(' ')
+    if pathspecs:
+        git_cmd.append('--')
+        git_cmd.extend(pathspecs)
+    else:
+        git_cmd.append(root)
+    metrics.incr('git_processes')
     git_p = Popen(git_cmd, stdout=PIPE)
-    files = git_p.communicate()[0].split('\n')
-    return files
+    for line in git_p.stdout:
+        metrics.incr('git_bytes_read', len(line))
+        metrics.incr('files_listed')
+        line = line.rstrip('\n')
+        if not long_format:
+            yield line
+            continue
+        if not line:
+            continue
+        # <mode> SP <type> SP <object> SP <object size> TAB <file>
+        meta, f = line.split('\t', 1)
+        size = meta.split()[3]
+        if size == '-':
+            size = None
+        else:
+            size = int(size)
+        yield f, size
+    git_p.wait()
+
+def git_blame_owners(f, git_exe, cwd):
+    """
+    Blame f at HEAD in the git repository at cwd, and return [(dev,
+    lines), ...] for the lines each dev last changed.
+    """
+    # -w = ignore whitespace, like the log
+    # --line-porcelain = full commit headers, including author, for
+    #   every line
+    git_cmd = ('%s blame -w --line-porcelain HEAD --' % git_exe).split(' ')
+    git_cmd.append(f)
+    out = git_output(git_cmd, stderr=PIPE, cwd=cwd)
+    dev_lines = {}
+    for line in out.split('\n'):
+        # the lines of the file itself start with a tab, so can't be
+        # mistaken for headers
+        if line.startswith('author '):
+            dev = safe_author_name(line[len('author '):])
+            dev_lines[dev] = dev_lines.get(dev, 0) + 1
+    return sorted(dev_lines.items())
+
+def git_blame_keys(git_exe, cwd, subdir='', since_keys=None):
+    """
+    For the files in HEAD of the git repository at cwd, under subdir
+    if given, return a dictionary of path -> (blob sha, sha of the
+    last commit that touched the path).  Together they pin down what a
+    blame of the path at HEAD would say, so they make a cache key for
+    it.
+
+    since_keys: optional (commit, {path: (blob sha, last commit)}) as
+    returned for an ancestor commit of HEAD, in which case only the
+    commits since it are walked, and paths none of them touched keep
+    their last commit.
+    """
+    pathspec = []
+    if subdir:
+        pathspec = ['--', subdir]
+    blobs = {}
+    # -z = null byte separate entries, so paths aren't quoted
+    git_cmd = ('%s ls-tree -r -z --full-tree HEAD' % git_exe).split(' ')
+    for entry in git_output(git_cmd + pathspec, cwd=cwd).split('\0'):
+        if not entry:
+            continue
+        # <mode> SP <type> SP <object> TAB <file>
+        meta, f = entry.split('\t', 1)
+        if meta.split(' ')[1] == 'blob':
+            blobs[f] = meta.split(' ')[2]
+
+    # walk back from HEAD until every path has turned up.  Recently
+    # changed paths turn up early, so only the oldest files make this
+    # walk the whole history.
+    last_commits = {}
+    missing = set(blobs)
+    git_cmd = ('%s log -z --name-only --format=format:%%x00%%H' % git_exe).split(' ')
+    if since_keys:
+        git_cmd.append('%s..HEAD' % since_keys[0])
+    else:
+        git_cmd.append('HEAD')
+    metrics.incr('git_processes')
+    git_p = Popen(git_cmd + pathspec, stdout=PIPE, cwd=cwd)
+    commit = None
+    rest = ''
+    while missing:
+        chunk = git_p.stdout.read(65536)
+        if not chunk:
+            break
+        metrics.incr('git_bytes_read', len(chunk))
+        tokens = (rest + chunk).split('\0')
+        rest = tokens.pop()
+        for token in tokens:
+            # each commit is '\0<sha>\n<first path>\0<path>...'
+            if '\n' in token and len(token.split('\n', 1)[0]) in (40, 64):
+                commit, token = token.split('\n', 1)
+            if token in missing:
+                last_commits[token] = commit
+                missing.discard(token)
+    git_p.stdout.close()
+    if git_p.poll() is None:
+        git_p.kill()
+    git_p.wait()
+
+    if since_keys:
+        for f in missing:
+            if f in since_keys[1]:
+                last_commits[f] = since_keys[1][f][1]
+    return dict([(f, (blobs[f], last_commits.get(f))) for f in blobs])
+
+def git_is_ancestor(commit, head, git_exe, cwd):
+    """
+    Whether commit is head or an ancestor of it, False if commit isn't
+    in the repository at cwd (any more).
+    """
+    git_cmd = ('%s merge-base' % git_exe).split(' ')
+    git_cmd.extend([commit, head])
+    return git_output(git_cmd, stderr=PIPE, cwd=cwd).strip() == commit
 
 def git_root(git_exe):
     """
@@ -145,8 +865,40 @@ def git_root(git_exe):
     root for purposes of adjusting paths.
     """
     git_cmd = ('%s rev-parse --show-toplevel' % git_exe).split(' ')
-    git_p = Popen(git_cmd, stdout=PIPE)
-    return git_p.communicate()[0].strip()
+    return git_output(git_cmd).strip()
+
+def git_head(git_exe):
+    """
+    Given that we have chdir'd into a Git controlled dir, get the
+    commit HEAD points to.
+    """
+    git_cmd = ('%s rev-parse HEAD' % git_exe).split(' ')
+    return git_output(git_cmd).strip()
+
+def git_output(git_cmd, stdin_data=None, stderr=None, cwd=None):
+    """
+    Run git_cmd, in cwd if given, feeding it stdin_data if any, and
+    return its output.  Pass stderr=PIPE to keep expected failures
+    quiet.
+    """
+    metrics.incr('git_processes')
+    stdin = None
+    if stdin_data is not None:
+        stdin = PIPE
+    git_p = Popen(git_cmd, stdin=stdin, stdout=PIPE, stderr=stderr, cwd=cwd)
+    out = git_p.communicate(stdin_data)[0]
+    metrics.incr('git_bytes_read', len(out))
+    return out
+
+def repo_relative(root):
+    """
+    Given that prepare has chdir'd us to the git root, get the path of
+    root relative to it, '' if root is the git root.
+    """
+    rel = os.path.relpath(root, os.getcwd())
+    if rel == os.curdir:
+        return ''
+    return rel.replace(os.path.sep, '/')
 
 def prepare(root, git_exe):
     # first we have to get into the git repo to make the git_root work...
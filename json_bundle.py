@@ -0,0 +1,342 @@
+"""
+Write the summary as a bundle of JSON shards and a single viewer page,
+for summarize.py --bundle, rather than one html file per project, dev
+and file.
+
+The bundle in output_dir is
+
+* index.html: the viewer, which renders the same tables as the html
+  pages, fetching only the shards the page being looked at needs.
+  Pages are addressed as index.html#project/NAME, #dev/NAME,
+  #dir/NAME and #file/NAME.
+
+* data/index.json: the tables of the index page, and how many shards
+  the devs, and the directories and files of each project, are split
+  into.
+
+* data/projects/PROJECT.json: the tables of each project.
+
+* data/devs/N.json, data/dirs/PROJECT/N.json and
+  data/files/PROJECT/N.json: the tables of the devs, and of the
+  directories and files of each project, spread over shards of about
+  SHARD_SIZE by the crc32 of their name.
+
+Each project, dev or file is stored as {"tables": [[valtype, noun,
+kind of the rows, limit, [[name, value], ...]], ...]}, with "members"
+listing the devs of a group of devs and "parent" the [kind, name] a
+directory is in.  The viewer needs to be served
+over http (python -m SimpleHTTPServer in output_dir will do to look at
+it locally), since browsers don't let pages fetch from file: urls.
+"""
+
+import os
+import math
+import zlib
+import urllib
+
+import json
+
+import summarize
+import metrics
+
+# about how many projects, devs or files go in a shard
+SHARD_SIZE = 2000
+
+# the kind of page each noun of the summary tables links to
+NOUN_KINDS = {'Projects': 'project', 'Devs': 'dev', 'Directories': 'dir', 'Subdirectories': 'dir', 'Files': 'file'}
+
+def text(s):
+    return s.decode('utf-8', 'replace')
+
+def shard_of(key, n_shards):
+    """
+    The shard key goes in, the same as the viewer's shardOf.
+    """
+    return (zlib.crc32(text(key).encode('utf-8')) & 0xffffffff) % n_shards
+
+def n_shards_for(n_keys):
+    return max(1, int(math.ceil(n_keys / float(SHARD_SIZE))))
+
+def tables(agg_by_single, noun, limit):
+    """
+    The tables summarize.summarize_top_by_valtype would render.
+    """
+    result = []
+    for valtype, nouns in agg_by_single.items():
+        nouns = summarize.sort_agg(nouns, True)
+        if limit:
+            nouns = nouns[:limit]
+        rows = [[text(t[0]), int(round(val))] for t, val in nouns if round(val) > summarize.GLOBAL_CUTOFF]
+        result.append([valtype, noun, NOUN_KINDS[noun], limit, rows])
+    return result
+
+def detail_tables(aggs_with_nouns, detail):
+    result = []
+    for agg, noun, linker, limit in aggs_with_nouns:
+        if detail in agg:
+            result.extend(tables(agg[detail], noun, limit))
+    return result
+
+def bundle_linker(kind):
+    def f(key):
+        return "<a href=\"index.html#%s/%s\">%s</a>" % (kind, urllib.quote(key, ''), key)
+    return f
+
+def write_json(fname, obj):
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fil = open(fname, 'w')
+    json.dump(obj, fil, separators=(',', ':'))
+    fil.close()
+    metrics.incr('shards_written')
+
+def write_project_shards(shard_dir, keys, detail):
+    """
+    Write detail(key) for the project:path keys into shards for each
+    project under shard_dir.  Returns {project: number of shards}.
+    """
+    keys_by_project = {}
+    for key in keys:
+        keys_by_project.setdefault(key.split(':', 1)[0], []).append(key)
+    n_shards = {}
+    for project, project_keys in keys_by_project.items():
+        n_shards[project] = n_shards_for(len(project_keys))
+        shards = [{} for i in range(n_shards[project])]
+        for key in project_keys:
+            shards[shard_of(key, n_shards[project])][text(key)] = detail(key)
+        for i, shard in enumerate(shards):
+            write_json(os.path.join(shard_dir, project, '%d.json' % i), shard)
+    return n_shards
+
+def write_bundle(lines, departed_devs, output_dir, snapshot_dir=None):
+    """
+    Write the bundle for the FileData in lines (and the trends in
+    snapshot_dir, if given) into output_dir.
+    """
+    aggs = summarize.summarize(lines, departed_devs)
+    data_dir = os.path.join(output_dir, 'data')
+
+    subdir, projects, noun, detail_fname, aggs_with_nouns, custom_lines_f = summarize.project_pages(aggs)
+    for project in projects:
+        write_json(os.path.join(data_dir, 'projects', '%s.json' % project),
+                   {'tables': detail_tables(aggs_with_nouns, project)})
+
+    subdir, devs, noun, detail_fname, aggs_with_nouns, custom_lines_f = summarize.dev_pages(aggs, departed_devs)
+    n_dev_shards = n_shards_for(len(devs))
+    dev_shards = [{} for i in range(n_dev_shards)]
+    for devs_key in devs:
+        dev = {'tables': []}
+        the_devs = devs_key.split(' and ')
+        if len(the_devs) > 1:
+            dev['members'] = [text(d) for d in the_devs]
+        elif the_devs[0] not in departed_devs:
+            top_shares = summarize.dev_top_shares(aggs, the_devs[0])[:10]
+            if top_shares:
+                dev['tables'].append(['shared', 'devs', 'dev', 10,
+                                      [[text(d[0]), int(round(val))] for d, val in top_shares
+                                       if round(val) > summarize.GLOBAL_CUTOFF]])
+        dev['tables'].extend(detail_tables(aggs_with_nouns, devs_key))
+        dev_shards[shard_of(devs_key, n_dev_shards)][text(devs_key)] = dev
+    for i, shard in enumerate(dev_shards):
+        write_json(os.path.join(data_dir, 'devs', '%d.json' % i), shard)
+
+    def dir_detail(dirname):
+        kind, parent = summarize.dir_parent(dirname)
+        return {'tables': detail_tables(aggs_with_nouns, dirname), 'parent': [kind, text(parent)]}
+    subdir, dirnames, noun, detail_fname, aggs_with_nouns, custom_lines_f = summarize.dir_pages(aggs)
+    n_dir_shards = write_project_shards(os.path.join(data_dir, 'dirs'), dirnames, dir_detail)
+
+    def file_detail(fname):
+        return {'tables': detail_tables(aggs_with_nouns, fname)}
+    subdir, fnames, noun, detail_fname, aggs_with_nouns, custom_lines_f = summarize.file_pages(aggs)
+    n_file_shards = write_project_shards(os.path.join(data_dir, 'files'), fnames, file_detail)
+
+    trends = None
+    if snapshot_dir:
+        trends = summarize.summarize_trends(snapshot_dir, departed_devs)
+    if trends:
+        summarize.write_page(os.path.join(output_dir, 'trends.html'),
+                             summarize.trends_page_html(trends, bundle_linker('project'), bundle_linker('dev')))
+
+    index_tables = tables(aggs[(summarize.a_valtype, summarize.a_project)], 'Projects', 100) + \
+                   tables(aggs[(summarize.a_valtype, summarize.a_dir)], 'Directories', 100) + \
+                   tables(aggs[(summarize.a_valtype, summarize.a_dev)], 'Devs', 100) + \
+                   tables(aggs[(summarize.a_valtype, summarize.a_fname)], 'Files', 100)
+    write_json(os.path.join(data_dir, 'index.json'),
+               {'cutoff': summarize.GLOBAL_CUTOFF,
+                'trends': bool(trends),
+                'shards': {'devs': n_dev_shards,
+                           'dirs': dict([(text(p), n) for p, n in n_dir_shards.items()]),
+                           'files': dict([(text(p), n) for p, n in n_file_shards.items()])},
+                'tables': index_tables})
+
+    fil = open(os.path.join(output_dir, 'index.html'), 'w')
+    fil.write(VIEWER_HTML)
+    fil.close()
+    metrics.incr('pages_written')
+
+VIEWER_HTML = """<html>
+<head><title>Git By a Bus Summary Results</title></head>
+<body>
+<div id="page">Loading...</div>
+<script type="text/javascript">
+var index = null;
+var loaded = {};
+
+var CRC_TABLE = [];
+for (var n = 0; n < 256; n++) {
+  var c = n;
+  for (var k = 0; k < 8; k++) {
+    c = (c & 1) ? (0xEDB88320 ^ (c >>> 1)) : (c >>> 1);
+  }
+  CRC_TABLE[n] = c >>> 0;
+}
+
+// crc32 of the utf-8 of s, as zlib.crc32
+function crc32(s) {
+  var bytes = unescape(encodeURIComponent(s));
+  var c = 0xFFFFFFFF;
+  for (var i = 0; i < bytes.length; i++) {
+    c = CRC_TABLE[(c ^ bytes.charCodeAt(i)) & 0xFF] ^ (c >>> 8);
+  }
+  return (c ^ 0xFFFFFFFF) >>> 0;
+}
+
+function shardOf(key, nShards) {
+  return crc32(key) % nShards;
+}
+
+function esc(s) {
+  return String(s).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+function show(html) {
+  document.getElementById('page').innerHTML = html;
+}
+
+function load(url, callback) {
+  if (url in loaded) {
+    callback(loaded[url]);
+    return;
+  }
+  var req = new XMLHttpRequest();
+  req.onreadystatechange = function() {
+    if (req.readyState != 4) {
+      return;
+    }
+    if (req.status != 200) {
+      show('<p>Could not load ' + esc(url) + '</p>');
+      return;
+    }
+    loaded[url] = JSON.parse(req.responseText);
+    callback(loaded[url]);
+  };
+  req.open('GET', url, true);
+  req.send(null);
+}
+
+function link(kind, name) {
+  return '<a href="#' + kind + '/' + encodeURIComponent(name) + '">' + esc(name) + '</a>';
+}
+
+function notes() {
+  return '<p>Note: values smaller than ' + index.cutoff + ' have been truncated in the interest of space.</p>' +
+    '<p>Note: the scale of the bars is relative only within, not across, tables.</p>';
+}
+
+function tableHtml(t) {
+  var valtype = t[0], noun = t[1], kind = t[2], limit = t[3], rows = t[4];
+  var html = '<h3>' + (limit ? 'Top ' + limit + ' ' : '') + noun + ' by highest estimated ' + valtype + '</h3>';
+  html += '<table style="width: 80%"><tr><th>' + noun + '</th><th>Total estimated ' + valtype + '</th></tr>';
+  var maxValue = rows.length ? rows[0][1] : 1;
+  for (var i = 0; i < rows.length; i++) {
+    html += '<tr><td>' + link(kind, rows[i][0]) + ' (' + rows[i][1] + ')</td><td style="width: 80%;">' +
+      '<div style="background-color: LightSteelBlue; width: ' + Math.ceil(100 * rows[i][1] / maxValue) + '%;">&nbsp;</div></td></tr>';
+  }
+  return html + '</table>';
+}
+
+function tablesHtml(tables) {
+  var html = '';
+  for (var i = 0; i < tables.length; i++) {
+    html += tableHtml(tables[i]);
+  }
+  return html;
+}
+
+function showIndex() {
+  document.title = 'Git By a Bus Summary Results';
+  var html = '<h1>Git by a Bus Summary Results</h1>';
+  if (index.trends) {
+    html += '<p><a href="trends.html">Trends over time</a></p>';
+  }
+  show(html + notes() + tablesHtml(index.tables));
+}
+
+var NOUNS = {project: 'Project', dev: 'Dev', dir: 'Directory', file: 'File'};
+
+function showDetail(kind, name, detail) {
+  var noun = NOUNS[kind];
+  document.title = 'Git By a Bus Summary Results for ' + noun + ': ' + name;
+  var html = '<p><a href="#">Index</a></p><h1>Git by a Bus Summary Results for ' + noun + ': ' + esc(name) + '</h1>';
+  if (!detail) {
+    show(html + '<p>Not found.</p>');
+    return;
+  }
+  html += notes();
+  if (detail.parent) {
+    html += '<p>In ' + link(detail.parent[0], detail.parent[1]) + '</p>';
+  }
+  if (detail.members) {
+    html += '<p>Common knowledge / risk for devs:</p><ul>';
+    for (var i = 0; i < detail.members.length; i++) {
+      html += '<li>' + link('dev', detail.members[i]) + '</li>';
+    }
+    html += '</ul>';
+  }
+  show(html + tablesHtml(detail.tables));
+}
+
+function route() {
+  var href = window.location.href;
+  var hash = href.indexOf('#') < 0 ? '' : href.substring(href.indexOf('#') + 1);
+  var slash = hash.indexOf('/');
+  if (slash < 0) {
+    showIndex();
+    return;
+  }
+  var kind = hash.substring(0, slash);
+  var name = decodeURIComponent(hash.substring(slash + 1));
+  if (kind == 'project') {
+    load('data/projects/' + encodeURIComponent(name) + '.json', function(detail) {
+      showDetail(kind, name, detail);
+    });
+  } else if (kind == 'dev') {
+    load('data/devs/' + shardOf(name, index.shards.devs) + '.json', function(shard) {
+      showDetail(kind, name, shard[name]);
+    });
+  } else if (kind == 'dir' || kind == 'file') {
+    var shards = index.shards[kind + 's'];
+    var project = name.split(':')[0];
+    if (!(project in shards)) {
+      showDetail(kind, name, null);
+      return;
+    }
+    load('data/' + kind + 's/' + encodeURIComponent(project) + '/' + shardOf(name, shards[project]) + '.json', function(shard) {
+      showDetail(kind, name, shard[name]);
+    });
+  } else {
+    showIndex();
+  }
+}
+
+load('data/index.json', function(data) {
+  index = data;
+  window.onhashchange = route;
+  route();
+});
+</script>
+</body>
+</html>
+"""
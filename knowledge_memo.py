@@ -0,0 +1,118 @@
+"""
+Memoization of knowledge estimates for estimate_unique_knowledge.py.
+
+A model's estimate for a file depends only on the model, its arguments
+and the file's dev experience (with its hunks, if recorded), and many
+files share their history (vendored copies, generated siblings, files
+added in one commit and never touched again), so estimates are looked
+up by a sha1 of those before running the model.
+
+The most recently used estimates are kept in memory, in two
+generations of at most size / 2 each: hits are moved to the new
+generation, and when it fills up the old one is dropped, which keeps
+the recently used ones without any bookkeeping per lookup.  With a
+memo dir, estimates are also stored in memo_dir/knowledge_memo.db
+(SQLite) and reused by later runs.
+"""
+
+import os
+import sqlite3
+import hashlib
+
+from common import dev_shared_to_str, dev_exp_to_str
+import metrics
+
+# number of estimates to keep in memory
+MEMO_SIZE = 100000
+
+# number of new estimates to store before committing them to disk
+MEMO_COMMIT = 10000
+
+def parse_dev_uniq(s):
+    """
+    Parse dev_uniq back the way dev_shared_to_str wrote it, so amounts
+    that were ints come back as ints and the output is the same as
+    without the memo.
+    """
+    dev_uniq = []
+    if not s:
+        return dev_uniq
+    for ddv in s.split(','):
+        segs = ddv.split(':')
+        v = segs[-1]
+        if v.lstrip('-').isdigit():
+            v = int(v)
+        else:
+            v = float(v)
+        dev_uniq.append((segs[:-1], v))
+    return dev_uniq
+
+class KnowledgeMemo(object):
+
+    def __init__(self, size=MEMO_SIZE, memo_dir=None):
+        self.size = size
+        self.new = {}
+        self.old = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.conn = None
+        self.uncommitted = 0
+        if memo_dir:
+            if not os.path.isdir(memo_dir):
+                os.makedirs(memo_dir)
+            self.conn = sqlite3.connect(os.path.join(memo_dir, 'knowledge_memo.db'))
+            self.conn.text_factory = str
+            self.conn.execute('CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, tot_knowledge INTEGER, dev_uniq TEXT)')
+
+    def key(self, spec, fd):
+        parts = [spec, dev_exp_to_str(fd.dev_experience)]
+        if fd.exp_hunks:
+            parts.append(dev_exp_to_str(fd.dev_experience, fd.exp_times, fd.exp_hunks))
+        return hashlib.sha1('\0'.join(parts)).hexdigest()
+
+    def remember(self, key, result):
+        if len(self.new) >= self.size / 2:
+            self.old = self.new
+            self.new = {}
+        self.new[key] = result
+
+    def get(self, key):
+        """
+        Returns (dev_uniq, tot_knowledge) for key, or None if it has
+        to be estimated.
+        """
+        result = self.new.get(key)
+        if result is None:
+            result = self.old.get(key)
+            if result is None and self.conn:
+                row = self.conn.execute('SELECT tot_knowledge, dev_uniq FROM memo WHERE key = ?', (key,)).fetchone()
+                if row:
+                    result = (parse_dev_uniq(row[1]), row[0])
+                    self.disk_hits += 1
+            if result is not None:
+                self.remember(key, result)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.remember(key, result)
+        if self.conn:
+            dev_uniq, tot_knowledge = result
+            self.conn.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?)',
+                              (key, tot_knowledge, dev_shared_to_str(dev_uniq)))
+            self.uncommitted += 1
+            if self.uncommitted >= MEMO_COMMIT:
+                self.conn.commit()
+                self.uncommitted = 0
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+        metrics.incr('memo_hits', self.hits)
+        metrics.incr('memo_disk_hits', self.disk_hits)
+        metrics.incr('memo_misses', self.misses)
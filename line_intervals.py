@@ -0,0 +1,147 @@
+"""
+The lines of a file as a sequence of segments, each a run of lines
+known by the same devs, for the positional knowledge model.
+
+The segments are kept in a treap ordered by position in the file, with
+each node holding the number of lines under it rather than a line
+number, so inserting or removing lines anywhere shifts everything after
+them for free.  Splitting the file at a line and joining the pieces
+back together both take O(log n) in the number of segments, so
+applying a hunk costs O(log n) plus the segments it replaces, however
+long the file is.
+
+What a segment holds is up to the caller, see PositionalModel in
+estimate_unique_knowledge.py.
+"""
+
+import random
+
+class Segment(object):
+
+    __slots__ = ['left', 'right', 'priority', 'length', 'size', 'value']
+
+    def __init__(self, length, value, priority):
+        self.left = None
+        self.right = None
+        self.priority = priority
+        self.length = length
+        # lines in this segment and everything under it
+        self.size = length
+        self.value = value
+
+def size_of(node):
+    if node is None:
+        return 0
+    return node.size
+
+def split(node, n_lines):
+    """
+    Split the segments under node into those holding the first n_lines
+    lines and those holding the rest, splitting the segment line
+    n_lines falls in if need be.  n_lines must be at most the lines
+    there are.  Returns the roots of both.
+    """
+    if node is None:
+        return None, None
+    left_size = 0
+    if node.left is not None:
+        left_size = node.left.size
+    if n_lines <= left_size:
+        first, node.left = split(node.left, n_lines)
+        node.size -= n_lines
+        return first, node
+    right_start = left_size + node.length
+    if n_lines >= right_start:
+        node.right, rest = split(node.right, n_lines - right_start)
+        node.size = n_lines
+        return node, rest
+    # the tail of this segment starts the rest, taking its place above
+    # the segments to its right
+    tail = Segment(right_start - n_lines, node.value, node.priority)
+    tail.right = node.right
+    tail.size = node.size - n_lines
+    node.length = n_lines - left_size
+    node.right = None
+    node.size = n_lines
+    return node, tail
+
+def join(first, rest):
+    """
+    Join the segments under first and rest, all of first's lines
+    coming before rest's.  Returns the root.
+    """
+    if first is None:
+        return rest
+    if rest is None:
+        return first
+    if first.priority > rest.priority:
+        first.size += rest.size
+        first.right = join(first.right, rest)
+        return first
+    rest.size += first.size
+    rest.left = join(first, rest.left)
+    return rest
+
+def segments(node):
+    """
+    Yields (length, value) for each segment under node, first line
+    first.
+    """
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+        else:
+            node = stack.pop()
+            yield node.length, node.value
+            node = node.right
+
+class LineIntervals(object):
+    """
+    The lines of a file, each with a value, as segments of lines with
+    the same value.
+    """
+
+    def __init__(self, seed=0):
+        self.root = None
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return size_of(self.root)
+
+    def replace(self, start, n_lines, make_segments):
+        """
+        Replace the n_lines lines from line start (counting from 0), as
+        far as there are lines, with make_segments(removed), where
+        removed is the lines taken out and the result the lines to put
+        in their place, both as [(length, value), ...].  If there
+        aren't start lines, the new lines go after the last one.
+
+        Returns the number of lines removed.
+        """
+        start = max(0, min(start, len(self)))
+        first, rest = split(self.root, start)
+        removed, rest = split(rest, min(n_lines, size_of(rest)))
+        middle = None
+        last = None
+        for length, value in make_segments(list(segments(removed))):
+            if length <= 0:
+                continue
+            if last is not None and last.value is value:
+                # the last segment added is the rightmost, so no sizes
+                # above it need adjusting but those on the way down
+                node = middle
+                while node is not last:
+                    node.size += length
+                    node = node.right
+                last.length += length
+                last.size += length
+                continue
+            last = Segment(length, value, self.random.random())
+            middle = join(middle, last)
+        self.root = join(join(first, middle), rest)
+        return size_of(removed)
+
+    def segments(self):
+        return segments(self.root)
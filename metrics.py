@@ -0,0 +1,47 @@
+"""
+Cheap run metrics, counted by each stage and collected by the
+git_by_a_bus.py driver into output_dir/metrics.json.
+
+Counters live in a plain module level dictionary, so counting is a
+dictionary update and cheap enough to leave on.  Counters named max_*
+hold a maximum rather than a total, which matters when counters from
+several processes are combined (see combine).
+"""
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+counters = {}
+
+def incr(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+def high(name, v):
+    """
+    Record v in the max_* counter name if it is the highest seen.
+    """
+    if v > counters.get(name, v - 1):
+        counters[name] = v
+
+def combine(into, other):
+    """
+    Add the counters in the dictionary other into the dictionary into.
+    """
+    for name, v in other.items():
+        if name.startswith('max_'):
+            into[name] = max(into.get(name, v), v)
+        else:
+            into[name] = into.get(name, 0) + v
+
+def write(fname):
+    fil = open(fname, 'w')
+    json.dump(counters, fil, indent=2, sort_keys=True)
+    fil.close()
+
+def read(fname):
+    fil = open(fname, 'r')
+    c = json.load(fil)
+    fil.close()
+    return c
@@ -0,0 +1,155 @@
+"""
+Per-stage profiling, turned on with --profile DIRNAME on any stage (or
+--profile on git_by_a_bus.py, which profiles every stage into the
+output dir).
+
+For a stage named stage, writes into DIRNAME:
+
+* stage.pstats: cProfile stats, for python -m pstats or any pstats
+  viewer (not for sampled stages, see below)
+
+* stage.collapsed.txt: sampled call stacks in the collapsed format
+  ('outer;inner;innermost count' per line) that flamegraph.pl and
+  friends read
+
+* stage.profile.txt: a report of the top functions by own and
+  cumulative time
+
+cProfile slows down the python it profiles several times over, which
+is fine for the estimate and summarize stages but not for the long
+gen stage, so gen uses only the sampler, which costs a signal every
+SAMPLE_INTERVAL seconds of cpu time.
+"""
+
+import sys
+import os
+import signal
+import cProfile
+import pstats
+
+from StringIO import StringIO
+
+# seconds of cpu time between samples
+SAMPLE_INTERVAL = 0.005
+
+# number of functions in the reports
+TOP_N = 30
+
+class Sampler(object):
+    """
+    Samples the python call stack every interval seconds of cpu time,
+    counting how often each stack is seen.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = {}
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        # restart interrupted system calls rather than have them fail
+        # with EINTR in the middle of reading from git.
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame:
+            code = frame.f_code
+            stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack.reverse()
+        stack = ';'.join(stack)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write_collapsed(self, fname):
+        fil = open(fname, 'w')
+        for stack, count in sorted(self.stacks.items()):
+            fil.write('%s %d\n' % (stack, count))
+        fil.close()
+
+    def top(self):
+        """
+        Returns ([(samples, function), ...] by own samples,
+        [(samples, function), ...] by cumulative samples), highest
+        first.
+        """
+        own = {}
+        cumulative = {}
+        for stack, count in self.stacks.items():
+            funcs = stack.split(';')
+            own[funcs[-1]] = own.get(funcs[-1], 0) + count
+            # count recursive functions once per stack
+            for func in set(funcs):
+                cumulative[func] = cumulative.get(func, 0) + count
+        own = sorted([(v, k) for k, v in own.items()], reverse=True)
+        cumulative = sorted([(v, k) for k, v in cumulative.items()], reverse=True)
+        return own[:TOP_N], cumulative[:TOP_N]
+
+# the profile in progress, if any
+current = {}
+
+def start(stage, profile_dir, sample_only=False):
+    """
+    Start profiling stage, writing the results into profile_dir when
+    stop is called.  If sample_only, don't use cProfile.
+    """
+    current['stage'] = stage
+    current['profile_dir'] = os.path.abspath(profile_dir)
+    current['sampler'] = Sampler(SAMPLE_INTERVAL)
+    current['profile'] = None
+    if not sample_only:
+        current['profile'] = cProfile.Profile()
+    current['sampler'].start()
+    if current['profile']:
+        current['profile'].enable()
+
+def stop():
+    """
+    Stop profiling and write out the results, if we're profiling.
+    """
+    if not current:
+        return
+    profile = current['profile']
+    sampler = current['sampler']
+    if profile:
+        profile.disable()
+    sampler.stop()
+
+    prefix = os.path.join(current['profile_dir'], current['stage'])
+    sampler.write_collapsed(prefix + '.collapsed.txt')
+
+    report = []
+    own, cumulative = sampler.top()
+    n_samples = sum(sampler.stacks.values())
+    report.append('%s: %d samples, one per %.3fs of cpu time\n' % (current['stage'], n_samples, SAMPLE_INTERVAL))
+    report.append('Top functions by own samples:')
+    report.extend(['%6.1f%%  %s' % (100.0 * v / n_samples, func) for v, func in own])
+    report.append('\nTop functions by cumulative samples:')
+    report.extend(['%6.1f%%  %s' % (100.0 * v / n_samples, func) for v, func in cumulative])
+
+    top_funcs = [func.split(':')[-1] for v, func in own]
+
+    if profile:
+        profile.dump_stats(prefix + '.pstats')
+        for sort in ['tottime', 'cumulative']:
+            out = StringIO()
+            stats = pstats.Stats(prefix + '.pstats', stream=out)
+            stats.strip_dirs().sort_stats(sort).print_stats(TOP_N)
+            report.append('\ncProfile, top functions by %s:' % sort)
+            report.append(out.getvalue())
+            if sort == 'tottime':
+                # (filename, line, function name) keys in sorted order
+                top_funcs = [fcn[2] for fcn in stats.fcn_list]
+
+    fil = open(prefix + '.profile.txt', 'w')
+    fil.write('\n'.join(report) + '\n')
+    fil.close()
+
+    print >> sys.stderr, "Profile of %s written to %s.*, top functions: %s" % \
+          (current['stage'], prefix, ', '.join(top_funcs[:5]))
+    current.clear()
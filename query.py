@@ -0,0 +1,48 @@
+"""
+Answer questions about a finished run from its results database (see
+results_db.py), e.g. the top risk files for a dev in a project:
+
+python query.py output/results.db --dev alice --project myproj
+
+Prints name<TAB>total lines, highest total first.
+
+Run python query.py -h for options.
+"""
+
+import sys
+import time
+
+from optparse import OptionParser
+
+import results_db
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] DB_FNAME")
+    parser.add_option('--by', dest='by', default='file', type='choice', choices=sorted(results_db.QUERY_BY.keys()),
+                      help='What to total by: file, project, dev or group (of devs sharing knowledge), defaults to file')
+    parser.add_option('--value', dest='value', default='risk', type='choice', choices=['risk', 'uniq'],
+                      help='Total the risk or the unique knowledge (uniq), defaults to risk')
+    parser.add_option('--dev', dest='dev', metavar='DEV',
+                      help='Only count knowledge held by groups DEV belongs to')
+    parser.add_option('--project', dest='project', metavar='PROJECT',
+                      help='Only count files in PROJECT')
+    parser.add_option('--path-prefix', dest='path_prefix', metavar='DIR',
+                      help='Only count files under the directory DIR (path relative to the top of the repository)')
+    parser.add_option('--top', dest='top', metavar='N', type='int', default=20,
+                      help='Number of results to print (defaults to 20)')
+    parser.add_option('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                      help='Print how long the query took to stderr')
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('You must pass the database file name.')
+
+    conn = results_db.connect(args[0])
+    start = time.time()
+    rows = results_db.query(conn, options.by, options.value, options.dev, options.project,
+                            options.path_prefix, options.top)
+    if options.verbose:
+        print >> sys.stderr, "Query took %.1fms" % (1000 * (time.time() - start))
+    for name, total in rows:
+        print "%s\t%s" % (name, total)
+    conn.close()
@@ -0,0 +1,125 @@
+"""
+Serve the summary pages from memory rather than writing one html file
+per project, dev and file, for summarize.py --serve.
+
+The results are aggregated once at startup, exactly as summarize.py
+does for the static pages, and every page url is indexed to the page
+it stands for.  Pages are rendered when they are asked for, with the
+same html the static pages have, and the last PAGE_CACHE_SIZE of them
+are kept.  Only needs the python standard library.
+"""
+
+import sys
+import urllib
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import summarize
+
+# number of rendered pages to keep
+PAGE_CACHE_SIZE = 256
+
+class PageCache(object):
+    """
+    Keeps the size most recently used pages.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.pages = {}
+        # url -> tick it was last used at
+        self.used = {}
+        self.tick = 0
+
+    def get(self, url):
+        if url not in self.pages:
+            return None
+        self.tick += 1
+        self.used[url] = self.tick
+        return self.pages[url]
+
+    def put(self, url, page):
+        if len(self.pages) >= self.size:
+            oldest = min([(tick, u) for u, tick in self.used.items()])[1]
+            del self.pages[oldest]
+            del self.used[oldest]
+        self.tick += 1
+        self.pages[url] = page
+        self.used[url] = self.tick
+
+class Report(object):
+    """
+    Renders the page for a url out of the aggregates.
+    """
+
+    def __init__(self, aggs, departed_devs, trends=None):
+        self.aggs = aggs
+        self.trends = trends
+        self.cache = PageCache(PAGE_CACHE_SIZE)
+        # url -> (page kind, detail)
+        self.urls = {}
+        self.kinds = [summarize.project_pages(aggs),
+                      summarize.dev_pages(aggs, departed_devs),
+                      summarize.dir_pages(aggs),
+                      summarize.file_pages(aggs)]
+        for kind in self.kinds:
+            subdir, details, noun, detail_fname, aggs_with_nouns, custom_lines_f = kind
+            for detail in details:
+                self.urls[detail_fname(detail).replace('\\', '/')] = (kind, detail)
+
+    def page(self, url):
+        """
+        Returns the html for url, or None if there is no such page.
+        """
+        page = self.cache.get(url)
+        if page is not None:
+            return page
+        if url == 'index.html':
+            html = summarize.index_html(self.aggs, self.trends)
+        elif url == 'trends.html' and self.trends:
+            html = summarize.trends_page_html(self.trends)
+        elif url in self.urls:
+            kind, detail = self.urls[url]
+            subdir, details, noun, detail_fname, aggs_with_nouns, custom_lines_f = kind
+            html = summarize.detail_page_html(detail, noun, summarize.detail_valtype_args(detail, aggs_with_nouns),
+                                              url, custom_lines_f)
+        else:
+            return None
+        page = '\n'.join(html)
+        self.cache.put(url, page)
+        return page
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.unquote(self.path.split('?')[0]).lstrip('/') or 'index.html'
+        page = self.server.report.page(url)
+        if page is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+def serve(lines, departed_devs, port, snapshot_dir=None):
+    """
+    Serve the pages for the FileData in lines (and the trends in
+    snapshot_dir, if given) on localhost:port until interrupted.
+    """
+    # aggregated here rather than by the caller, since the aggregates
+    # are keyed by this module's summarize functions, which aren't the
+    # same objects as summarize.py's own when it runs as a script
+    trends = None
+    if snapshot_dir:
+        trends = summarize.summarize_trends(snapshot_dir, departed_devs)
+    report = Report(summarize.summarize(lines, departed_devs), departed_devs, trends)
+    server = HTTPServer(('localhost', port), ReportHandler)
+    server.report = report
+    print >> sys.stderr, "Serving the summary at http://localhost:%d/, interrupt to stop" % port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
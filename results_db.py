@@ -0,0 +1,241 @@
+"""
+Load the final FileData (the output of estimate_file_risk.py) into a
+SQLite database, for summarize.py --db and query.py to work from
+without going back to the tsvs.
+
+Run as python results_db.py DB_FNAME < estimate_file_risk.tsv
+
+The knowledge and risk of each group of devs in each file are
+normalized into:
+
+* files: one row per FileData line, with the project and path split
+  out of fname
+
+* devs: one row per dev
+
+* dev_groups: one row per group of 1 or more devs that share knowledge
+  (key is the dev names joined by NUL, as in FileData)
+
+* group_members: the devs in each group
+
+* file_groups: the unique knowledge and risk of each group in each
+  file
+
+with indexes for finding files by project and path prefix and groups
+by dev.  The database is written to DB_FNAME.partial and only moved
+into place once it is complete.
+"""
+
+import sys
+import os
+import sqlite3
+
+from optparse import OptionParser
+
+from common import FileData, dev_exp_to_str
+import metrics
+import profiling
+import stage_io
+
+# number of rows to insert with a single executemany
+INSERT_BATCH = 10000
+
+SCHEMA = """
+CREATE TABLE files (id INTEGER PRIMARY KEY, fname TEXT, project TEXT, path TEXT,
+                    cnt_lines INTEGER, tot_knowledge INTEGER, dev_experience TEXT);
+CREATE TABLE devs (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE dev_groups (id INTEGER PRIMARY KEY, key TEXT UNIQUE, size INTEGER);
+CREATE TABLE group_members (group_id INTEGER, dev_id INTEGER, PRIMARY KEY (group_id, dev_id));
+CREATE TABLE file_groups (file_id INTEGER, group_id INTEGER, uniq REAL, risk REAL);
+"""
+
+# created after loading, which is cheaper than keeping them up to date
+# through the inserts.
+INDEXES = """
+CREATE INDEX files_project_path ON files (project, path);
+CREATE INDEX files_path ON files (path);
+CREATE INDEX group_members_dev ON group_members (dev_id, group_id);
+CREATE INDEX file_groups_file ON file_groups (file_id);
+CREATE INDEX file_groups_group ON file_groups (group_id);
+"""
+
+def connect(db_fname):
+    conn = sqlite3.connect(db_fname)
+    # paths and dev names come back as the byte strings they went in
+    # as
+    conn.text_factory = str
+    return conn
+
+def load(lines, db_fname):
+    """
+    Load the FileData in lines into a new database at db_fname.
+    """
+    if os.path.exists(db_fname):
+        os.remove(db_fname)
+    conn = connect(db_fname)
+    # the database is thrown away if we die partway, so there's no
+    # point paying for a journal
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(SCHEMA)
+
+    dev_ids = {}
+    group_ids = {}
+    batches = {'files': [], 'devs': [], 'dev_groups': [], 'group_members': [], 'file_groups': []}
+    inserts = {'files': 'INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+               'devs': 'INSERT INTO devs VALUES (?, ?)',
+               'dev_groups': 'INSERT INTO dev_groups VALUES (?, ?, ?)',
+               'group_members': 'INSERT INTO group_members VALUES (?, ?)',
+               'file_groups': 'INSERT INTO file_groups VALUES (?, ?, ?, ?)'}
+
+    def flush():
+        for table in ['files', 'devs', 'dev_groups', 'group_members', 'file_groups']:
+            if batches[table]:
+                conn.executemany(inserts[table], batches[table])
+                batches[table] = []
+
+    def group_id(devs):
+        key = '\0'.join(devs)
+        if key not in group_ids:
+            group_ids[key] = len(group_ids) + 1
+            batches['dev_groups'].append((group_ids[key], key, len(devs)))
+            for dev in devs:
+                if dev not in dev_ids:
+                    dev_ids[dev] = len(dev_ids) + 1
+                    batches['devs'].append((dev_ids[dev], dev))
+                batches['group_members'].append((group_ids[key], dev_ids[dev]))
+        return group_ids[key]
+
+    file_id = 0
+    for line in lines:
+        fd = FileData(line)
+        if not fd.fname:
+            continue
+        file_id += 1
+        path = fd.fname.split(':', 1)[-1]
+        batches['files'].append((file_id, fd.fname, fd.project, path, fd.cnt_lines, fd.tot_knowledge,
+                                 dev_exp_to_str(fd.dev_experience, fd.exp_times)))
+        risks = dict([('\0'.join(devs), risk) for devs, risk in fd.dev_risk])
+        for devs, uniq in fd.dev_uniq:
+            batches['file_groups'].append((file_id, group_id(devs), uniq, risks.get('\0'.join(devs))))
+        metrics.incr('files_stored')
+        if len(batches['file_groups']) >= INSERT_BATCH:
+            flush()
+    flush()
+    conn.executescript(INDEXES)
+    # let the query planner know e.g. that a dev is usually a better
+    # filter than a project
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    metrics.incr('devs_stored', len(dev_ids))
+    metrics.incr('dev_groups_stored', len(group_ids))
+
+def file_data_lines(db_fname):
+    """
+    Yields the FileData in the database as tsv lines, in the order they
+    were loaded.
+    """
+    conn = connect(db_fname)
+    files = conn.execute('SELECT id, fname, cnt_lines, tot_knowledge, dev_experience FROM files ORDER BY id')
+    groups = conn.cursor().execute('SELECT fg.file_id, g.key, fg.uniq, fg.risk FROM file_groups fg ' + \
+                                   'JOIN dev_groups g ON g.id = fg.group_id ORDER BY fg.file_id, fg.rowid')
+    next_group = groups.fetchone()
+    for file_id, fname, cnt_lines, tot_knowledge, dev_experience in files:
+        fd = FileData(fname)
+        fd.cnt_lines = cnt_lines
+        fd.tot_knowledge = tot_knowledge
+        while next_group and next_group[0] == file_id:
+            devs = next_group[1].split('\0')
+            fd.dev_uniq.append((devs, next_group[2]))
+            if next_group[3] is not None:
+                fd.dev_risk.append((devs, next_group[3]))
+            next_group = groups.fetchone()
+        line = fd.as_line().split('\t')
+        # the experience is stored as it was in the tsv
+        line[2] = dev_experience or ''
+        yield '\t'.join(line)
+    conn.close()
+
+# what query can total by: (column to group by, joins needed)
+QUERY_BY = {'file': ('f.fname', ''),
+            'project': ('f.project', ''),
+            'group': ("REPLACE(g.key, X'00', ' and ')", 'JOIN dev_groups g ON g.id = fg.group_id'),
+            'dev': ('d.name', 'JOIN group_members gm ON gm.group_id = fg.group_id JOIN devs d ON d.id = gm.dev_id')}
+
+def prefix_end(prefix):
+    """
+    The smallest string bigger than every string starting with prefix,
+    so a prefix match can use the index on path, or None if there
+    isn't one (prefix is all \xff bytes).
+    """
+    prefix = prefix.rstrip('\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def query(conn, by='file', value='risk', dev=None, project=None, path_prefix=None, top=20):
+    """
+    Total value ('risk' or 'uniq') by by ('file', 'project', 'group'
+    or 'dev'), over the groups that include dev if given, and the
+    files in project and under the directory path_prefix if given
+    (so src/server doesn't take in src/server2).
+
+    With by='dev', each dev is credited with the whole value of every
+    group they belong to.
+
+    Returns [(name, total), ...] for the top totals, highest first.
+    """
+    column, joins = QUERY_BY[by]
+    sql = ['SELECT %s, SUM(fg.%s) AS total FROM file_groups fg JOIN files f ON f.id = fg.file_id' % \
+           (column, {'risk': 'risk', 'uniq': 'uniq'}[value]), joins]
+    where = []
+    args = []
+    if dev is not None:
+        # the groups dev is in, through the index on group_members
+        where.append('fg.group_id IN (SELECT gm2.group_id FROM group_members gm2 JOIN devs d2 ' + \
+                     'ON d2.id = gm2.dev_id WHERE d2.name = ?)')
+        args.append(dev)
+    if project is not None:
+        where.append('f.project = ?')
+        args.append(project)
+    if path_prefix:
+        path_prefix = path_prefix.rstrip('/') + '/'
+        where.append('f.path >= ?')
+        args.append(path_prefix)
+        end = prefix_end(path_prefix)
+        if end is not None:
+            where.append('f.path < ?')
+            args.append(end)
+    if where:
+        sql.append('WHERE ' + ' AND '.join(where))
+    sql.append('GROUP BY %s ORDER BY total DESC LIMIT ?' % column)
+    args.append(top)
+    return conn.execute(' '.join(sql), args).fetchall()
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] DB_FNAME < estimate_file_risk.tsv")
+    parser.add_option('--metrics', dest='metrics', metavar='FILE',
+                      help='Write counters about the run as json to FILE')
+    parser.add_option('--profile', dest='profile', metavar='DIRNAME',
+                      help='Profile this stage, writing results_db.pstats, results_db.collapsed.txt and results_db.profile.txt into DIRNAME')
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('You must pass the database file name.')
+
+    if options.profile:
+        profiling.start('results_db', options.profile)
+
+    db_fname = os.path.abspath(args[0])
+    load(stage_io.input_lines(sys.stdin), db_fname + '.partial')
+    os.rename(db_fname + '.partial', db_fname)
+
+    profiling.stop()
+
+    if options.metrics:
+        metrics.write(options.metrics)
+
+    # print to the tsv so if folks look there they get redirected
+    # correctly
+    print "Results database is available at %s" % db_fname
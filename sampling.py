@@ -0,0 +1,272 @@
+"""
+Stratified sampling of the files to analyze, for quick org-level
+numbers on repositories too big to run in full.
+
+gen_file_stats.py picks a fraction of the files in every stratum (a
+directory of a project, pooled with its subdirectories that are too
+small to sample on their own) with a fixed seed, and writes a sample
+manifest describing the strata.  summarize.py reads the manifest back,
+scales each sampled file up to the stratum it stands for, and puts
+bootstrap confidence intervals around the totals.
+
+Run python sampling.py to check on a synthetic population that the
+estimates come out unbiased and the intervals cover the true totals.
+
+The manifest is a tsv of
+
+#sample<TAB>seed<TAB>fraction
+project<TAB>directory<TAB>files in the stratum<TAB>files sampled
+"""
+
+import sys
+import os
+import math
+import random
+import hashlib
+
+# rounds of resampling for the confidence intervals
+BOOTSTRAP_ROUNDS = 200
+
+# two sided confidence of the intervals
+CONFIDENCE = 0.95
+
+# directories expected to have fewer files than this sampled are
+# pooled into their parent, so that every stratum has a few files for
+# the bootstrap to resample
+MIN_EXPECTED_SAMPLED = 5
+
+def pool_directories(counts, fraction):
+    """
+    counts: {directory: files in it} for the directories of a project
+
+    Returns {directory: the directory whose stratum its files are in}.
+    Going deepest first, a directory expected to have fewer than
+    MIN_EXPECTED_SAMPLED files sampled (counting those pooled into it
+    already) is pooled into its parent, up to the top of the project,
+    which takes whatever is left however few.
+    """
+    totals = dict(counts)
+    for d in counts.keys():
+        while d:
+            d = os.path.dirname(d)
+            totals.setdefault(d, 0)
+    pooled = set()
+    for d in sorted(totals.keys(), key=lambda d: (-(d.count('/') + 1 if d else 0), d)):
+        if d and totals[d] * fraction < MIN_EXPECTED_SAMPLED:
+            totals[os.path.dirname(d)] += totals[d]
+            pooled.add(d)
+    strata = {}
+    for d in counts:
+        target = d
+        while target in pooled:
+            target = os.path.dirname(target)
+        strata[d] = target
+    return strata
+
+def stratum_of(strata, project, path):
+    """
+    The stratum of strata (from read_manifest) that project:path was
+    sampled from: that of its directory, or of the nearest directory
+    above it it was pooled into.
+    """
+    d = os.path.dirname(path)
+    while (project, d) not in strata and d:
+        d = os.path.dirname(d)
+    return project, d
+
+def seeded_random(seed, *keys):
+    """
+    A Random seeded from seed and keys, stable across runs and
+    machines.
+    """
+    digest = hashlib.md5('\0'.join([str(seed)] + list(keys))).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+class Sample(object):
+    """
+    Chooses the files to analyze, fraction of each stratum.  Since a
+    5% sample of a 3 file directory is less than a file, directories
+    are pooled into their parents until they are big enough (see
+    pool_directories), and the count for each stratum is rounded up or
+    down at random in proportion, but to no less than two files (or the
+    one file of a stratum of one), so that the bootstrap has more than
+    one file to resample.
+
+    Every stratum is then represented, and each of its files stands for
+    population / sampled files, so the scaled up totals are unbiased
+    whatever the rounding came to.
+    """
+
+    def __init__(self, fraction, size, seed):
+        """
+        Sample fraction of the files, or if size is given, that many
+        files (on average) out of all of them.
+        """
+        self.fraction = fraction
+        self.size = size
+        self.seed = seed
+        # (project, directory) -> (files in stratum, files sampled)
+        self.strata = {}
+
+    def set_population(self, n_files):
+        """
+        Tell the sample how many files there are to choose from in
+        all, before choosing any.
+        """
+        if self.size is not None:
+            self.fraction = min(1.0, float(self.size) / max(n_files, 1))
+
+    def choose(self, project, files, key=None):
+        """
+        Returns the items of files, in their original order, that are
+        in the sample.  key gets the path from an item, if the items
+        aren't paths.
+        """
+        if key is None:
+            key = lambda f: f
+        by_dir = {}
+        for i, f in enumerate(files):
+            by_dir.setdefault(os.path.dirname(key(f)), []).append(i)
+        pooled = pool_directories(dict([(d, len(indexes)) for d, indexes in by_dir.items()]), self.fraction)
+        by_stratum = {}
+        for d, indexes in by_dir.items():
+            by_stratum.setdefault((project, pooled[d]), []).extend(indexes)
+
+        chosen = set()
+        for stratum, indexes in by_stratum.items():
+            indexes.sort()
+            rand = seeded_random(self.seed, *stratum)
+            exact = len(indexes) * self.fraction
+            n = int(math.floor(exact))
+            if rand.random() < exact - n:
+                n += 1
+            n = max(n, min(2, len(indexes)))
+            chosen.update(rand.sample(indexes, n))
+            self.strata[stratum] = (len(indexes), n)
+        return [f for i, f in enumerate(files) if i in chosen]
+
+    def write_manifest(self, fname):
+        fil = open(fname + '.partial', 'w')
+        fil.write('#sample\t%s\t%s\n' % (self.seed, self.fraction))
+        for (project, directory), (population, sampled) in sorted(self.strata.items()):
+            fil.write('%s\t%s\t%d\t%d\n' % (project, directory, population, sampled))
+        fil.close()
+        os.rename(fname + '.partial', fname)
+
+def read_manifest(fname):
+    """
+    Returns (seed, fraction, {(project, directory): (files in
+    stratum, files sampled)}).
+    """
+    fil = open(fname, 'r')
+    tag, seed, fraction = fil.readline().rstrip('\n').split('\t')
+    strata = {}
+    for line in fil:
+        project, directory, population, sampled = line.rstrip('\n').split('\t')
+        strata[(project, directory)] = (int(population), int(sampled))
+    fil.close()
+    return seed, float(fraction), strata
+
+def percentile(sorted_vals, pct):
+    return sorted_vals[min(len(sorted_vals) - 1, int(pct * len(sorted_vals)))]
+
+def estimate_totals(strata_vals, strata, seed):
+    """
+    strata_vals: {stratum: [{key: val, ...} for each sampled file]}
+
+    strata: from read_manifest
+
+    Estimates the total of every key over the whole population, by
+    weighting each sampled file by the number of files of its stratum
+    it stands for, population / sampled.  Returns {key: (estimate, low,
+    high)}, where low and high bound the CONFIDENCE interval found by
+    resampling the files of each stratum BOOTSTRAP_ROUNDS times.
+    Strata that were sampled in full are known exactly, so aren't
+    resampled.
+    """
+    def total(files_by_stratum):
+        totals = {}
+        for stratum, files in files_by_stratum:
+            population, sampled = strata[stratum]
+            weight = float(population) / sampled
+            for vals in files:
+                for k, v in vals.items():
+                    totals[k] = totals.get(k, 0) + weight * v
+        return totals
+
+    # sampled files without any history have no lines, and count as
+    # nothing
+    by_stratum = [(stratum, files + [{}] * (strata[stratum][1] - len(files)))
+                  for stratum, files in sorted(strata_vals.items())]
+    estimates = total(by_stratum)
+
+    rand = seeded_random(seed, 'bootstrap')
+    rounds = dict([(k, []) for k in estimates])
+    for i in range(BOOTSTRAP_ROUNDS):
+        resampled = [(stratum, [files[rand.randrange(len(files))] for f in files])
+                     for stratum, files in by_stratum if strata[stratum][0] > strata[stratum][1]]
+        resampled.extend([(stratum, files) for stratum, files in by_stratum if strata[stratum][0] <= strata[stratum][1]])
+        totals = total(resampled)
+        for k in rounds:
+            rounds[k].append(totals.get(k, 0))
+
+    tail = (1 - CONFIDENCE) / 2
+    results = {}
+    for k, estimate in estimates.items():
+        vals = sorted(rounds[k])
+        results[k] = (estimate, percentile(vals, tail), percentile(vals, 1 - tail))
+    return results
+
+def synthetic_population(rand, n_files):
+    """
+    [(project, path, lines), ...] of n_files files, mostly in
+    directories of 3 files, nested a couple deep, with a few big
+    directories, and the files of each directory of similar sizes.
+    """
+    files = []
+    while len(files) < n_files:
+        project = 'p%d' % rand.randrange(3)
+        directory = 'd%d/s%d' % (rand.randrange(50), rand.randrange(1000))
+        size = 3
+        if not rand.randrange(100):
+            size = 200
+        dir_lines = rand.randint(1, 500)
+        for i in range(size):
+            files.append((project, '%s/f%d.py' % (directory, i), dir_lines + rand.randint(0, 50)))
+    return files[:n_files]
+
+def check_unbiased(n_files=6000, fraction=0.05, n_seeds=20, tolerance=0.03):
+    """
+    Sample a synthetic population with n_seeds seeds, and return
+    (true total, mean estimate, fraction of the intervals that cover
+    the true total, whether the mean is within tolerance of the true
+    total).
+    """
+    population = synthetic_population(random.Random(0), n_files)
+    true_total = sum([lines for project, path, lines in population])
+    by_project = {}
+    for project, path, lines in population:
+        by_project.setdefault(project, []).append((path, lines))
+
+    estimates = []
+    covered = 0
+    for seed in range(n_seeds):
+        sample = Sample(fraction, None, seed)
+        strata_vals = {}
+        for project, files in sorted(by_project.items()):
+            for path, lines in sample.choose(project, files, key=lambda path_lines: path_lines[0]):
+                strata_vals.setdefault(stratum_of(sample.strata, project, path), []).append({'lines': lines})
+        estimate, low, high = estimate_totals(strata_vals, sample.strata, seed)['lines']
+        estimates.append(estimate)
+        if low <= true_total <= high:
+            covered += 1
+    mean = sum(estimates) / len(estimates)
+    return true_total, mean, float(covered) / n_seeds, abs(mean - true_total) <= tolerance * true_total
+
+if __name__ == '__main__':
+    true_total, mean, coverage, unbiased = check_unbiased()
+    print "True total %d, mean estimate %.0f (%+.1f%%), %d%% of the %d%% intervals cover it" % \
+          (true_total, mean, 100 * (mean - true_total) / true_total, round(100 * coverage), round(100 * CONFIDENCE))
+    if not unbiased:
+        print >> sys.stderr, "Error: the estimates are biased"
+        sys.exit(1)
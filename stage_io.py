@@ -0,0 +1,201 @@
+"""
+Compressed stage tsvs.
+
+Every stage reads its input with input_lines, which tells a gzip, bz2
+or xz stream from plain text by its first bytes and decompresses it as
+it goes, so any stage can be fed a compressed tsv on stdin.  The
+decompression runs in a child process, rather than a thread that
+would have to take turns with the stage for the interpreter lock.
+
+The driver compresses what each stage writes (see git_by_a_bus.py
+--compress) with pump, in a thread of the driver, which overlaps with
+the stage running in its own process.
+
+xz needs the lzma module, which only comes with python 3 (or the
+backports.lzma package).
+"""
+
+import sys
+import os
+import re
+import zlib
+import bz2
+import threading
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# bytes to read or compress at a time
+CHUNK_SIZE = 1 << 16
+
+# (first bytes, compression) of the compressions we can read.  bz2 has
+# a digit for the block size after BZh, then the magic of the first
+# block, or of the end of the stream if it's empty.
+MAGIC = [(re.compile(r'\x1f\x8b'), 'gz'),
+         (re.compile(r'BZh[1-9](1AY&SY|\x17rE8P\x90)'), 'bz2'),
+         (re.compile(r'\xfd7zXZ\x00'), 'xz')]
+
+# bytes enough to tell them apart
+HEAD_SIZE = 10
+
+def compressions():
+    """
+    The compressions we can write, as the extensions they get.
+    """
+    if lzma is None:
+        return ['gz', 'bz2']
+    return ['gz', 'bz2', 'xz']
+
+def compressed_fname(fname, compression):
+    if not compression:
+        return fname
+    return fname + '.' + compression
+
+def existing(fname):
+    """
+    fname if it exists, else the first of its compressed versions that
+    does, else None.
+    """
+    for compression in [None, 'gz', 'bz2', 'xz']:
+        if os.path.isfile(compressed_fname(fname, compression)):
+            return compressed_fname(fname, compression)
+    return None
+
+def compression_of(head):
+    for magic, compression in MAGIC:
+        if magic.match(head):
+            return compression
+    return None
+
+def decompressor(compression):
+    if compression == 'gz':
+        # 16 + = expect a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise IOError('the input is xz compressed, which needs the lzma module')
+    return lzma.LZMADecompressor()
+
+def compressor(compression):
+    if compression == 'gz':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == 'bz2':
+        return bz2.BZ2Compressor()
+    return lzma.LZMACompressor()
+
+def decompress_chunks(f, compression, head):
+    """
+    Yields the decompressed contents of f, of which head has already
+    been read, a chunk at a time.  Streams that were concatenated (as
+    by cat a.gz b.gz) are decompressed one after the other.
+    """
+    d = decompressor(compression)
+    data = head
+    while data:
+        try:
+            out = d.decompress(data)
+        except EOFError:
+            # bz2 and xz won't take anything once their stream has
+            # ended, so data starts the next one
+            d = decompressor(compression)
+            continue
+        if out:
+            yield out
+        # what came after the end of the stream, if it has ended
+        data = d.unused_data
+        if data:
+            d = decompressor(compression)
+        else:
+            data = f.read(CHUNK_SIZE)
+
+def input_lines(f):
+    """
+    Yields the lines of f, decompressing them first if f is
+    compressed.
+    """
+    head = f.read(HEAD_SIZE)
+    compression = compression_of(head)
+    if compression is None:
+        if head and not head.endswith('\n'):
+            head += f.readline()
+        for line in head.splitlines(True):
+            yield line
+        for line in f:
+            yield line
+        return
+
+    # decompress in a child process, which has its own copy of
+    # whatever f has buffered, and read its lines from a pipe
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+        status = 0
+        try:
+            out = os.fdopen(w, 'wb', 0)
+            for chunk in decompress_chunks(f, compression, head):
+                out.write(chunk)
+            out.close()
+        except Exception, e:
+            print >> sys.stderr, "Error: can't decompress the input: %s" % e
+            status = 1
+        os._exit(status)
+    os.close(w)
+    pipe = os.fdopen(r, 'rb')
+    for line in pipe:
+        yield line
+    pipe.close()
+    if os.waitpid(pid, 0)[1]:
+        raise IOError("can't decompress the input")
+
+def file_lines(fname):
+    """
+    Yields the lines of the file fname, compressed or not.
+    """
+    fil = open(fname, 'rb')
+    for line in input_lines(fil):
+        yield line
+    fil.close()
+
+class CompressedWriter(object):
+    """
+    A file-like wrapper compressing what is written to it into fil.
+    """
+
+    def __init__(self, fil, compression):
+        self.fil = fil
+        self.compressor = compressor(compression)
+
+    def write(self, s):
+        out = self.compressor.compress(s)
+        if out:
+            self.fil.write(out)
+
+    def close(self):
+        """
+        Finish the stream, leaving fil open.
+        """
+        self.fil.write(self.compressor.flush())
+
+def pump(src, writer):
+    """
+    Start a thread copying everything from the file src, typically the
+    stdout of a stage, to writer until src runs out.  Returns the
+    thread.
+    """
+    def copy():
+        while True:
+            chunk = os.read(src.fileno(), CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        src.close()
+    thread = threading.Thread(target=copy)
+    thread.start()
+    return thread
@@ -1,22 +1,81 @@
 """
 Hackish script to generate summary html for file risk data.
 
-Puts the results in output_dir/{devs,files,projects}, with an index at
-output_dir/index.html
+Puts the results in output_dir/{devs,dirs,files,projects}, with an
+index at output_dir/index.html.  Directories are totalled with their
+subdirectories (see DirTrie).
+
+With --snapshot-dir, also charts the knowledge snapshots there (see
+estimate_unique_knowledge.py --snapshots) per project and dev in
+output_dir/trends.html.
+
+With --serve PORT, serves the same pages from memory on
+localhost:PORT, rendering them as they are asked for (see
+report_server.py), instead of writing them.  With --index-only, only
+output_dir/index.html (and trends.html) is written.  With --bundle,
+writes the results as JSON shards with a single viewer page instead
+(see json_bundle.py).
+
+With --db, reads the FileData from a results database (see
+results_db.py) rather than stdin.
+
+With --aggs FILE, the aggregates are also saved to FILE, and with
+--update OLD_TSV as well, only the lines of the files that changed
+since then are read: those in OLD_TSV (as they were) are taken out of
+the saved aggregates and those on stdin (as they are now) put in, and
+only the pages they touch are rewritten (see update_summary).
+
+With --memory-budget MB, the aggregates are kept in about MB
+megabytes, spilling the rest to sorted runs on disk that are merged and
+sorted again to stream the rows of each page into it, largest first
+(see create_external_summary), however many files and devs there are.
+
+With --sample-manifest, the lines are a sample (see gen_file_stats.py
+--sample-fraction), and only an index of the totals per project and
+dev, scaled up to all the files and with confidence intervals, is
+written.
 """
 
 import sys
 import os
+import re
 import math
 import hashlib
+import marshal
+import heapq
+import struct
+import binascii
+import shutil
+import tempfile
 
 from optparse import OptionParser
 
 from common import FileData, parse_departed_devs
+import metrics
+import profiling
+import sampling
+import results_db
+import stage_io
+from external_sort import ExternalSums, sort_lines, parse_sum
 
 # we cut off any value below this as just noise.
 GLOBAL_CUTOFF = 10
 
+# knowledge snapshots with risk, written by estimate_file_risk.py
+SNAPSHOT_RISK_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})\.risk\.tsv$')
+
+# number of devs to chart trends for, by risk in the latest snapshot
+TREND_DEVS = 20
+
+# the values rolled up by directory
+DIR_VALTYPES = ['unique knowledge', 'orphaned knowledge', 'risk']
+
+# number of directories listed on each dev page
+DEV_TOP_DIRS = 20
+
+# number of projects, directories, devs and files listed on the index
+INDEX_LIMIT = 100
+
 class Dat(object):
     """
     A single piece of data for the aggregate routines to aggregate,
@@ -75,6 +134,22 @@ def a_fname(dat):
 def a_valtype(dat):
     return dat.valtype
 
+def a_dir(dat):
+    return dir_of(dat.file_data.fname)
+
+def a_subdir(dat):
+    # only a key, for the aggregates of the directories right under
+    # each directory that DirTrie.rollup makes
+    return a_dir(dat)
+
+def dir_of(fname):
+    """
+    project:path/to/file -> project:path/to, and project:file ->
+    project: for the top of the project.
+    """
+    project, path = fname.split(':', 1)
+    return "%s:%s" % (project, os.path.dirname(path))
+
 def agg(path, diction, dat):
     """
     dat has the value to aggregate and the data associated with the value (FileData, devs)
@@ -107,6 +182,179 @@ def agg_all(aggs, dat):
 def create_agg(aggs, path):
     aggs[path] = {}
 
+def add_aggs(aggs, delta, sign):
+    """
+    Add the aggregates delta into aggs, times sign (1 or -1).  Every
+    aggregate is a sum, so the aggregates of the whole are the
+    aggregates of its parts added up.
+
+    Totals that come to nothing on taking away are removed, along with
+    the dicts left empty, so files and devs that are gone don't hang
+    around as zeroes.
+    """
+    for k, v in delta.items():
+        if isinstance(v, dict):
+            if k not in aggs:
+                if sign < 0:
+                    continue
+                aggs[k] = {}
+            add_aggs(aggs[k], v, sign)
+            if not aggs[k]:
+                del aggs[k]
+        else:
+            total = aggs.get(k, 0) + sign * v
+            if sign < 0 and abs(total) <= 1e-9 * max(abs(v), 1):
+                aggs.pop(k, None)
+            else:
+                aggs[k] = total
+
+def save_aggs(aggs, departed_devs, fname):
+    """
+    Save aggs, and the departed devs they were made with, to fname,
+    naming the a_* functions of the paths.  marshal rather than pickle,
+    which takes several times as long on the aggregates of a large
+    run, and only the same python reads them back anyway.
+    """
+    named = dict([(tuple([p.__name__ for p in path]), agg) for path, agg in aggs.items()])
+    fil = open(fname + '.partial', 'wb')
+    # the departed devs first, so saved_departed_devs needn't load the
+    # rest
+    marshal.dump(sorted(departed_devs), fil)
+    marshal.dump(named, fil)
+    fil.close()
+    os.rename(fname + '.partial', fname)
+
+def saved_departed_devs(fname):
+    """
+    The departed devs the aggregates in fname were saved with, or None
+    if they can't be read (by this python).
+    """
+    fil = open(fname, 'rb')
+    try:
+        departed_devs = marshal.load(fil)
+    except (ValueError, EOFError, TypeError):
+        departed_devs = None
+    fil.close()
+    return departed_devs
+
+def load_aggs(fname):
+    """
+    Returns (departed_devs, aggs) as saved by save_aggs.
+    """
+    fil = open(fname, 'rb')
+    departed_devs = marshal.load(fil)
+    named = marshal.load(fil)
+    fil.close()
+    return departed_devs, dict([(tuple([globals()[p] for p in path]), agg) for path, agg in named.items()])
+
+class DirNode(object):
+    __slots__ = ['name', 'parent', 'children', 'vals', 'files']
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+        # path component -> DirNode
+        self.children = {}
+        # valtype -> dev -> val, of the files right in this directory
+        # until DirTrie.rollup, then of the whole subtree
+        self.vals = {}
+        # valtype -> fname -> val, of the files right in this
+        # directory
+        self.files = {}
+
+class DirTrie(object):
+    """
+    Totals by directory.  Aggregating with a_dir paths for every level
+    of every file's directory would walk the aggs once per level per
+    value, so instead each value is added once, to the trie node of
+    the directory its file is in, and rollup then adds every
+    directory's totals into its parent's, deepest first.
+    """
+
+    def __init__(self):
+        # project -> DirNode for the top of the project
+        self.projects = {}
+        # the node the last value went to, since a file's values come
+        # together
+        self.last = (None, None)
+
+    def node_for(self, dirname):
+        project, path = dirname.split(':', 1)
+        if project not in self.projects:
+            self.projects[project] = DirNode("%s:" % project, None)
+        node = self.projects[project]
+        if path:
+            for part in path.split('/'):
+                if part not in node.children:
+                    node.children[part] = DirNode("%s%s%s" % (node.name, node.parent and '/' or '', part), node)
+                node = node.children[part]
+        return node
+
+    def add(self, dat):
+        fname = dat.file_data.fname
+        if self.last[0] != fname:
+            self.last = (fname, self.node_for(a_dir(dat)))
+        node = self.last[1]
+        valtype = a_valtype(dat)
+        dev = a_dev(dat)
+        devs = node.vals.setdefault(valtype, {})
+        devs[dev] = devs.get(dev, 0) + dat.val
+        fnames = node.files.setdefault(valtype, {})
+        fnames[fname] = fnames.get(fname, 0) + dat.val
+
+    def nodes(self):
+        """
+        Every node, each before its children.
+        """
+        stack = self.projects.values()
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def rollup(self, aggs):
+        """
+        Total up the subtree of every directory, and add the
+        aggregates by directory to aggs, except for the tops of the
+        projects, which are the same as the aggregates by project:
+
+        (a_valtype, a_dir), (a_dir, a_valtype, a_dev) and (a_dev,
+        a_valtype, a_dir): subtree totals
+
+        (a_dir, a_valtype, a_subdir) and (a_project, a_valtype,
+        a_subdir): subtree totals of the directories right under each
+        directory or project
+
+        (a_dir, a_valtype, a_fname): the files right in each directory
+        """
+        by_valtype = aggs.setdefault((a_valtype, a_dir), {})
+        by_dir = aggs.setdefault((a_dir, a_valtype, a_dev), {})
+        by_dev = aggs.setdefault((a_dev, a_valtype, a_dir), {})
+        subdirs = aggs.setdefault((a_dir, a_valtype, a_subdir), {})
+        project_subdirs = aggs.setdefault((a_project, a_valtype, a_subdir), {})
+        files = aggs.setdefault((a_dir, a_valtype, a_fname), {})
+
+        # children come after their parents, so going backwards every
+        # subtree is added up before its directory is reached
+        for node in reversed(list(self.nodes())):
+            if node.parent is None:
+                continue
+            if node.parent.parent is None:
+                parent_subdirs = project_subdirs.setdefault(node.parent.name[:-1], {})
+            else:
+                parent_subdirs = subdirs.setdefault(node.parent.name, {})
+            by_dir[node.name] = node.vals
+            if node.files:
+                files[node.name] = node.files
+            for valtype, devs in node.vals.items():
+                total = sum(devs.values())
+                by_valtype.setdefault(valtype, {})[node.name] = total
+                parent_subdirs.setdefault(valtype, {})[node.name] = total
+                parent_devs = node.parent.vals.setdefault(valtype, {})
+                for dev, val in devs.items():
+                    parent_devs[dev] = parent_devs.get(dev, 0) + val
+                    by_dev.setdefault(dev, {}).setdefault(valtype, {})[node.name] = val
+
 def split_out_dev_vals(dev_vals, departed_devs):
     """
     Split the values in dev_vals into those that are held by only
@@ -157,59 +405,87 @@ def split_out_dev_vals(dev_vals, departed_devs):
     return [(devs_lookup.split('\0'), val) for devs_lookup, val in lookup.items()], \
            [(dep_lookup.split('\0'), val) for dep_lookup, val in departed_lookup.items()]
 
-def summarize(lines, departed_devs):
+def summarize(lines, departed_devs, agg_paths=None):
     """
     Aggregate the FileData in lines, considering all devs in
     departed_devs to be hit by a bus.
+
+    Only aggregates by agg_paths if given, rather than everything the
+    html pages need.
     """
     
     aggs = {}
 
-    # aggregate by valtype and our top-level objects, used by the
-    # index page.
-    create_agg(aggs, (a_valtype, a_dev))
-    create_agg(aggs, (a_valtype, a_project))
-    create_agg(aggs, (a_valtype, a_fname))
+    if agg_paths:
+        for path in agg_paths:
+            create_agg(aggs, path)
+    else:
+        # aggregate by valtype and our top-level objects, used by the
+        # index page.
+        create_agg(aggs, (a_valtype, a_dev))
+        create_agg(aggs, (a_valtype, a_project))
+        create_agg(aggs, (a_valtype, a_fname))
+
+        # aggregates by project for the projects pages
+        create_agg(aggs, (a_project, a_valtype, a_fname))
+        create_agg(aggs, (a_project, a_valtype, a_dev))
 
-    # aggregates by project for the projects pages
-    create_agg(aggs, (a_project, a_valtype, a_fname))
-    create_agg(aggs, (a_project, a_valtype, a_dev))
+        # aggregates by dev group of 1 or more for the devs pages.
+        create_agg(aggs, (a_dev, a_valtype, a_fname))
+        create_agg(aggs, (a_dev, a_valtype, a_project))
 
-    # aggregates by dev group of 1 or more for the devs pages.
-    create_agg(aggs, (a_dev, a_valtype, a_fname))
-    create_agg(aggs, (a_dev, a_valtype, a_project))
+        # fname aggregate for the files pages
+        create_agg(aggs, (a_fname, a_valtype, a_dev))
 
-    # fname aggregate for the files pages
-    create_agg(aggs, (a_fname, a_valtype, a_dev))
+    # directories are rolled up separately, see DirTrie
+    dirs = None
+    if not agg_paths:
+        dirs = DirTrie()
+
+    def agg_dat(dat):
+        agg_all(aggs, dat)
+        if dirs and dat.valtype in DIR_VALTYPES:
+            dirs.add(dat)
 
     for line in lines:
         fd = FileData(line)
+        metrics.incr('files_summarized')
+        for dat in file_dats(fd, departed_devs):
+            agg_dat(dat)
 
-        # we don't do anything with the risk represented by departed
-        # devs...the risk has already turned out to be real and the
-        # knowledge is gone.
-        dev_risk, _ignored = split_out_dev_vals(fd.dev_risk, departed_devs)
-        for devs, risk in dev_risk:
-            agg_all(aggs, Dat('risk', fd, devs, risk))
-        dev_uniq, dev_orphaned = split_out_dev_vals(fd.dev_uniq, departed_devs)
-        for devs, uniq in dev_uniq:
-            agg_all(aggs, Dat('unique knowledge', fd, devs, uniq))
-            # hack: to get the devs with most shared knowledge to show
-            # up on the devs pages, explode the devs and aggregate
-            # them pairwise here under a different valtype that only
-            # the devs pages will use
-            for dev1 in devs:
-                for dev2 in devs:
-                    # don't double count the similarity
-                    if dev1 < dev2:
-                        agg_all(aggs, Dat('shared knowledge (devs still present)', fd, [dev1, dev2], uniq))
-        # if there is knowledge unique to groups of 1 or more devs who
-        # are all departed, this knowledge is orphaned.
-        for devs, orphaned in dev_orphaned:
-            agg_all(aggs, Dat('orphaned knowledge', fd, devs, orphaned))
+    if dirs:
+        dirs.rollup(aggs)
 
     return aggs
 
+def file_dats(fd, departed_devs):
+    """
+    Yields the Dats to aggregate for the FileData fd, considering all
+    devs in departed_devs to be hit by a bus.
+    """
+    # we don't do anything with the risk represented by departed
+    # devs...the risk has already turned out to be real and the
+    # knowledge is gone.
+    dev_risk, _ignored = split_out_dev_vals(fd.dev_risk, departed_devs)
+    for devs, risk in dev_risk:
+        yield Dat('risk', fd, devs, risk)
+    dev_uniq, dev_orphaned = split_out_dev_vals(fd.dev_uniq, departed_devs)
+    for devs, uniq in dev_uniq:
+        yield Dat('unique knowledge', fd, devs, uniq)
+        # hack: to get the devs with most shared knowledge to show
+        # up on the devs pages, explode the devs and aggregate
+        # them pairwise here under a different valtype that only
+        # the devs pages will use
+        for dev1 in devs:
+            for dev2 in devs:
+                # don't double count the similarity
+                if dev1 < dev2:
+                    yield Dat('shared knowledge (devs still present)', fd, [dev1, dev2], uniq)
+    # if there is knowledge unique to groups of 1 or more devs who
+    # are all departed, this knowledge is orphaned.
+    for devs, orphaned in dev_orphaned:
+        yield Dat('orphaned knowledge', fd, devs, orphaned)
+
 def tupelize(agg, tuples_and_vals, key_list):
     for k, v in agg.items():
         loc_key = list(key_list)
@@ -229,7 +505,7 @@ def sort_agg(agg, desc):
     tuples_and_vals = [t[1] for t in tuples_and_vals]
     return tuples_and_vals
 
-def by_valtype_html(valtype, nouns, noun, linker, limit):
+def by_valtype_head_html(valtype, noun, limit):
     html = []
     limit_str = ''
     if limit:
@@ -237,13 +513,26 @@ def by_valtype_html(valtype, nouns, noun, linker, limit):
     html.append("<h3>%s%s by highest estimated %s</h3>" % (limit_str, noun, valtype))
     html.append("<table style=\"width: 80%\">")
     html.append("<tr><th>%s</th><th>Total estimated %s</th></tr>" % (noun, valtype))
+    return html
+
+def by_valtype_row_html(name, val, linker, max_value):
+    """
+    The table row of name, or None if val is below the cutoff.
+    """
+    if round(val) > GLOBAL_CUTOFF:
+        vals_t = (linker(name),
+                  int(round(val)),
+                  math.ceil(100 * (val / max_value)))
+        return "<tr><td>%s (%d)</td><td style=\"width: 80%%;\"><div style=\"background-color: LightSteelBlue; width: %d%%;\">&nbsp;</div></td></tr>" % vals_t
+    return None
+
+def by_valtype_html(valtype, nouns, noun, linker, limit):
+    html = by_valtype_head_html(valtype, noun, limit)
     max_value = max([n[1] for n in nouns])
     for t, val in nouns:
-        if round(val) > GLOBAL_CUTOFF:
-            vals_t = (linker(t[0]),
-                      int(round(val)),
-                      math.ceil(100 * (val / max_value)))
-            html.append("<tr><td>%s (%d)</td><td style=\"width: 80%%;\"><div style=\"background-color: LightSteelBlue; width: %d%%;\">&nbsp;</div></td></tr>" % vals_t)
+        row = by_valtype_row_html(t[0], val, linker, max_value)
+        if row:
+            html.append(row)
     html.append("</table>") 
     return html
 
@@ -259,6 +548,12 @@ def fname_fname(fname):
 def fname_linker(fname):
     return "<a href=\"%s\">%s</a>" % (fname_fname(fname), fname)    
 
+def dir_fname(dirname):
+    return os.path.join('dirs', "%s.html" % dirname.replace(':', '__').replace('/', '__'))
+
+def dir_linker(dirname):
+    return "<a href=\"%s\">%s</a>" % (dir_fname(dirname), dirname)
+
 def dev_fname(dev):
     return os.path.join('devs', "%s.html" % hashlib.md5(dev).hexdigest())
 
@@ -286,33 +581,51 @@ def add_global_explanation(html):
     html.append('<p>Note: values smaller than %d have been truncated in the interest of space.</p>' % GLOBAL_CUTOFF)
     html.append('<p>Note: the scale of the bars is relative only within, not across, tables.</p>')
 
-def create_index(aggs, output_dir):
+def write_page(fname, html):
+    outfil = open(fname, 'w')
+    outfil.write('\n'.join(html))
+    outfil.close()
+    metrics.incr('pages_written')
+
+def index_html(aggs, trends=None):
     html = []
     html.append("<html>\n<head><title>Git By a Bus Summary Results</title></head>\n<body>")
     html.append("<h1>Git by a Bus Summary Results</h1>")
+    if trends:
+        html.append("<p><a href=\"trends.html\">Trends over time</a></p>")
     add_global_explanation(html)
-    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_project)], 'Projects', project_linker, 100))
-    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_dev)], 'Devs', dev_linker, 100))
-    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_fname)], 'Files', fname_linker, 100))
+    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_project)], 'Projects', project_linker, INDEX_LIMIT))
+    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_dir)], 'Directories', dir_linker, INDEX_LIMIT))
+    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_dev)], 'Devs', dev_linker, INDEX_LIMIT))
+    html.extend(summarize_top_by_valtype(aggs[(a_valtype, a_fname)], 'Files', fname_linker, INDEX_LIMIT))
     html.append("</body>\n</html>")
-    outfil = open(os.path.join(output_dir, 'index.html'), 'w')
-    outfil.write('\n'.join(html))
-    outfil.close()
+    return html
 
-def create_detail_page(detail, noun, valtype_args, fname, custom_lines_f):
+def create_index(aggs, output_dir, trends=None):
+    write_page(os.path.join(output_dir, 'index.html'), index_html(aggs, trends))
+
+def detail_head_html(detail, noun):
     html = []
     html.append("<html>\n<head><title>Git By a Bus Summary Results for %s: %s</title></head>\n<body>" % (noun, detail))
     html.append("<p><a href=\"../index.html\">Index</a></p>")
     html.append("<h1>Git by a Bus Summary Results for %s: %s</h1>" % (noun, detail))
     add_global_explanation(html)
+    return html
+
+def detail_page_html(detail, noun, valtype_args, fname, custom_lines_f):
+    html = detail_head_html(detail, noun)
     if custom_lines_f:
         html.extend(custom_lines_f(detail, noun, valtype_args, fname))
     for vtarg in valtype_args:
         html.extend(summarize_top_by_valtype(vtarg[0], vtarg[1], vtarg[2], vtarg[3]))
     html.append("</body>\n</html>")
-    outfil = open(fname, 'w')
-    outfil.write('\n'.join(html))
-    outfil.close()
+    return html
+
+def create_detail_page(detail, noun, valtype_args, fname, custom_lines_f):
+    write_page(fname, detail_page_html(detail, noun, valtype_args, fname, custom_lines_f))
+
+def detail_valtype_args(detail, aggs_with_nouns):
+    return [(agg[detail], nouns, linker, limit) for agg, nouns, linker, limit in aggs_with_nouns if detail in agg]
 
 def create_detail_pages(output_dir, subdir, details, noun, detail_fname, aggs_with_nouns, custom_lines_f = None):
     try:
@@ -322,18 +635,50 @@ def create_detail_pages(output_dir, subdir, details, noun, detail_fname, aggs_wi
 
     for detail in details:
         outfile_name = os.path.join(output_dir, detail_fname(detail))
-        vt_args = [(agg[detail], nouns, linker, None) for agg, nouns, linker in aggs_with_nouns if detail in agg]
+        vt_args = detail_valtype_args(detail, aggs_with_nouns)
         create_detail_page(detail, noun, vt_args, outfile_name, custom_lines_f)
 
-def create_project_pages(aggs, output_dir):
+# *_pages functions.
+#
+# Return the arguments after output_dir to create_detail_pages for a
+# kind of page: (subdir, details, noun, detail_fname, aggs_with_nouns,
+# custom_lines_f)
+
+def project_pages(aggs):
     dev_agg = aggs[(a_project, a_valtype, a_dev)]
+    dir_agg = aggs[(a_project, a_valtype, a_subdir)]
     fname_agg = aggs[(a_project, a_valtype, a_fname)]
     projects = fname_agg.keys()
-    create_detail_pages(output_dir, 'projects', projects, 'Project', project_fname, [(dev_agg, 'Devs', parent_linker(dev_fname)),                                                                                                                     (fname_agg, 'Files', parent_linker(fname_fname))])
-
+    return 'projects', projects, 'Project', project_fname, [(dev_agg, 'Devs', parent_linker(dev_fname), None),
+                                                            (dir_agg, 'Directories', parent_linker(dir_fname), None),
+                                                            (fname_agg, 'Files', parent_linker(fname_fname), None)], None
 
+def create_project_pages(aggs, output_dir):
+    create_detail_pages(output_dir, *project_pages(aggs))
 
-def create_dev_pages(aggs, output_dir, departed_devs):
+def dev_top_shares(aggs, the_dev):
+    """
+    The devs the_dev shares the most knowledge with, as [([dev],
+    shared), ...], most first.
+    """
+    agg = aggs[(a_valtype, a_dev)]
+    shared_k_agg = agg.get('shared knowledge (devs still present)',{})
+    top_shares = {}
+    for dev_devs, shared in shared_k_agg.items():
+        the_dev_devs = dev_devs.split(' and ')
+        if len(the_dev_devs) != 2:
+            continue
+        dev1, dev2 = the_dev_devs
+        if dev1 == the_dev:
+            top_shares[dev2] = shared
+        elif dev2 == the_dev:
+            top_shares[dev1] = shared
+    top_shares = [(shared, odev) for odev, shared in top_shares.items()]
+    top_shares.sort()
+    top_shares.reverse()
+    return [([ts[1]], ts[0]) for ts in top_shares]
+
+def dev_pages(aggs, departed_devs):
 
     # callback to pass into create_detail_pages to make
     #
@@ -355,37 +700,59 @@ def create_dev_pages(aggs, output_dir, departed_devs):
             the_dev = the_devs[0]
             if the_dev in departed_devs:
                 return html
-            agg = aggs[(a_valtype, a_dev)]
-            shared_k_agg = agg.get('shared knowledge (devs still present)',{})
-            top_shares = {}
-            for dev_devs, shared in shared_k_agg.items():
-                the_dev_devs = dev_devs.split(' and ')
-                if len(the_dev_devs) != 2:
-                    continue
-                dev1, dev2 = the_dev_devs
-                if dev1 == the_dev:
-                    top_shares[dev2] = shared
-                elif dev2 == the_dev:
-                    top_shares[dev1] = shared
-            top_shares = [(shared, odev) for odev, shared in top_shares.items()]
-            top_shares.sort()
-            top_shares.reverse()
-            top_shares = [([ts[1]], ts[0]) for ts in top_shares]
+            top_shares = dev_top_shares(aggs, the_dev)
             if top_shares:
                 html.extend(by_valtype_html('shared', top_shares, 'devs', parent_linker(dev_fname), 10))
                         
         return html
 
     project_agg = aggs[(a_dev, a_valtype, a_project)]
+    dir_agg = aggs[(a_dev, a_valtype, a_dir)]
     fname_agg = aggs[(a_dev, a_valtype, a_fname)]
     devs = fname_agg.keys()
-    create_detail_pages(output_dir, 'devs', devs, 'Dev', dev_fname, [(project_agg, 'Projects', parent_linker(project_fname)),
-                                                                     (fname_agg, 'Files', parent_linker(fname_fname))], dev_custom)
+    return 'devs', devs, 'Dev', dev_fname, [(project_agg, 'Projects', parent_linker(project_fname), None),
+                                            (dir_agg, 'Directories', parent_linker(dir_fname), DEV_TOP_DIRS),
+                                            (fname_agg, 'Files', parent_linker(fname_fname), None)], dev_custom
 
-def create_file_pages(aggs, output_dir):
+def create_dev_pages(aggs, output_dir, departed_devs):
+    create_detail_pages(output_dir, *dev_pages(aggs, departed_devs))
+
+def file_pages(aggs):
     dev_agg = aggs[(a_fname, a_valtype, a_dev)]
     fnames = dev_agg.keys()
-    create_detail_pages(output_dir, 'files', fnames, 'File', fname_fname, [(dev_agg, 'Devs', parent_linker(dev_fname))])
+    return 'files', fnames, 'File', fname_fname, [(dev_agg, 'Devs', parent_linker(dev_fname), None)], None
+
+def create_file_pages(aggs, output_dir):
+    create_detail_pages(output_dir, *file_pages(aggs))
+
+def dir_parent(dirname):
+    """
+    The directory dirname is in, or its project if it's at the top.
+    """
+    parent = dir_of(dirname)
+    if parent.endswith(':'):
+        return 'project', parent[:-1]
+    return 'dir', parent
+
+def dir_pages(aggs):
+
+    # callback to pass into create_detail_pages to link up to the
+    # directory or project the directory is in
+    def dir_custom(dirname, noun, valtype_args, fname):
+        kind, parent = dir_parent(dirname)
+        linker = parent_linker({'project': project_fname, 'dir': dir_fname}[kind])
+        return ["<p>In %s</p>" % linker(parent)]
+
+    dev_agg = aggs[(a_dir, a_valtype, a_dev)]
+    subdir_agg = aggs[(a_dir, a_valtype, a_subdir)]
+    fname_agg = aggs[(a_dir, a_valtype, a_fname)]
+    dirnames = dev_agg.keys()
+    return 'dirs', dirnames, 'Directory', dir_fname, [(dev_agg, 'Devs', parent_linker(dev_fname), None),
+                                                      (subdir_agg, 'Subdirectories', parent_linker(dir_fname), None),
+                                                      (fname_agg, 'Files', parent_linker(fname_fname), None)], dir_custom
+
+def create_dir_pages(aggs, output_dir):
+    create_detail_pages(output_dir, *dir_pages(aggs))
 
 def add_dev_dev(dev_dev, dev1, dev2, diff):
     if dev1 not in dev_dev:
@@ -405,24 +772,542 @@ def read_dev_x_cmp(x_cmp_fname, make_sym):
     fil.close()
     return dev_dev
 
-def create_summary(lines, output_dir, departed_devs):
+def summarize_trends(snapshot_dir, departed_devs):
+    """
+    Aggregate each knowledge snapshot in snapshot_dir by project and
+    dev.
+
+    Returns [(date, aggs), ...], oldest first.
+    """
+    trends = []
+    for snapshot in sorted(os.listdir(snapshot_dir)):
+        m = SNAPSHOT_RISK_RE.match(snapshot)
+        if not m:
+            continue
+        fil = open(os.path.join(snapshot_dir, snapshot), 'r')
+        trends.append((m.group(1), summarize(fil, departed_devs, [(a_valtype, a_project), (a_valtype, a_dev)])))
+        fil.close()
+    return trends
+
+def trend_html(valtype, dated_vals):
+    html = []
+    html.append("<table style=\"width: 80%\">")
+    html.append("<tr><th>Date</th><th>Total estimated %s</th></tr>" % valtype)
+    max_value = max([val for date, val in dated_vals] + [1])
+    for date, val in dated_vals:
+        vals_t = (date,
+                  int(round(val)),
+                  math.ceil(100 * (val / max_value)))
+        html.append("<tr><td>%s (%d)</td><td style=\"width: 80%%;\"><div style=\"background-color: LightSteelBlue; width: %d%%;\">&nbsp;</div></td></tr>" % vals_t)
+    html.append("</table>")
+    return html
+
+def trends_html(trends, agg_path, noun, linker, keys, valtypes):
+    html = []
+    html.append("<h2>%s</h2>" % noun)
+    for key in keys:
+        html.append("<h3>%s</h3>" % linker(key))
+        for valtype in valtypes:
+            dated_vals = [(date, aggs[agg_path].get(valtype, {}).get(key, 0)) for date, aggs in trends]
+            if not [val for date, val in dated_vals if round(val)]:
+                continue
+            html.append("<h4>%s</h4>" % valtype)
+            html.extend(trend_html(valtype, dated_vals))
+    return html
+
+def trends_page_html(trends, project_link=project_linker, dev_link=dev_linker):
+    by_project = (a_valtype, a_project)
+    by_dev = (a_valtype, a_dev)
+    projects = set()
+    for date, aggs in trends:
+        for nouns in aggs[by_project].values():
+            projects.update(nouns.keys())
+    # the devs with the most risk now
+    latest_risk = trends[-1][1][by_dev].get('risk', {})
+    devs = [dev for risk, dev in sorted([(risk, dev) for dev, risk in latest_risk.items()], reverse=True)]
+
+    html = []
+    html.append("<html>\n<head><title>Git By a Bus Trends</title></head>\n<body>")
+    html.append("<p><a href=\"index.html\">Index</a></p>")
+    html.append("<h1>Git by a Bus Trends</h1>")
+    html.append('<p>Note: the scale of the bars is relative only within, not across, tables.</p>')
+    html.append('<p>Note: only the files that exist now are counted, files deleted since a date are left out '
+                'of it, so the totals of past dates are too low.</p>')
+    html.extend(trends_html(trends, by_project, 'Projects', project_link, sorted(projects),
+                            ['risk', 'unique knowledge', 'orphaned knowledge']))
+    html.extend(trends_html(trends, by_dev, 'Top %d Devs' % TREND_DEVS, dev_link, devs[:TREND_DEVS],
+                            ['risk', 'unique knowledge']))
+    html.append("</body>\n</html>")
+    return html
+
+def create_trends_page(trends, output_dir):
+    write_page(os.path.join(output_dir, 'trends.html'), trends_page_html(trends))
+
+def summarize_sample(lines, departed_devs, strata, seed):
+    """
+    Aggregate the sampled FileData in lines by project and dev, and
+    scale the totals up to all the files the sample was drawn from.
+
+    Returns {(a_valtype, a_project or a_dev): {valtype: {project or
+    dev: (estimate, low, high)}}}
+    """
+    paths = [(a_valtype, a_project), (a_valtype, a_dev)]
+    strata_vals = {}
+    for line in lines:
+        fd = FileData(line)
+        metrics.incr('files_summarized')
+        # the totals of the file alone, which the bootstrap resamples
+        vals = {}
+        for dat in file_dats(fd, departed_devs):
+            for path in paths:
+                k = (path, path[0](dat), path[1](dat))
+                vals[k] = vals.get(k, 0) + dat.val
+        stratum = sampling.stratum_of(strata, fd.project, fd.fname.split(':', 1)[1])
+        strata_vals.setdefault(stratum, []).append(vals)
+
+    estimates = {}
+    for (path, valtype, noun), estimate in sampling.estimate_totals(strata_vals, strata, seed).items():
+        estimates.setdefault(path, {}).setdefault(valtype, {})[noun] = estimate
+    return estimates
+
+def by_valtype_estimate_html(valtype, nouns, noun, limit):
+    html = []
+    html.append("<h3>Top %d %s by highest estimated %s</h3>" % (limit, noun, valtype))
+    html.append("<table style=\"width: 80%\">")
+    html.append("<tr><th>%s</th><th>Total estimated %s (%d%% confidence interval)</th></tr>" % \
+                (noun, valtype, round(100 * sampling.CONFIDENCE)))
+    nouns = sorted([(estimate, n) for n, estimate in nouns.items()], reverse=True)[:limit]
+    max_value = max([estimate[2] for estimate, n in nouns] + [1])
+    for (estimate, low, high), n in nouns:
+        if round(estimate) > GLOBAL_CUTOFF:
+            vals_t = (n, int(round(estimate)), int(round(low)), int(round(high)),
+                      math.ceil(100 * (estimate / max_value)))
+            html.append("<tr><td>%s (%d, %d to %d)</td><td style=\"width: 80%%;\"><div style=\"background-color: LightSteelBlue; width: %d%%;\">&nbsp;</div></td></tr>" % vals_t)
+    html.append("</table>")
+    return html
+
+def create_sample_index(estimates, output_dir, strata):
+    population = sum([p for p, s in strata.values()])
+    sampled = sum([s for p, s in strata.values()])
+    html = []
+    html.append("<html>\n<head><title>Git By a Bus Summary Results</title></head>\n<body>")
+    html.append("<h1>Git by a Bus Summary Results</h1>")
+    html.append("<p>Estimated from a sample of %d of %d files, drawn from each directory of each project.  " % \
+                (sampled, population) + \
+                "The ranges are %d%% confidence intervals from %d rounds of resampling.</p>" % \
+                (round(100 * sampling.CONFIDENCE), sampling.BOOTSTRAP_ROUNDS))
+    add_global_explanation(html)
+    for path, noun in [((a_valtype, a_project), 'Projects'), ((a_valtype, a_dev), 'Devs')]:
+        for valtype, nouns in sorted(estimates.get(path, {}).items()):
+            if valtype.startswith('shared knowledge'):
+                continue
+            html.extend(by_valtype_estimate_html(valtype, nouns, noun, 100))
+    html.append("</body>\n</html>")
+    outfil = open(os.path.join(output_dir, 'index.html'), 'w')
+    outfil.write('\n'.join(html))
+    outfil.close()
+    metrics.incr('pages_written')
+
+def create_summary(lines, output_dir, departed_devs, snapshot_dir=None, sample_manifest=None, index_only=False,
+                   aggs_fname=None):
+    if sample_manifest:
+        seed, fraction, strata = sampling.read_manifest(sample_manifest)
+        create_sample_index(summarize_sample(lines, departed_devs, strata, seed), output_dir, strata)
+        return
+    trends = None
+    if snapshot_dir:
+        trends = summarize_trends(snapshot_dir, departed_devs)
     aggs = summarize(lines, departed_devs)
-    create_index(aggs, output_dir)
-    create_project_pages(aggs, output_dir)
-    create_dev_pages(aggs, output_dir, departed_devs)
-    create_file_pages(aggs, output_dir)
-    
+    create_index(aggs, output_dir, trends)
+    if not index_only:
+        create_project_pages(aggs, output_dir)
+        create_dev_pages(aggs, output_dir, departed_devs)
+        create_dir_pages(aggs, output_dir)
+        create_file_pages(aggs, output_dir)
+    if trends:
+        create_trends_page(trends, output_dir)
+    if aggs_fname:
+        save_aggs(aggs, departed_devs, aggs_fname)
+
+def touched_devs(delta):
+    """
+    The devs whose pages the aggregates delta touch: the dev groups in
+    it, and the devs in them, whose pages list who they share the most
+    with.
+    """
+    devs = set(delta[(a_dev, a_valtype, a_fname)].keys())
+    for valtype, dev_vals in delta[(a_valtype, a_dev)].items():
+        devs.update(dev_vals.keys())
+    for dev in list(devs):
+        devs.update(dev.split(' and '))
+    return devs
+
+def update_pages(output_dir, pages, touched):
+    """
+    Like create_detail_pages for the arguments pages (see the *_pages
+    functions), but only writes the pages of the details in touched,
+    and removes those of them that are no longer there.
+    """
+    subdir, details, noun, detail_fname, aggs_with_nouns, custom_lines_f = pages
+    details = set(details)
+    create_detail_pages(output_dir, subdir, [d for d in touched if d in details], noun, detail_fname,
+                        aggs_with_nouns, custom_lines_f)
+    for detail in touched:
+        if detail not in details and os.path.isfile(os.path.join(output_dir, detail_fname(detail))):
+            os.remove(os.path.join(output_dir, detail_fname(detail)))
+
+def update_summary(old_lines, new_lines, output_dir, departed_devs, aggs_fname, snapshot_dir=None):
+    """
+    Update the summary in output_dir, whose aggregates create_summary
+    saved to aggs_fname, for the files whose lines were old_lines
+    (those that are gone, or have changed) and are now new_lines
+    (those that are new, or have changed).
+
+    Takes the aggregates of old_lines out of the saved ones and puts
+    those of new_lines in, then rewrites the index and only the pages
+    of the projects, devs, directories and files the changes touch.
+    """
+    saved_departed, aggs = load_aggs(aggs_fname)
+    if saved_departed != sorted(departed_devs):
+        print >> sys.stderr, "Error: %s was saved with different departed devs, summarize in full instead" % aggs_fname
+        sys.exit(1)
+    old = summarize(old_lines, departed_devs)
+    new = summarize(new_lines, departed_devs)
+    add_aggs(aggs, old, -1)
+    add_aggs(aggs, new, 1)
+
+    trends = None
+    if snapshot_dir:
+        trends = summarize_trends(snapshot_dir, departed_devs)
+    create_index(aggs, output_dir, trends)
+
+    def touched(path):
+        return set(old[path].keys()) | set(new[path].keys())
+
+    update_pages(output_dir, project_pages(aggs), touched((a_project, a_valtype, a_fname)))
+    update_pages(output_dir, dev_pages(aggs, departed_devs), touched_devs(old) | touched_devs(new))
+    # a directory's aggregates include everything under it, so its
+    # parents are touched too
+    update_pages(output_dir, dir_pages(aggs), touched((a_dir, a_valtype, a_dev)))
+    update_pages(output_dir, file_pages(aggs), touched((a_fname, a_valtype, a_dev)))
+    if trends:
+        create_trends_page(trends, output_dir)
+    save_aggs(aggs, departed_devs, aggs_fname)
+
+# the pages of each kind, by the a_* function of what the pages are
+# of: the function returning the arguments to create_detail_pages for
+# them, and the a_* functions of what they list
+PAGE_KINDS = {'a_project': (project_pages, ['a_dev', 'a_subdir', 'a_fname']),
+              'a_dev': (dev_pages, ['a_project', 'a_dir', 'a_fname']),
+              'a_dir': (dir_pages, ['a_dev', 'a_subdir', 'a_fname']),
+              'a_fname': (file_pages, ['a_dev'])}
+
+def external_keys(dat):
+    """
+    The keys create_external_summary adds the value of dat to: (kind,
+    name, listed, valtype, listed_name) for the pages of each kind
+    (see PAGE_KINDS), and ('index', '', listed, valtype, listed_name)
+    for the index, where kind and listed name a_* functions.
+
+    The directory totals are added to every directory the file is
+    under, rather than rolled up as DirTrie does.
+    """
+    valtype = dat.valtype
+    project = a_project(dat)
+    dev = a_dev(dat)
+    fname = a_fname(dat)
+    yield ('index', '', 'a_project', valtype, project)
+    yield ('index', '', 'a_dev', valtype, dev)
+    yield ('index', '', 'a_fname', valtype, fname)
+    yield ('a_project', project, 'a_dev', valtype, dev)
+    yield ('a_project', project, 'a_fname', valtype, fname)
+    yield ('a_dev', dev, 'a_project', valtype, project)
+    yield ('a_dev', dev, 'a_fname', valtype, fname)
+    yield ('a_fname', fname, 'a_dev', valtype, dev)
+    if valtype == 'shared knowledge (devs still present)':
+        # for the devs each dev shares the most with (see
+        # dev_top_shares)
+        for the_dev in dat.dev:
+            yield ('a_dev', the_dev, 'shares', valtype, dev)
+    if valtype in DIR_VALTYPES:
+        dirname = a_dir(dat)
+        if not dirname.endswith(':'):
+            yield ('a_dir', dirname, 'a_fname', valtype, fname)
+        subdir = None
+        # the tops of the projects are left out, as in DirTrie.rollup
+        while not dirname.endswith(':'):
+            yield ('index', '', 'a_dir', valtype, dirname)
+            yield ('a_dir', dirname, 'a_dev', valtype, dev)
+            yield ('a_dev', dev, 'a_dir', valtype, dirname)
+            if subdir:
+                yield ('a_dir', dirname, 'a_subdir', valtype, subdir)
+            subdir = dirname
+            dirname = dir_of(dirname)
+        if subdir:
+            yield ('a_project', project, 'a_subdir', valtype, subdir)
+
+# bytes of a table of an external page to hold in memory before it is
+# spilled to a temporary file
+TABLE_SPOOL_SIZE = 1 << 20
+
+# for desc_sort_key: every byte mapped to 255 - byte
+COMPLEMENT = ''.join([chr(255 - i) for i in range(256)])
+
+def desc_sort_key(val, name):
+    """
+    A str of hex digits that sorts (val, name) pairs in the order
+    sort_agg(agg, True) puts them in: val largest first, then name
+    largest first.
+    """
+    # the bits of a positive double sort as it does, those of a
+    # negative one in reverse; the bits of both are flipped to sort
+    # largest first
+    bits = struct.unpack('>Q', struct.pack('>d', float(val) + 0.0))[0]
+    if bits >> 63:
+        bits = ~bits & 0xffffffffffffffff
+    else:
+        bits |= 1 << 63
+    # 'z' ends the name after any hex digit, so that a name sorts
+    # after the longer names it is the start of
+    return '%016x%sz' % (~bits & 0xffffffffffffffff, binascii.hexlify(name.translate(COMPLEMENT)))
+
+class ExternalPage(object):
+    """
+    The page of detail, of kind (see PAGE_KINDS), written as the rows
+    of its tables are added, largest first, so that however many
+    files it lists, only the tables of one listed kind (of up to
+    TABLE_SPOOL_SIZE bytes each, the rest spilled to tmp_dir) and the
+    devs a dev shares knowledge with are held.
+
+    The tables of a listed kind are written out, once the rows of the
+    next one come, in the order summarize_top_by_valtype writes them.
+    """
+
+    def __init__(self, output_dir, kind, detail, departed_devs, tmp_dir=None):
+        pages_f, listed_names = PAGE_KINDS[kind]
+        self.aggs = {}
+        for name in listed_names:
+            self.aggs[(globals()[kind], a_valtype, globals()[name])] = {}
+        if kind == 'a_dev':
+            # dev_custom looks these up when the page is started
+            self.aggs[(a_valtype, a_dev)] = {}
+            pages = pages_f(self.aggs, departed_devs)
+        else:
+            pages = pages_f(self.aggs)
+        self.subdir, details, self.noun, detail_fname, aggs_with_nouns, self.custom_lines_f = pages
+        self.listed_args = dict(zip(listed_names, [(noun, linker, limit) for agg, noun, linker, limit in aggs_with_nouns]))
+        self.output_dir = output_dir
+        self.kind = kind
+        self.detail = detail
+        self.fname = os.path.join(output_dir, detail_fname(detail))
+        self.tmp_dir = tmp_dir
+        self.fil = None
+        self.listed = None
+        # valtype -> [spooled file, max value, rows]
+        self.tables = {}
+
+    def write_lines(self, fil, html):
+        for line in html:
+            fil.write(line + '\n')
+
+    def start(self):
+        try:
+            os.mkdir(os.path.join(self.output_dir, self.subdir))
+        except:
+            pass
+        self.fil = open(self.fname, 'w')
+        self.write_lines(self.fil, detail_head_html(self.detail, self.noun))
+        if self.custom_lines_f:
+            self.write_lines(self.fil, self.custom_lines_f(self.detail, self.noun, [], self.fname))
+
+    def write_tables(self):
+        for valtype, (spool, max_value, rows) in self.tables.items():
+            spool.write('</table>\n')
+            spool.seek(0)
+            shutil.copyfileobj(spool, self.fil)
+            spool.close()
+        self.tables = {}
+
+    def add(self, listed, valtype, name, val):
+        if listed == 'shares':
+            self.aggs[(a_valtype, a_dev)].setdefault(valtype, {})[name] = val
+            return
+        if self.fil is None:
+            self.start()
+        if listed != self.listed:
+            self.write_tables()
+            self.listed = listed
+        noun, linker, limit = self.listed_args[listed]
+        table = self.tables.get(valtype)
+        if table is None:
+            # the first row of a table is its largest
+            table = self.tables[valtype] = [tempfile.SpooledTemporaryFile(TABLE_SPOOL_SIZE, dir=self.tmp_dir), val, 0]
+            self.write_lines(table[0], by_valtype_head_html(valtype, noun, limit))
+        spool, max_value, rows = table
+        if limit and rows >= limit:
+            return
+        table[2] += 1
+        row = by_valtype_row_html(name, val, linker, max_value)
+        if row:
+            spool.write(row + '\n')
+
+    def close(self):
+        """
+        Write out the page, if it lists anything but the devs a dev
+        shares knowledge with: the pages of create_detail_pages are
+        those of the details with a table of files or devs, which
+        every page with any tables has.
+        """
+        if self.fil is None:
+            return
+        self.write_tables()
+        self.fil.write("</body>\n</html>")
+        self.fil.close()
+        metrics.incr('pages_written')
+
+def create_external_summary(lines, output_dir, departed_devs, memory_budget, tmp_dir=None, snapshot_dir=None):
+    """
+    Like create_summary, but for aggregates that don't fit in memory.
+
+    The values are added up in at most about half of memory_budget
+    bytes, and spilled to sorted runs in tmp_dir beyond that (see
+    external_sort.ExternalSums).  The sums that come out of merging
+    them are sorted again, in the other half, by page, by table and
+    largest first, and the rows streamed into each page in turn (see
+    ExternalPage).  Only the top of the index is kept.
+    """
+    trends = None
+    if snapshot_dir:
+        trends = summarize_trends(snapshot_dir, departed_devs)
+    sums = ExternalSums(memory_budget / 2, tmp_dir)
+    for line in lines:
+        fd = FileData(line)
+        metrics.incr('files_summarized')
+        for dat in file_dats(fd, departed_devs):
+            for key in external_keys(dat):
+                sums.add(key, dat.val)
+
+    # listed -> valtype -> heap of the top (val, name) of the index
+    index_tops = {}
+
+    def page_rows():
+        # kind, detail, the place of listed on the page (the devs a dev
+        # shares with first, for the top of its page), valtype and the
+        # order of the row, joined by NULs so that each page's rows,
+        # and each table's, come out together
+        for (kind, detail, listed_kind, valtype, listed_name), val in sums.items():
+            if kind == 'index':
+                top = index_tops.setdefault(listed_kind, {}).setdefault(valtype, [])
+                if len(top) < INDEX_LIMIT:
+                    heapq.heappush(top, (val, listed_name))
+                elif (val, listed_name) > top[0]:
+                    heapq.heapreplace(top, (val, listed_name))
+                continue
+            place = 0
+            if listed_kind != 'shares':
+                place = PAGE_KINDS[kind][1].index(listed_kind) + 1
+            yield '%s\t%s\t%s\t%r\t%s\n' % ('\0'.join([kind, detail, str(place), valtype, desc_sort_key(val, listed_name)]),
+                                            listed_kind, valtype, val, listed_name)
+
+    page = None
+    for line in sort_lines(page_rows(), memory_budget / 2, tmp_dir):
+        key, listed_kind, valtype, val, listed_name = line.rstrip('\n').split('\t')
+        kind, detail = key.split('\0', 2)[:2]
+        if page is None or (kind, detail) != (page.kind, page.detail):
+            if page:
+                page.close()
+            page = ExternalPage(output_dir, kind, detail, departed_devs, tmp_dir)
+        page.add(listed_kind, valtype, listed_name, parse_sum(val))
+    if page:
+        page.close()
+
+    aggs = {}
+    for name in ['a_project', 'a_dir', 'a_dev', 'a_fname']:
+        aggs[(a_valtype, globals()[name])] = dict([(valtype, dict([(n, v) for v, n in top]))
+                                                   for valtype, top in index_tops.get(name, {}).items()])
+    create_index(aggs, output_dir, trends)
+    if trends:
+        create_trends_page(trends, output_dir)
+
 if __name__ == '__main__':
     parser = OptionParser()
     parser.add_option('-d', '--departed-dev-file', dest='departed_dev_file', metavar='FILE',
                       help='File listing departed devs, one per line')
+    parser.add_option('--snapshot-dir', dest='snapshot_dir', metavar='DIRNAME',
+                      help='Chart the knowledge snapshots in DIRNAME (see estimate_unique_knowledge.py --snapshots) in trends.html')
+    parser.add_option('--db', dest='db', metavar='FILE',
+                      help='Read the FileData from the results database FILE (see results_db.py) instead of stdin')
+    parser.add_option('--sample-manifest', dest='sample_manifest', metavar='FILE',
+                      help='The lines are a sample described by FILE (see gen_file_stats.py --sample-manifest), ' + \
+                      'only write an index of estimated totals')
+    parser.add_option('--index-only', dest='index_only', default=False, action='store_true',
+                      help='Only write index.html (and trends.html), not the project, dev and file pages')
+    parser.add_option('--serve', dest='serve', metavar='PORT', type='int',
+                      help='Serve the pages on localhost:PORT, rendering them on request, instead of writing them')
+    parser.add_option('--bundle', dest='bundle', default=False, action='store_true',
+                      help='Write the results as JSON shards, with a single page to view them, instead of a page per project, dev and file')
+    parser.add_option('--memory-budget', dest='memory_budget', metavar='MB', type='int',
+                      help='Keep the aggregates in about MB megabytes of memory, spilling the rest to disk')
+    parser.add_option('--tmp-dir', dest='tmp_dir', metavar='DIRNAME',
+                      help='Where to spill the aggregates with --memory-budget (defaults to the system\'s temporary directory)')
+    parser.add_option('--aggs', dest='aggs', metavar='FILE',
+                      help='Save the aggregates to FILE, for a later --update')
+    parser.add_option('--update', dest='update', metavar='OLD_TSV',
+                      help='Only the files that changed since the run that saved --aggs are on stdin, and their lines ' + \
+                      'from then in OLD_TSV: update that summary rather than writing it anew')
+    parser.add_option('--metrics', dest='metrics', metavar='FILE',
+                      help='Write counters about the run as json to FILE')
+    parser.add_option('--profile', dest='profile', metavar='DIRNAME',
+                      help='Profile this stage, writing summarize.pstats, summarize.collapsed.txt and summarize.profile.txt into DIRNAME')
     options, args = parser.parse_args()
 
+    if options.serve and options.sample_manifest:
+        parser.error('--serve is not supported for samples')
+    if options.bundle and (options.serve or options.sample_manifest or options.index_only):
+        parser.error('--bundle does not go with --serve, --sample-manifest or --index-only')
+    if options.aggs and (options.serve or options.bundle or options.sample_manifest or options.index_only):
+        parser.error('--aggs does not go with --serve, --bundle, --sample-manifest or --index-only')
+    if options.memory_budget and (options.serve or options.bundle or options.sample_manifest or options.index_only or \
+                                  options.aggs):
+        parser.error('--memory-budget does not go with --serve, --bundle, --sample-manifest, --index-only or --aggs')
+    if options.update and (not options.aggs or options.db):
+        parser.error('--update requires --aggs, and does not go with --db')
+    if not options.serve and len(args) != 1:
+        parser.error('You must pass the output directory.')
+
+    if options.profile:
+        profiling.start('summarize', options.profile)
+
     departed_devs = []
     if options.departed_dev_file:
         parse_departed_devs(options.departed_dev_file, departed_devs)
 
-    create_summary(sys.stdin, args[0], departed_devs)
+    lines = stage_io.input_lines(sys.stdin)
+    if options.db:
+        lines = results_db.file_data_lines(options.db)
+
+    if options.serve:
+        import report_server
+        report_server.serve(lines, departed_devs, options.serve, options.snapshot_dir)
+        sys.exit(0)
+
+    if options.update:
+        update_summary(stage_io.file_lines(options.update), lines, args[0], departed_devs, options.aggs,
+                       options.snapshot_dir)
+    elif options.memory_budget:
+        create_external_summary(lines, args[0], departed_devs, options.memory_budget << 20, options.tmp_dir,
+                                options.snapshot_dir)
+    elif options.bundle:
+        import json_bundle
+        json_bundle.write_bundle(lines, departed_devs, args[0], options.snapshot_dir)
+    else:
+        create_summary(lines, args[0], departed_devs, options.snapshot_dir, options.sample_manifest, options.index_only,
+                       options.aggs)
+
+    profiling.stop()
+
+    if options.metrics:
+        metrics.write(options.metrics)
 
     # print to the tsv so if folks look there they get redirected
     # correctly
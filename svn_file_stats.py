@@ -14,7 +14,8 @@ import re
 
 import pysvn
 
-from common import is_interesting, FileData, safe_author_name
+from common import FileData, safe_author_name
+from file_filter import FileFilter
 
 def gen_stats(root, project, interesting, not_interesting, options):
     """
@@ -41,8 +42,9 @@ def gen_stats(root, project, interesting, not_interesting, options):
     # not our project root
     repo_root = client.root_url_from_path(root)
 
-    interesting_fs = [f[0].repos_path for f in client.list(root, recurse=True) if
-                      is_interesting(f[0].repos_path, interesting, not_interesting) and f[0].kind == pysvn.node_kind.file]
+    file_filter = FileFilter(interesting, not_interesting)
+    interesting_fs = list(file_filter.filter([f[0].repos_path for f in client.list(root, recurse=True) if
+                                              f[0].kind == pysvn.node_kind.file]))
 
     for f in interesting_fs:
         dev_experience = parse_dev_experience(f, client, repo_root)
@@ -0,0 +1,265 @@
+"""
+Sidecar indexes of the stage tsvs, for re-running the chain on just a
+few files (see git_by_a_bus.py --only).
+
+STAGE.tsv.idx has a line per FileData line of STAGE.tsv, with its
+fname, byte offset, length and a sha1 of the line, after a header with
+the size and mtime of the tsv it indexes, so an index made stale by a
+hand edit of the tsv is rebuilt rather than trusted.  The lines are
+read with mmap, and splice writes a new tsv with some of the lines
+replaced, copying the runs of lines in between as they are, along with
+its index.
+
+For looking files up by path (see lookup), STAGE.tsv.paths has the
+same entries sorted by path, with the same header, so a file is found
+with a binary search of it rather than a scan.  It is only built (or
+rebuilt, once the tsv has changed) by the first lookup that needs it.
+
+Only plain tsvs can be indexed, since offsets into a compressed one
+are no use.
+"""
+
+import os
+import re
+import mmap
+import hashlib
+
+def index_fname(tsv):
+    return tsv + '.idx'
+
+def stat_key(tsv):
+    st = os.stat(tsv)
+    return '#\t%d\t%r' % (st.st_size, st.st_mtime)
+
+def line_fname(line):
+    return line.split('\t', 1)[0].rstrip('\r\n')
+
+def line_sha1(line):
+    return hashlib.sha1(line.rstrip('\r\n')).hexdigest()
+
+def write_index(tsv, entries):
+    fil = open(index_fname(tsv) + '.partial', 'w')
+    fil.write(stat_key(tsv) + '\n')
+    for entry in entries:
+        fil.write('%s\t%d\t%d\t%s\n' % entry)
+    fil.close()
+    os.rename(index_fname(tsv) + '.partial', index_fname(tsv))
+
+def build_index(tsv):
+    entries = []
+    offset = 0
+    fil = open(tsv, 'rb')
+    for line in fil:
+        if line.strip():
+            entries.append((line_fname(line), offset, len(line), line_sha1(line)))
+        offset += len(line)
+    fil.close()
+    write_index(tsv, entries)
+    return entries
+
+def index_is_fresh(tsv, fname=None):
+    fname = fname or index_fname(tsv)
+    if not os.path.isfile(fname):
+        return False
+    fil = open(fname, 'r')
+    fresh = fil.readline().rstrip('\n') == stat_key(tsv)
+    fil.close()
+    return fresh
+
+def read_index(tsv):
+    """
+    Returns [(fname, offset, length, sha1), ...] for the lines of tsv,
+    in order, (re)building its index if need be.
+    """
+    if not index_is_fresh(tsv):
+        return build_index(tsv)
+    fil = open(index_fname(tsv), 'r')
+    fil.readline()
+    entries = []
+    for line in fil:
+        fname, offset, length, sha1 = line.rstrip('\n').split('\t')
+        entries.append((fname, int(offset), int(length), sha1))
+    fil.close()
+    return entries
+
+def path_index_fname(tsv):
+    return tsv + '.paths'
+
+def build_path_index(tsv):
+    """
+    Write the index of tsv by path: a line of path, fname, offset and
+    length per entry of its index, sorted.
+    """
+    lines = ['%s\t%s\t%d\t%d\n' % (fname.split(':', 1)[-1], fname, offset, length)
+             for fname, offset, length, sha1 in read_index(tsv)]
+    lines.sort()
+    fil = open(path_index_fname(tsv) + '.partial', 'w')
+    fil.write(stat_key(tsv) + '\n')
+    fil.writelines(lines)
+    fil.close()
+    os.rename(path_index_fname(tsv) + '.partial', path_index_fname(tsv))
+
+def first_line_from(m, start, key):
+    """
+    The offset of the first line of the sorted lines of m from start
+    on that is not less than key, or len(m) if there's none.
+    """
+    lo = start
+    hi = len(m)
+    # lo and hi are always at the start of a line, everything before
+    # lo less than key and nothing from hi on
+    while lo < hi:
+        mid = (lo + hi) // 2
+        line_start = max(m.rfind('\n', 0, mid) + 1, lo)
+        line_end = m.find('\n', line_start)
+        if line_end < 0:
+            line_end = len(m)
+        if m[line_start:line_end] < key:
+            lo = line_end + 1
+        else:
+            hi = line_start
+    return min(lo, len(m))
+
+def lookup(tsv, path, project=None):
+    """
+    The lines of tsv for the file path (relative to the top of its git
+    repository) in project, or in any project if not given, as
+    [(fname, line), ...].
+
+    The entries of path are found with a binary search of the index by
+    path, through mmap, so a lookup in the index of a million files
+    only reads a few pages of it once the index has been built.
+    """
+    if not index_is_fresh(tsv, path_index_fname(tsv)):
+        build_path_index(tsv)
+    idx, m = open_mmap(path_index_fname(tsv))
+    found = []
+    if m:
+        key = path + '\t'
+        at = first_line_from(m, m.find('\n') + 1, key)
+        while at < len(m) and m[at:at + len(key)] == key:
+            end = m.find('\n', at)
+            line_path, fname, offset, length = m[at:end].split('\t')
+            if project is None or fname == '%s:%s' % (project, path):
+                found.append((fname, int(offset), int(length)))
+            at = end + 1
+    idx.close()
+
+    lines = []
+    fil = open(tsv, 'rb')
+    for fname, offset, length in found:
+        fil.seek(offset)
+        lines.append((fname, fil.read(length)))
+    fil.close()
+    return lines
+
+def open_mmap(tsv):
+    """
+    (file, mmap) of tsv, or (file, '') if it's empty, which mmap
+    doesn't do.
+    """
+    fil = open(tsv, 'rb')
+    if not os.fstat(fil.fileno()).st_size:
+        return fil, ''
+    return fil, mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ)
+
+def records(tsv, fnames):
+    """
+    The lines of tsv for the fnames in the set fnames, in the order of
+    tsv.
+    """
+    fil, m = open_mmap(tsv)
+    lines = [m[offset:offset + length] for fname, offset, length, sha1 in read_index(tsv) if fname in fnames]
+    fil.close()
+    return lines
+
+def splice(tsv, new_lines, replaced):
+    """
+    Rewrite tsv with the lines of the fnames in the set replaced taken
+    out, and new_lines put in: each where the line for its fname was
+    (whether or not the fname is in replaced), or at the end if there
+    wasn't one.
+
+    Returns the lines taken out.
+    """
+    entries = read_index(tsv)
+    new_by_fname = {}
+    new_order = []
+    for line in new_lines:
+        if not line.strip():
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        fname = line_fname(line)
+        if fname not in new_by_fname:
+            new_order.append(fname)
+        new_by_fname[fname] = line
+
+    fil, m = open_mmap(tsv)
+    out = open(tsv + '.partial', 'wb')
+    new_entries = []
+    taken_out = []
+    # the run of lines to copy as they are, as (start, end) offsets
+    # into tsv and the offset it goes to
+    run = None
+    written = 0
+
+    def copy_run():
+        if run:
+            out.write(m[run[0]:run[1]])
+
+    for fname, offset, length, sha1 in entries:
+        if fname not in replaced and fname not in new_by_fname:
+            if run and run[1] == offset:
+                run = (run[0], offset + length)
+            else:
+                copy_run()
+                run = (offset, offset + length)
+            new_entries.append((fname, written, length, sha1))
+            written += length
+            continue
+        copy_run()
+        run = None
+        taken_out.append(m[offset:offset + length])
+        line = new_by_fname.pop(fname, None)
+        if line is not None:
+            out.write(line)
+            new_entries.append((fname, written, len(line), line_sha1(line)))
+            written += len(line)
+    copy_run()
+    for fname in new_order:
+        line = new_by_fname.get(fname)
+        if line is not None:
+            out.write(line)
+            new_entries.append((fname, written, len(line), line_sha1(line)))
+            written += len(line)
+    fil.close()
+    out.flush()
+    os.fsync(out.fileno())
+    out.close()
+    os.rename(tsv + '.partial', tsv)
+    write_index(tsv, new_entries)
+    return taken_out
+
+class Selection(object):
+    """
+    The fnames (project:path) to re-run: those any of the regular
+    expressions in patterns matches, and those listed in the file
+    files_fname, one per line.
+    """
+
+    def __init__(self, patterns, files_fname=None):
+        self.patterns = [re.compile(pattern) for pattern in patterns or []]
+        self.fnames = set()
+        if files_fname:
+            fil = open(files_fname, 'r')
+            self.fnames.update([line.strip() for line in fil if line.strip()])
+            fil.close()
+
+    def __call__(self, fname):
+        if fname in self.fnames:
+            return True
+        for pattern in self.patterns:
+            if pattern.search(fname):
+                return True
+        return False